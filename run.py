@@ -1,10 +1,40 @@
+import os
+import json
+import logging
+import csv
+import heapq
+import functools
+import asyncio
+import argparse
+import ipaddress
+import sys
+import urllib.parse
+import zlib
+import re
+import html
+import zipfile
+import hashlib
+import io
+import gzip
+import bz2
+import lzma
+import base64
+import shutil
+import tempfile
+import threading
+import queue
+import time
+from contextlib import contextmanager, nullcontext
+from xml.etree import ElementTree
+from collections import deque
+import numpy as np
 import pandas as pd
 from tkinter import *
 from tkinter import messagebox, simpledialog, ttk, filedialog
-from datetime import datetime
+from datetime import datetime, date
 from tkcalendar import DateEntry
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+import matplotlib
+from matplotlib.figure import Figure
 import seaborn as sns # For nicer plots
 
 # For PDF Export
@@ -14,12 +44,15 @@ from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 
+logger = logging.getLogger(__name__)
+
 # Initialize Excel file and DataFrame
 EXCEL_FILE = '' # This will now be set by the initial book selection
-# Global variable for undo/redo stack
-undo_stack = []
-redo_stack = []
-MAX_UNDO_HISTORY = 10 # Limit undo history to prevent excessive memory usage
+BOOK_COLUMNS = ['Date', 'Ticker', 'Trade_Type', 'Quantity', 'Price', 'Total', 'Notes']
+# Every change to a book is appended to its operation log (book.oplog.jsonl), which backs undo/redo
+MAX_UNDO_HISTORY = 50 # Number of operations that stay undoable, also across restarts
+OPLOG_MAX_BYTES = 4 << 20 # The log is compacted down to its undo/redo history once it grows past this
+operation_log_cache = {} # Log path -> (file signature, records), so a save does not re-parse the whole log
 
 # Global variable for decimal precision settings
 decimal_precision = {
@@ -30,31 +63,169 @@ decimal_precision = {
     'avg_buy_price': 2
 }
 
+# Reporting periods offered for summaries and PDF export
+PERIOD_OPTIONS = ["All Time", "YTD", "MTD", "Custom"]
+
+# Cache of replayed lot state keyed by (book signature, cost-basis method, book length, row position)
+lot_state_cache = {}
+MAX_LOT_STATE_CACHE = 8
+
+# Year-end lot-state checkpoints, persisted next to the book per cost-basis method (see restore_checkpoint)
+CHECKPOINT_COLUMNS = ['Date', 'Ticker', 'Trade_Type', 'Quantity', 'Price'] # The columns lot matching depends on
+checkpoint_cache = {} # Loaded checkpoint files keyed by path
+partition_cache = {} # Closed yearly partitions keyed by (book signature, book length, current year)
+MAX_PARTITION_CACHE = 4
+
+# Round trips (one row per matched lot slice) keyed by (book signature, cost-basis method, FX table, book length)
+ROUND_TRIP_COLUMNS = ['Ticker', 'Entry_Date', 'Exit_Date', 'Quantity', 'Entry_Price', 'Exit_Price', 'PnL', 'Holding_Days']
+round_trip_cache = {}
+MAX_ROUND_TRIP_CACHE = 4
+PERIODS_PER_YEAR = 365 # Daily P&L is annualized over calendar days, markets trade every day
+
+# Realized-gain (tax-lot) report: one row per matched lot slice
+TAX_LOT_COLUMNS = ['Ticker', 'Acquired', 'Sold', 'Quantity', 'Cost_Basis', 'Proceeds', 'Gain', 'Holding_Days', 'Term']
+LONG_TERM_DAYS = 365 # Lots held longer than this are reported as long-term
+
+# Materialized P&L rollups (daily and monthly, per ticker plus a total row per period)
+ROLLUP_VALUES = ['Bought', 'Sold', 'Realized_PnL', 'Trades', 'Volume', 'Position_Change', 'Cost_Change']
+ROLLUP_COLUMNS = ['Period', 'Ticker'] + ROLLUP_VALUES
+ROLLUP_TOTAL = '__TOTAL__' # Ticker value used for the all-tickers row of each period
+rollup_cache = {}
+
+# Per-book settings, persisted next to the book
+DEFAULT_BOOK_SETTINGS = {
+    'price_history_file': '',
+    'cost_basis_method': 'FIFO',
+    'reporting_currency': '', # Empty keeps every value in its ticker's quote currency
+    'fx_rates_file': ''
+}
+book_settings = dict(DEFAULT_BOOK_SETTINGS)
+
+# Local price history used for mark-to-market valuation
+PRICE_HISTORY_COLUMNS = ['ticker', 'timestamp', 'price']
+price_history_cache = {} # Parsed price files keyed by file signature
+MAX_PRICE_HISTORY_CACHE = 4
+
+# Quote assets recognised at the end of bare tickers such as 'BTCUSDT'
+KNOWN_QUOTE_ASSETS = ['USDT', 'USDC', 'BUSD', 'FDUSD', 'TUSD', 'DAI', 'USD', 'EUR', 'GBP', 'TRY', 'IRT', 'BTC', 'ETH', 'BNB']
+fx_cache = {}
+conversion_path_cache = {} # Resolved multi-hop conversion paths keyed by (FX table, from asset, to asset)
+unconvertible_logged = set() # (quote asset, reporting currency) pairs already logged as having no conversion path
+
+# Parsed books keyed by a hash of the file contents (see read_book_file)
+parsed_book_cache = {}
+MAX_PARSED_BOOK_CACHE = 4
+XLSX_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+XLSX_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+XLSX_CHUNK_BYTES = 1 << 20 # Sheet XML decompressed and scanned per step
+XLSX_ROW_PATTERN = re.compile(rb'<row\b[^>]*?(?:/>|>.*?</row>)', re.S)
+# A cell split into (column letters, row number, type, <v> text, simple inline string, anything else)
+XLSX_CELL_PATTERN = re.compile(
+    rb'<c r="([A-Z]+)(\d+)"(?:[^>]*? t="(\w+)")?[^>]*?(?:/>|>(?:<f\b[^>]*?(?:/>|>.*?</f>))?'
+    rb'(?:<v>([^<]*)</v>|<is><t(?:\s[^>]*)?>([^<]*)</t></is>)?(.*?)</c>)', re.S)
+XLSX_VALUE_PATTERN = re.compile(rb'<v(?:\s[^>]*)?>(.*?)</v>', re.S)
+XLSX_TEXT_PATTERN = re.compile(rb'<t(?:\s[^>]*)?>(.*?)</t>', re.S)
+# Cell texts read as missing values, matching pandas.read_excel's defaults
+XLSX_NA_STRINGS = ['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                   '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null']
+
+# Last read or written version of each book, keyed by absolute path (see read_book)
+book_cache = {}
+
+# Record export: rows written per chunk, and compressed CSV extensions
+EXPORT_CHUNK_ROWS = 100000
+EXPORT_CSV_COMPRESSION = {'.csv.gz': 'gzip', '.csv.bz2': 'bz2', '.csv.xz': 'xz', '.csv.zst': 'zstd'}
+
+# Out-of-core analytics: rows read per piece when streaming archives that do not fit in memory
+STREAM_CHUNK_ROWS = 250000
+
+# Rendered chart PNGs, content-addressed by chart inputs and stored next to the book (see chart_png)
+CHART_FIGSIZE = (6, 4) # Inches; shared by the summary window and the PDF so both reuse the same renders
+CHART_DPI = 100
+CHART_CACHE_MAX_BYTES = 32 << 20 # Least recently used charts are evicted beyond this
+CHART_POLL_MS = 50 # How often the summary window checks for charts prepared in the background
+
+# What-if simulation: scenarios listed in the simulation window (all of them are still evaluated)
+SIMULATION_MAX_ROWS = 1000
+SIMULATION_MAX_SCENARIOS = 100000 # Scenario prices per position accepted from the window or the API
+SIMULATION_MAX_TRADES = 1000 # Hypothetical trades per batch
+
+# Rendered display strings of book columns keyed by (book version, book length, column, precision)
+format_cache = {}
+MAX_FORMAT_CACHE = 32
+
+# Book storage: atomic replace, a single writer lock and retained snapshots
+BOOK_LOCK_TIMEOUT = 10 # Seconds a writer waits for another instance to finish saving
+BOOK_LOCK_STALE_SECONDS = 120 # Lock files older than this are left over from a crashed writer
+BOOK_REPLACE_RETRIES = 20
+MAX_BOOK_SNAPSHOTS = 20
+book_thread_lock = threading.RLock()
+book_lock_depth = 0
+
+# Local read API (python run.py --serve book.xlsx)
+API_DEFAULT_PORT = 8765
+API_POLL_INTERVAL = 1.0 # Seconds between checks for changed books, settings and FX/price files
+API_DEFAULT_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+MAX_API_CACHED_RESPONSES = 512 # Per book and version
+API_STATUS_TEXT = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                   500: "Internal Server Error"}
+
+# Fill ingestion from a local file or socket (python run.py --ingest fills.jsonl --book book.xlsx)
+INGEST_BATCH_SIZE = 1000 # Most fills written in one batch
+INGEST_BATCH_INTERVAL = 0.5 # Seconds the first fill of a batch waits for more before the batch is written
+INGEST_POLL_INTERVAL = 0.2 # Seconds between checks of a tailed fill file
+INGEST_VIEW_REFRESH_MS = 1000 # Open windows are refreshed at most this often while ingesting
+INGEST_DEFAULT_PORT = 8766
+INGEST_FIELD_NAMES = {
+    'date': 'Date', 'ticker': 'Ticker', 'symbol': 'Ticker',
+    'trade_type': 'Trade_Type', 'type': 'Trade_Type', 'side': 'Trade_Type',
+    'quantity': 'Quantity', 'qty': 'Quantity', 'price': 'Price', 'notes': 'Notes',
+    'fill_id': 'Fill_Id', 'trade_id': 'Fill_Id', 'exec_id': 'Fill_Id', 'id': 'Fill_Id'
+}
+ingest_job = None # Running GUI ingestion: source, stop event, thread, stats and events queue
+
+# Trade identity index used to detect duplicate trades, persisted next to the book (see get_trade_index)
+TRADE_IDENTITY_COLUMNS = ['Date', 'Ticker', 'Trade_Type', 'Quantity', 'Price']
+trade_index_cache = {}
+
+# Open windows refreshed in place when the book changes, keyed by window
+book_change_listeners = {}
+
 # Global variables to track Toplevel windows
 show_records_window = None
 summary_window = None
 settings_window = None 
 book_selection_window = None 
+ingest_window = None
+simulation_window = None
 
 def init_excel_file(file_path):
     """Initializes the Excel file with required columns if it doesn't exist."""
     global EXCEL_FILE
     EXCEL_FILE = file_path 
+    load_book_settings()
     try:
-        df = pd.read_excel(EXCEL_FILE)
+        columns = read_book_header(EXCEL_FILE) # The header row is enough to validate the structure
         required_columns = ['Date', 'Ticker', 'Trade_Type', 'Quantity', 'Price', 'Total', 'Notes']
-        if not all(col in df.columns for col in required_columns):
+        if not all(col in columns for col in required_columns):
             messagebox.showwarning("File Structure Warning", 
                                    "Existing Excel file is missing required columns. A new structure will be applied.")
             df = pd.DataFrame(columns=required_columns)
-            df.to_excel(EXCEL_FILE, index=False)
+            write_book(df)
     except FileNotFoundError:
         df = pd.DataFrame(columns=['Date', 'Ticker', 'Trade_Type', 'Quantity', 'Price', 'Total', 'Notes'])
-        df.to_excel(EXCEL_FILE, index=False)
+        write_book(df)
     except Exception as e:
         messagebox.showerror("File Error", f"Could not open or initialize Excel file: {e}\nCreating a new empty file.")
         df = pd.DataFrame(columns=['Date', 'Ticker', 'Trade_Type', 'Quantity', 'Price', 'Total', 'Notes'])
-        df.to_excel(EXCEL_FILE, index=False)
+        write_book(df)
+    try:
+        recovery_message = recover_book()
+        if recovery_message:
+            messagebox.showinfo("Book Recovered", recovery_message)
+    except Exception as e:
+        messagebox.showerror("Recovery Error", f"Could not check the book against its operation log: {e}")
 
 
 def load_data():
@@ -62,10 +233,7 @@ def load_data():
     if not EXCEL_FILE:
         return pd.DataFrame(columns=['Date', 'Ticker', 'Trade_Type', 'Quantity', 'Price', 'Total', 'Notes'])
     try:
-        df = pd.read_excel(EXCEL_FILE)
-        df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-        df = df.dropna(subset=['Date'])
-        return df
+        return read_book(EXCEL_FILE)
     except FileNotFoundError:
         messagebox.showerror("Error", f"Excel file '{EXCEL_FILE}' not found. It might have been moved or deleted.")
         init_excel_file(EXCEL_FILE)
@@ -75,113 +243,1076 @@ def load_data():
         return pd.DataFrame(columns=['Date', 'Ticker', 'Trade_Type', 'Quantity', 'Price', 'Total', 'Notes'])
 
 
-def save_data(df, record_undo=True):
-    """Saves DataFrame to Excel and manages undo/redo stack."""
+def write_changes(df, changed_tickers=None):
+    """Saves df as an undoable operation for a caller holding the book lock. Returns None once the book
+    is written, or an error message to show after the lock is released (see report_record_change), since
+    a modal dialog shown under the lock would block every other writer until it is dismissed.
+
+    changed_tickers lists the tickers touched by the change so the P&L rollups can be updated
+    incrementally; None means the change is unknown and the rollups are rebuilt.
+    """
     if not EXCEL_FILE:
-        messagebox.showwarning("Save Error", "No Excel file selected or created. Cannot save data.")
-        return
+        return "No Excel file selected or created. Cannot save data."
+    try:
+        store_book(df, changed_tickers)
+    except Exception as e:
+        return f"Failed to save data to Excel: {e}"
+    return None
 
-    if record_undo:
-        current_df_state = load_data()
-        undo_stack.append(current_df_state.copy())
-        if len(undo_stack) > MAX_UNDO_HISTORY:
-            undo_stack.pop(0)
-        redo_stack.clear()
 
+def report_record_change(error, changed_tickers):
+    """Shows the error of a record change, or announces the change; called once the book lock is released."""
+    if error:
+        messagebox.showerror("Error", error)
+        return False
+    publish_book_change({'tickers': sorted(changed_tickers)})
+    return True
+
+
+def store_book(df, changed_tickers=None, fill_ids=None, operation='op', target=None):
+    """Sorts and writes the book and brings the rollups and the trade identity index up to date.
+
+    The new file is read back before it replaces the book, so the caches hold exactly what was persisted.
+    The change from the current book to it is then appended to the operation log as an operation of the
+    given kind ('op', or 'undo'/'redo' of the target operation) before the book is replaced;
+    operation=None writes the book without logging it. fill_ids maps the external fill ids of newly
+    imported rows to their identity hashes. Errors are raised to the caller.
+    """
+    with book_write_lock():
+        df = df.copy()
+        df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+        df = sort_book(df)
+        previous_signature = book_signature()
+        written = {}
+
+        def commit(temp_path):
+            written['df'], _ = read_sorted_book_file(temp_path)
+            if operation is not None:
+                previous = current_book() if previous_signature else pd.DataFrame(columns=BOOK_COLUMNS)
+                log_operation(previous, written['df'], operation, target)
+
+        write_book(df, before_replace=commit)
+        df = written['df']
+        remember_book(df, book_signature())
+        refresh_rollups(df, previous_signature, changed_tickers)
+        update_trade_index(df, book_signature(), {**remembered_fill_ids(), **(fill_ids or {})})
+        if operation is not None:
+            compact_operation_log()
+
+
+def file_signature(file_path):
+    """Returns a cheap identity of a file version (path, modification time, size), or None if it is missing."""
     try:
-        df.to_excel(EXCEL_FILE, index=False)
-    except Exception as e:
-        messagebox.showerror("Save Error", f"Failed to save data to Excel: {e}")
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+
+def book_signature():
+    """Returns a cheap identity of the current book file, used to key derived-state caches."""
+    return file_signature(EXCEL_FILE)
+
+
+def sidecar_path(suffix):
+    """Returns the path of a file stored next to the current book, e.g. 'book.rollups.json'."""
+    return os.path.splitext(EXCEL_FILE)[0] + suffix
+
+
+def load_book_settings():
+    """Loads the settings stored next to the current book, falling back to the defaults."""
+    global book_settings
+    book_settings = dict(DEFAULT_BOOK_SETTINGS)
+    try:
+        with open(sidecar_path('.settings.json')) as f:
+            book_settings.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+
+
+def save_book_settings():
+    """Writes the current book settings next to the book."""
+    def write(temp_path):
+        with open(temp_path, 'w') as f:
+            json.dump(book_settings, f, indent=2)
+
+    try:
+        atomic_write(sidecar_path('.settings.json'), write)
+    except OSError as e:
+        messagebox.showerror("Settings Error", f"Failed to save book settings: {e}")
+
+
+def sort_book(df):
+    """Returns the book sorted by Date. The sort is stable so same-day trades keep their entry order."""
+    if not df['Date'].is_monotonic_increasing:
+        df = df.sort_values(by='Date', kind='mergesort')
+    return df.reset_index(drop=True)
+
+# --- Book Storage ---
+
+def atomic_write(file_path, write):
+    """Writes a file by calling write(temp_path) and renaming the result over file_path.
+
+    Readers therefore see either the previous or the new file, never a partially written one.
+    """
+    directory = os.path.dirname(os.path.abspath(file_path))
+    base_name, extension = os.path.splitext(os.path.basename(file_path))
+    fd, temp_path = tempfile.mkstemp(prefix=f".{base_name}.", suffix=f".tmp{extension}", dir=directory)
+    os.close(fd)
+    try:
+        write(temp_path)
+        with open(temp_path, 'rb+') as f:
+            os.fsync(f.fileno())
+        replace_file(temp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def replace_file(source_path, target_path):
+    """os.replace with a short retry, since Windows refuses to replace a file another process has open."""
+    for attempt in range(BOOK_REPLACE_RETRIES):
+        try:
+            os.replace(source_path, target_path)
+            return
+        except PermissionError:
+            if attempt == BOOK_REPLACE_RETRIES - 1:
+                raise
+            time.sleep(0.05 * (attempt + 1))
+
+
+@contextmanager
+def book_write_lock(timeout=BOOK_LOCK_TIMEOUT):
+    """Holds the single-writer lock of the current book for the duration of a read-modify-write.
+
+    The lock is a file created exclusively next to the book, so it also excludes other app instances
+    and report jobs. It is re-entrant within this process; locks older than BOOK_LOCK_STALE_SECONDS
+    are assumed to belong to a crashed writer and are broken. Readers never take this lock.
+    """
+    global book_lock_depth
+    with book_thread_lock:
+        if book_lock_depth:
+            book_lock_depth += 1
+            try:
+                yield
+            finally:
+                book_lock_depth -= 1
+            return
+
+        lock_path = sidecar_path('.lock')
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, f"{os.getpid()}\n".encode())
+                os.close(fd)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > BOOK_LOCK_STALE_SECONDS:
+                        os.remove(lock_path)
+                        continue
+                except OSError:
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError("The book is being saved by another instance. Please try again.")
+                time.sleep(0.05)
+
+        book_lock_depth = 1
+        try:
+            yield
+        finally:
+            book_lock_depth = 0
+            try:
+                os.remove(lock_path)
+            except OSError:
+                pass
+
+
+def snapshot_dir():
+    return sidecar_path('.snapshots')
+
+
+def list_book_snapshots():
+    """Returns the versions of the retained book snapshots, oldest first."""
+    try:
+        names = os.listdir(snapshot_dir())
+    except OSError:
+        return []
+    return sorted(int(name[1:-5]) for name in names if name.startswith('v') and name.endswith('.xlsx') and name[1:-5].isdigit())
+
+
+def snapshot_path(version):
+    return os.path.join(snapshot_dir(), f"v{version:08d}.xlsx")
+
+
+def record_snapshot(file_path):
+    """Keeps an immutable copy of a freshly written book under the next version number.
+
+    A hard link is used where the filesystem allows it, so a snapshot costs no extra write.
+    Only the newest MAX_BOOK_SNAPSHOTS versions are retained.
+    """
+    os.makedirs(snapshot_dir(), exist_ok=True)
+    versions = list_book_snapshots()
+    version = (versions[-1] if versions else 0) + 1
+    try:
+        os.link(file_path, snapshot_path(version))
+    except OSError:
+        shutil.copy2(file_path, snapshot_path(version))
+    for old_version in (versions + [version])[:-MAX_BOOK_SNAPSHOTS]:
+        try:
+            os.remove(snapshot_path(old_version))
+        except OSError:
+            pass
+    return version
+
+
+def write_book(df, before_replace=None):
+    """Atomically replaces the book file with df and records the new version as a snapshot.
+
+    before_replace(temp_path) is called with the complete new file before it replaces the book.
+    """
+    def write(temp_path):
+        df.to_excel(temp_path, index=False)
+        if before_replace is not None:
+            before_replace(temp_path)
+        record_snapshot(temp_path)
+
+    with book_write_lock():
+        atomic_write(EXCEL_FILE, write)
+
+
+def xlsx_sheet_path(archive):
+    """Returns the archive member of the first worksheet, as listed in the workbook."""
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    sheet = workbook.find(f'{XLSX_MAIN_NS}sheets/{XLSX_MAIN_NS}sheet')
+    relation_id = sheet.get(f'{XLSX_REL_NS}id')
+    relations = ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    for relation in relations:
+        if relation.get('Id') == relation_id:
+            target = relation.get('Target')
+            return target.lstrip('/') if target.startswith('/') else 'xl/' + target
+    raise KeyError(relation_id)
+
+
+def xlsx_shared_strings(archive):
+    try:
+        root_element = ElementTree.fromstring(archive.read('xl/sharedStrings.xml'))
+    except KeyError:
+        return []
+    return [''.join(text.text or '' for text in item.iter(f'{XLSX_MAIN_NS}t')) for item in root_element]
+
+
+def xlsx_column_index(letters):
+    """0-based column of the letters of a cell reference, e.g. b'C' -> 2."""
+    index = 0
+    for char in letters:
+        index = index * 26 + char - 64
+    return index - 1
+
+
+def xlsx_text(raw):
+    text = raw.decode('utf-8')
+    return html.unescape(text) if '&' in text else text
+
+
+def xlsx_cell_value(cell_type, value, inline, rest, shared_strings):
+    """Decodes one cell the fast pattern could not split (rich text, unusual child elements)."""
+    if cell_type == b'inlineStr':
+        return ''.join(xlsx_text(text) for text in XLSX_TEXT_PATTERN.findall(rest))
+    match = XLSX_VALUE_PATTERN.search(rest)
+    if match is None:
+        return None
+    raw = match.group(1)
+    if cell_type in (b'', b'n'):
+        return float(raw)
+    if cell_type == b's':
+        return shared_strings[int(raw)]
+    if cell_type == b'b':
+        return raw == b'1'
+    return None if cell_type == b'e' else xlsx_text(raw)
+
+
+def scan_xlsx_cells(chunk, shared_strings):
+    """Splits the complete rows in chunk into cells and decodes them column-wise.
+
+    Returns {column letters: (row numbers, numbers, other values)}: numeric cells as a float64 array
+    (NaN elsewhere) and text/boolean cells as an object array (None elsewhere), or None when the
+    column holds no such cell in this chunk. Only cells holding text need per-cell Python work.
+    """
+    cells = XLSX_CELL_PATTERN.findall(chunk)
+    if len(cells) != chunk.count(b'<c ') + chunk.count(b'<c>'):
+        raise ValueError("Unsupported cell layout") # e.g. cells without a reference; pandas reads those
+    if not cells:
+        return {}
+    letters, row_numbers, types, values, inline, rest = (np.array(part) for part in zip(*cells))
+    row_numbers = row_numbers.astype(np.int64)
+
+    numeric = ((types == b'') | (types == b'n')) & (values != b'') & (rest == b'')
+    numbers = np.full(len(cells), np.nan)
+    numbers[numeric] = values[numeric].astype(float)
+
+    others = np.full(len(cells), None, dtype=object)
+    shared = (types == b's') & (rest == b'')
+    if shared.any():
+        others[shared] = np.array(shared_strings, dtype=object)[values[shared].astype(np.int64)]
+    booleans = (types == b'b') & (rest == b'')
+    others[booleans] = values[booleans] == b'1'
+    text = ((types == b'inlineStr') | (types == b'str') | (types == b'd')) & (rest == b'')
+    if text.any():
+        raw = np.where(types[text] == b'inlineStr', inline[text], values[text])
+        decoded = np.char.decode(raw, 'utf-8').astype(object)
+        for position in np.flatnonzero(np.char.find(raw, b'&') >= 0):
+            decoded[position] = html.unescape(decoded[position])
+        others[text] = decoded
+    for position in np.flatnonzero(rest != b''):
+        value = xlsx_cell_value(types[position], values[position], inline[position], rest[position], shared_strings)
+        if type(value) is float:
+            numbers[position] = value
+        else:
+            others[position] = value
+
+    columns = {}
+    order = np.argsort(letters, kind='stable')
+    boundaries = np.flatnonzero(letters[order][1:] != letters[order][:-1]) + 1
+    for group in np.split(order, boundaries):
+        group_others = others[group]
+        columns[bytes(letters[group[0]])] = (row_numbers[group], numbers[group], group_others if pd.notna(group_others).any() else None)
+    return columns
+
+
+def iter_xlsx_chunks(archive):
+    """Yields the first worksheet's XML in pieces that end on a row boundary."""
+    with archive.open(xlsx_sheet_path(archive)) as sheet:
+        pending = b''
+        first = True
+        while True:
+            data = sheet.read(XLSX_CHUNK_BYTES)
+            if first and data and b'<worksheet' not in data[:4096]:
+                raise ValueError("Unsupported worksheet markup") # e.g. prefixed namespaces
+            first = False
+            if not data:
+                if pending:
+                    yield pending
+                return
+            pending += data
+            end = pending.rfind(b'</row>')
+            if end >= 0:
+                yield pending[:end + 6]
+                pending = pending[end + 6:]
+
+
+def read_book_header(file_path):
+    """Returns the column names of a book from its first row, without parsing the rest of the sheet."""
+    try:
+        with zipfile.ZipFile(file_path) as archive:
+            shared_strings = xlsx_shared_strings(archive)
+            for chunk in iter_xlsx_chunks(archive):
+                first_row = XLSX_ROW_PATTERN.search(chunk)
+                if first_row is None:
+                    continue
+                columns = scan_xlsx_cells(first_row.group(0), shared_strings)
+                cells = sorted((xlsx_column_index(letters), others[0]) for letters, (_, _, others) in columns.items() if others is not None)
+                return [str(value) for _, value in cells if value is not None]
+        return []
+    except (zipfile.BadZipFile, KeyError, ValueError, ElementTree.ParseError):
+        # Not a workbook this reader understands (e.g. a legacy .xls); let pandas read it
+        return pd.read_excel(file_path, nrows=0).columns.tolist()
+
+
+def excel_serials_to_datetimes(serials, date1904=False):
+    """Converts Excel date serials (NaN where missing) to datetime64[us] exactly as openpyxl does.
+
+    The time of day is rounded to whole milliseconds in integer arithmetic, so timestamps written with
+    millisecond precision read back unchanged; float day arithmetic would shift some by a microsecond.
+    """
+    serials = np.asarray(serials, dtype=float)
+    valid = ~np.isnan(serials)
+    days = np.floor(serials[valid])
+    milliseconds = np.round((serials[valid] - days) * 86400.0 * 1000.0)
+    if not date1904:
+        days += (serials[valid] > 0) & (serials[valid] < 60) # Excel counts a 29 February 1900 that never existed
+    epoch = np.datetime64('1904-01-01' if date1904 else '1899-12-30', 'us').astype(np.int64)
+    micros = np.full(len(serials), np.iinfo(np.int64).min) # NaT
+    micros[valid] = epoch + days.astype(np.int64) * 86400000000 + milliseconds.astype(np.int64) * 1000
+    return micros.view('datetime64[us]')
+
+
+def typed_book_column(name, numbers, others, date1904=False):
+    """Builds a typed pandas column from a column's numeric cells (float64, NaN elsewhere) and its
+    other cells (object array, None elsewhere; None when there are none)."""
+    if others is not None:
+        others = pd.Series(others, dtype=object)
+        others = others.where(~others.isin(XLSX_NA_STRINGS), None)
+        if others.isna().all():
+            others = None
+    if name == 'Date':
+        dates = pd.Series(excel_serials_to_datetimes(numbers, date1904))
+        if others is not None:
+            dates = dates.fillna(pd.to_datetime(others, errors='coerce'))
+        return dates
+    if name in ('Quantity', 'Price', 'Total'):
+        column = pd.Series(numbers)
+        if others is not None:
+            column = column.fillna(pd.to_numeric(others, errors='coerce').astype(float))
+        return column
+    # Text columns keep whole numbers as int, as pandas.read_excel does
+    column = pd.Series(np.full(len(numbers), np.nan), dtype=object) if others is None else others.where(others.notna(), np.nan)
+    has_number = ~np.isnan(numbers)
+    if has_number.any():
+        found = numbers[has_number]
+        whole = found == np.floor(found)
+        column[has_number] = np.where(whole, found.astype(np.int64).astype(object), found.astype(object))
+    return column
+
+
+def xlsx_date1904(archive):
+    workbook_properties = ElementTree.fromstring(archive.read('xl/workbook.xml')).find(f'{XLSX_MAIN_NS}workbookPr')
+    return workbook_properties is not None and workbook_properties.get('date1904') in ('1', 'true')
+
+
+def xlsx_header(parts):
+    """Returns {column index: (column letters, name)} from the first-row cells of scanned sheet parts."""
+    header = {}
+    for letters, chunks in parts.items():
+        rows, _, others = chunks[0]
+        if len(rows) and rows[0] == 1 and others is not None and others[0] is not None:
+            header[xlsx_column_index(letters)] = (letters, str(others[0]))
+    return header
+
+
+def xlsx_book_columns(header, parts, first_row, last_row, date1904=False):
+    """Assembles the typed book columns of sheet rows first_row..last_row from scanned sheet parts."""
+    columns = {}
+    size = last_row - first_row + 1
+    for index in range(max(header) + 1):
+        letters, name = header.get(index, (None, f"Unnamed: {index}"))
+        numbers = np.full(size, np.nan)
+        others = None
+        for rows, chunk_numbers, chunk_others in parts.get(letters, []):
+            keep = (rows >= first_row) & (rows <= last_row)
+            numbers[rows[keep] - first_row] = chunk_numbers[keep]
+            if chunk_others is not None:
+                if others is None:
+                    others = np.full(size, None, dtype=object)
+                others[rows[keep] - first_row] = chunk_others[keep]
+        if others is not None and not pd.notna(others).any():
+            others = None
+        columns[name] = typed_book_column(name, numbers, others, date1904)
+    return columns
+
+
+def parse_book_bytes(data):
+    """Parses a book workbook straight into typed columns, streaming the sheet XML in chunks."""
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            date1904 = xlsx_date1904(archive)
+            shared_strings = xlsx_shared_strings(archive)
+            parts = {}
+            for chunk in iter_xlsx_chunks(archive):
+                for letters, column in scan_xlsx_cells(chunk, shared_strings).items():
+                    parts.setdefault(letters, []).append(column)
+    except (zipfile.BadZipFile, KeyError, ValueError, ElementTree.ParseError):
+        return pd.read_excel(io.BytesIO(data))
+
+    header = xlsx_header(parts)
+    if not header:
+        return pd.DataFrame()
+    last_row = 1
+    for chunks in parts.values():
+        for rows, numbers, others in chunks:
+            filled = ~np.isnan(numbers) if others is None else ~np.isnan(numbers) | pd.notna(others)
+            if filled.any():
+                last_row = max(last_row, int(rows[filled].max())) # Trailing empty rows are formatting left-overs
+    return pd.DataFrame(xlsx_book_columns(header, parts, 2, last_row, date1904))
+
+
+def read_book_file(file_path):
+    """Reads a book file together with the signature of the exact file version that was read.
+
+    Parsed books are cached by a hash of the file contents, so an unchanged file (a snapshot of the
+    current version, a re-saved identical book, a touched file) is not parsed again.
+    """
+    with open(file_path, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        data = f.read()
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    df = parsed_book_cache.pop(digest, None)
+    if df is None:
+        df = parse_book_bytes(data)
+        if len(parsed_book_cache) >= MAX_PARSED_BOOK_CACHE:
+            parsed_book_cache.pop(next(iter(parsed_book_cache)))
+    parsed_book_cache[digest] = df # Re-inserted so the most recently used book is evicted last
+    return df.copy(), (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+
+def read_sorted_book_file(file_path):
+    """Reads a book file sorted by Date, without undated rows, with the signature of the version read."""
+    df, signature = read_book_file(file_path)
+    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
+    return sort_book(df.dropna(subset=['Date'])), signature
+
+
+def current_book():
+    """Returns the current book as last read or written by this process, without copying it.
+
+    The file is only read when it changed since; the result must be treated as read-only.
+    """
+    cached = book_cache.get(os.path.abspath(EXCEL_FILE))
+    if cached is not None and cached.attrs['book_signature'] == book_signature():
+        return cached
+    read_book(EXCEL_FILE)
+    return book_cache[os.path.abspath(EXCEL_FILE)]
+
+
+def read_book(file_path):
+    """Reads a book sorted by Date, tagged with its file signature. Errors are raised to the caller."""
+    cached = book_cache.get(os.path.abspath(file_path))
+    if cached is not None and cached.attrs['book_signature'] == file_signature(file_path):
+        return cached.copy()
+    df, signature = read_sorted_book_file(file_path)
+    remember_book(df, signature)
+    df.attrs['book_signature'] = signature
+    return df
+
+
+def remember_book(df, signature):
+    """Keeps the last version of a book this process read or wrote, so refreshing views after a save
+    does not parse the file again."""
+    df = df.copy()
+    df.attrs['book_signature'] = signature
+    book_cache[signature[0]] = df
+
+
+def load_book_snapshot(version=None):
+    """Loads a retained book snapshot (the newest by default) for report jobs that want a pinned version.
+
+    Snapshots are never modified once written, so they can be read while the book is being edited.
+    """
+    versions = list_book_snapshots()
+    if not versions:
+        return load_data()
+    if version is None:
+        version = versions[-1]
+    df, _ = read_sorted_book_file(snapshot_path(version))
+    df.attrs['snapshot_version'] = version
+    return df
+
+
+# --- Operation Log ---
+
+def operation_log_path():
+    return sidecar_path('.oplog.jsonl')
+
+
+def book_digest(df, identity_hashes=None):
+    """Identifies a version of the book by its length and a hash of its trades in order.
+
+    identity_hashes may pass the book's trade_identity_hashes when they were already computed.
+    """
+    if identity_hashes is None:
+        identity_hashes = trade_identity_hashes(df)
+    return [len(df), hashlib.blake2b(identity_hashes.tobytes(), digest_size=16).hexdigest()]
+
+
+def book_row_hashes(df):
+    """Hashes whole book rows (the trade identity plus Total and Notes) into an (n, 2) uint64 array."""
+    rest = pd.DataFrame({'Total': pd.to_numeric(df['Total'], errors='coerce').astype(float),
+                         'Notes': df['Notes'].where(df['Notes'].notna(), '').astype(str)})
+    return np.column_stack([trade_identity_hashes(df), pd.util.hash_pandas_object(rest, index=False).to_numpy()])
+
+
+def operation_splice(old, new, old_rows, new_rows):
+    """Returns (start, removed rows, inserted rows): the one span of rows that turns book old into book new.
+
+    old_rows and new_rows are the books' book_row_hashes. Edits, deletions and inserts of a sorted book
+    change a single span, so logging the span instead of the book keeps each log record small.
+    """
+    common = min(len(old), len(new))
+    differs = (old_rows[:common] != new_rows[:common]).any(axis=1)
+    start = int(np.argmax(differs)) if differs.any() else common
+    tail = common - start
+    differs = (old_rows[len(old) - tail:][::-1] != new_rows[len(new) - tail:][::-1]).any(axis=1)
+    suffix = int(np.argmax(differs)) if differs.any() else tail
+    return start, old.iloc[start:len(old) - suffix], new.iloc[start:len(new) - suffix]
+
+
+def rows_to_json(rows):
+    """Converts book rows to JSON lists in BOOK_COLUMNS order."""
+    records = rows[BOOK_COLUMNS].astype(object)
+    records['Date'] = pd.to_datetime(rows['Date']).dt.strftime('%Y-%m-%dT%H:%M:%S.%f')
+    return records.where(records.notna(), None).values.tolist()
+
+
+def rows_from_json(rows):
+    df = pd.DataFrame(rows, columns=BOOK_COLUMNS)
+    df['Date'] = pd.to_datetime(df['Date'])
+    for column in ['Quantity', 'Price', 'Total']:
+        df[column] = pd.to_numeric(df[column])
+    return df
+
+
+def apply_splice(df, start, removed_count, inserted):
+    """Replaces removed_count rows of the book at start with the inserted rows."""
+    return pd.concat([df.iloc[:start], inserted, df.iloc[start + removed_count:]], ignore_index=True)
+
+
+def encode_log_record(record):
+    """Encodes a log record as one line prefixed by its CRC32, so a torn write is recognised on reading."""
+    text = json.dumps(record, separators=(',', ':')).encode()
+    return b'%08x %s\n' % (zlib.crc32(text), text)
+
+
+def read_operation_log():
+    """Returns the records of the book's operation log, oldest first. Call with book_write_lock held.
+
+    A record cut short by a crash during its append was never acknowledged, so it is truncated away.
+    """
+    path = operation_log_path()
+    signature = file_signature(path)
+    cached = operation_log_cache.get(os.path.abspath(path))
+    if cached is not None and cached[0] == signature:
+        return list(cached[1])
+    if signature is None:
+        return []
+    with open(path, 'rb') as f:
+        data = f.read()
+    records, valid_bytes = [], 0
+    for line in data.splitlines(keepends=True):
+        checksum, _, text = line.rstrip(b'\n').partition(b' ')
+        if not line.endswith(b'\n') or checksum != b'%08x' % zlib.crc32(text):
+            break
+        records.append(json.loads(text))
+        valid_bytes += len(line)
+    if valid_bytes < len(data):
+        with open(path, 'r+b') as f:
+            f.truncate(valid_bytes)
+            os.fsync(f.fileno())
+    operation_log_cache[os.path.abspath(path)] = (file_signature(path), records)
+    return list(records)
+
+
+def log_operation(old, new, kind='op', target=None):
+    """Appends the change from book old to book new to the operation log and fsyncs it.
+
+    The append is the commit point of the change: once it returns, recover_book can finish the change even
+    if the book itself is never written. Returns the record, or None if the book did not change.
+    """
+    records = read_operation_log()
+    old_rows, new_rows = book_row_hashes(old), book_row_hashes(new)
+    start, removed, inserted = operation_splice(old, new, old_rows, new_rows)
+    if kind == 'op' and removed.empty and inserted.empty:
+        return None # Saving an unchanged book is not an action worth undoing
+    record = {'seq': records[-1]['seq'] + 1 if records else 1, 'kind': kind, 'target': target,
+              'time': datetime.now().isoformat(timespec='seconds'), 'base': book_digest(old, old_rows[:, 0]),
+              'result': book_digest(new, new_rows[:, 0]), 'start': start, 'removed': rows_to_json(removed),
+              'inserted': rows_to_json(inserted)}
+    path = operation_log_path()
+    with open(path, 'ab') as f:
+        f.write(encode_log_record(record))
+        f.flush()
+        os.fsync(f.fileno())
+    operation_log_cache[os.path.abspath(path)] = (file_signature(path), records + [record])
+    return record
+
+
+def operation_history(records):
+    """Derives the undo and redo stacks (operation seqs, top last) from the log records."""
+    undo, redo = [], []
+    for record in records:
+        if record['kind'] == 'op':
+            undo.append(record['seq'])
+            redo.clear()
+        elif record['kind'] == 'undo' and record['target'] in undo:
+            undo.remove(record['target'])
+            redo.append(record['target'])
+        elif record['kind'] == 'redo' and record['target'] in redo:
+            redo.remove(record['target'])
+            undo.append(record['target'])
+    return undo[-MAX_UNDO_HISTORY:], redo
+
+
+def compact_operation_log():
+    """Rewrites a log grown past OPLOG_MAX_BYTES to just the records its undo/redo history needs.
+
+    The undoable operations and the undone ones are kept, followed by one undo record per undone
+    operation, so the rewritten log yields the same stacks and still ends at the current book.
+    """
+    if (file_signature(operation_log_path()) or (None, 0, 0))[2] <= OPLOG_MAX_BYTES:
+        return
+    records = read_operation_log()
+    by_seq = {record['seq']: record for record in records}
+    undo, redo = operation_history(records)
+    kept = [by_seq[seq] for seq in undo] + [by_seq[seq] for seq in reversed(redo)]
+    seq = records[-1]['seq']
+    for target in redo:
+        seq += 1
+        operation = by_seq[target]
+        kept.append({'seq': seq, 'kind': 'undo', 'target': target, 'time': operation['time'],
+                     'base': operation['result'], 'result': operation['base'], 'start': operation['start'],
+                     'removed': operation['inserted'], 'inserted': operation['removed']})
+    path = operation_log_path()
+    def write(temp_path):
+        with open(temp_path, 'wb') as f:
+            f.writelines(encode_log_record(record) for record in kept)
+    atomic_write(path, write)
+    operation_log_cache[os.path.abspath(path)] = (file_signature(path), kept)
+
+
+def recover_book():
+    """Brings the book in line with its operation log, e.g. after a crash. Returns a message when it had to.
+
+    A crash between logging a change and writing the book leaves the book at the last record's base
+    version, so the logged change is replayed. A book matching neither side of the last record was
+    changed outside the app; its log no longer applies, so it is kept aside under a timestamped name
+    and a new one is started.
+    """
+    with book_write_lock():
+        records = read_operation_log()
+        if not records or not os.path.exists(EXCEL_FILE):
+            return None
+        last = records[-1]
+        df = read_book(EXCEL_FILE)
+        digest = book_digest(df)
+        if digest == last['result']:
+            return None
+        if digest == last['base']:
+            store_book(apply_splice(df, last['start'], len(last['removed']), rows_from_json(last['inserted'])),
+                       operation=None)
+            return f"The last change ({last['time']}) had not been written to the book and was recovered from the operation log."
+        kept_path = sidecar_path(f".{datetime.now().strftime('%Y%m%dT%H%M%S')}.oplog.jsonl")
+        replace_file(operation_log_path(), kept_path)
+        return (f"The book was changed outside the app, so its undo history no longer applies. "
+                f"The previous operation log was kept as '{kept_path}'.")
+
 
 def undo_last_action():
-    global show_records_window, summary_window 
-    if undo_stack:
-        current_df_state = load_data()
-        redo_stack.append(current_df_state.copy())
-
-        previous_df_state = undo_stack.pop()
-        previous_df_state.to_excel(EXCEL_FILE, index=False)
-        messagebox.showinfo("Undo", "Last action undone.")
-
-        if show_records_window is not None and show_records_window.winfo_exists():
-            show_records_window.destroy() 
-            show_records()
-        if summary_window is not None and summary_window.winfo_exists():
-            summary_window.destroy() 
-            show_portfolio_summary()
-    else:
-        messagebox.showinfo("Undo", "No more actions to undo.")
+    step_operation('undo')
 
 def redo_last_undo():
-    global show_records_window, summary_window 
-    if redo_stack:
-        current_df_state = load_data()
-        undo_stack.append(current_df_state.copy())
-
-        next_df_state = redo_stack.pop()
-        next_df_state.to_excel(EXCEL_FILE, index=False)
-        messagebox.showinfo("Redo", "Last undo redone.")
-
-        if show_records_window is not None and show_records_window.winfo_exists():
-            show_records_window.destroy()
-            show_records()
-        if summary_window is not None and summary_window.winfo_exists():
-            summary_window.destroy()
-            show_portfolio_summary()
-    else:
-        messagebox.showinfo("Redo", "No more actions to redo.")
+    step_operation('redo')
+
+def step_operation(kind):
+    """Undoes the most recent undoable operation or redoes the most recently undone one, from the log."""
+    title = kind.capitalize()
+    # Dialogs are shown only once the book lock is released, so they never block other writers
+    try:
+        with book_write_lock():
+            records = read_operation_log()
+            undo, redo = operation_history(records)
+            stack = undo if kind == 'undo' else redo
+            if stack:
+                tickers = step_logged_operation(kind, records, stack[-1])
+    except Exception as e:
+        messagebox.showerror(f"{title} Error", f"Failed to {kind}: {e}")
+        return False
+    if not stack:
+        messagebox.showinfo(title, f"No more actions to {kind}.")
+        return False
+    publish_book_change({'tickers': tickers})
+    messagebox.showinfo(title, "Last action undone." if kind == 'undo' else "Last undo redone.")
+    return True
+
+
+def step_logged_operation(kind, records, seq):
+    """Undoes or redoes logged operation seq on the book, under the caller's book lock. Returns its tickers."""
+    operation = next(record for record in records if record['seq'] == seq)
+    removed, inserted = operation['removed'], operation['inserted']
+    if kind == 'undo':
+        removed, inserted = inserted, removed
+    df = load_data()
+    if book_digest(df) != (operation['result'] if kind == 'undo' else operation['base']):
+        raise ValueError("the book has been changed since that action.")
+    tickers = sorted({row[1] for row in removed + inserted})
+    store_book(apply_splice(df, operation['start'], len(removed), rows_from_json(inserted)), tickers,
+               operation=kind, target=operation['seq'])
+    return tickers
 
 
 def add_record(date, ticker, trade_type, quantity, price, notes):
     try:
         total = quantity * price
-        new_record = pd.DataFrame({'Date': [date], 'Ticker': [ticker], 'Trade_Type': [trade_type],
+        trade_date = pd.Timestamp(date)
+        new_record = pd.DataFrame({'Date': [trade_date], 'Ticker': [ticker], 'Trade_Type': [trade_type],
                                    'Quantity': [quantity], 'Price': [price], 'Total': [total], 'Notes': [notes]})
-        df = load_data()
-        df = pd.concat([df, new_record], ignore_index=True)
-        save_data(df, record_undo=True)
-        return True
+        # Ask about a duplicate before taking the book lock, so a pending prompt never blocks other writers
+        confirmed = False
+        while True:
+            if not confirmed and find_duplicate_trades(new_record)[0][0]:
+                if not messagebox.askyesno(
+                        "Possible Duplicate", f"The book already has a {trade_type} of {quantity} {ticker} at {price} on "
+                                              f"{trade_date.strftime('%Y-%m-%d')}. Add it anyway?"):
+                    return False
+                confirmed = True
+            with book_write_lock():
+                df = load_data()
+                if not confirmed and find_duplicate_trades(new_record)[0][0]:
+                    continue # A matching trade was written meanwhile; ask again outside the lock
+                # Insert after any trades on the same date so the book stays sorted without a full re-sort
+                position = int(df['Date'].searchsorted(trade_date, side='right')) if not df.empty else 0
+                df = pd.concat([df.iloc[:position], new_record, df.iloc[position:]], ignore_index=True)
+                error = write_changes(df, changed_tickers={ticker})
+            break
     except Exception as e:
-        messagebox.showerror("Error", f"Failed to add record: {e}")
-        return False
+        error = f"Failed to add record: {e}"
+    return report_record_change(error, {ticker})
 
-def edit_record(index, date, ticker, trade_type, quantity, price, notes):
-    df = load_data()
-    if 0 <= index < len(df):
-        try:
-            save_data(df.copy(), record_undo=True) 
-
-            df.at[index, 'Date'] = date
-            df.at[index, 'Ticker'] = ticker
-            df.at[index, 'Trade_Type'] = trade_type
-            df.at[index, 'Quantity'] = quantity
-            df.at[index, 'Price'] = price
-            df.at[index, 'Total'] = quantity * price
-            df.at[index, 'Notes'] = notes
-            df.to_excel(EXCEL_FILE, index=False) 
-            return True
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to edit record: {e}")
-            return False
-    else:
-        messagebox.showerror("Error", "Invalid index for editing.")
-        return False
+def record_position(df, index, row_id=None):
+    """The book position of a record: index, or where the trade with stable id row_id now is (-1 once it is gone)."""
+    if row_id is None:
+        return index
+    return int(pd.Index(book_row_ids(df)).get_indexer([row_id])[0])
 
-def delete_record(index):
-    df = load_data()
-    if 0 <= index < len(df):
-        try:
-            save_data(df.copy(), record_undo=True) 
+def edit_record(index, date, ticker, trade_type, quantity, price, notes, row_id=None):
+    changed_tickers = set()
+    try:
+        with book_write_lock():
+            df = load_data()
+            index = record_position(df, index, row_id)
+            if row_id is not None and index < 0:
+                error = "The record was changed or removed meanwhile."
+            elif not 0 <= index < len(df):
+                error = "Invalid index for editing."
+            else:
+                changed_tickers = {df.at[index, 'Ticker'], ticker}
+                df.at[index, 'Date'] = pd.Timestamp(date)
+                df.at[index, 'Ticker'] = ticker
+                df.at[index, 'Trade_Type'] = trade_type
+                df.at[index, 'Quantity'] = quantity
+                df.at[index, 'Price'] = price
+                df.at[index, 'Total'] = quantity * price
+                df.at[index, 'Notes'] = notes
+                error = write_changes(df, changed_tickers=changed_tickers)
+    except Exception as e:
+        error = f"Failed to edit record: {e}"
+    return report_record_change(error, changed_tickers)
 
-            df = df.drop(index).reset_index(drop=True)
-            df.to_excel(EXCEL_FILE, index=False) 
-            return True
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to delete record: {e}")
-            return False
+def delete_record(index, row_id=None):
+    changed_tickers = set()
+    try:
+        with book_write_lock():
+            df = load_data()
+            index = record_position(df, index, row_id)
+            if row_id is not None and index < 0:
+                error = "The record was changed or removed meanwhile."
+            elif not 0 <= index < len(df):
+                error = "Invalid index for deletion."
+            else:
+                changed_tickers = {df.at[index, 'Ticker']}
+                df = df.drop(index).reset_index(drop=True)
+                error = write_changes(df, changed_tickers=changed_tickers)
+    except Exception as e:
+        error = f"Failed to delete record: {e}"
+    return report_record_change(error, changed_tickers)
+
+# --- Duplicate Detection ---
+
+def trade_identity_hashes(df):
+    """Hashes the identity of each trade (date, ticker, side, quantity, price) into a uint64 array."""
+    identity = pd.DataFrame({
+        'Date': pd.to_datetime(df['Date'], errors='coerce').astype('datetime64[ns]'),
+        'Ticker': df['Ticker'].astype(str).str.strip(),
+        'Trade_Type': df['Trade_Type'].astype(str).str.strip().str.lower(),
+        'Quantity': pd.to_numeric(df['Quantity'], errors='coerce').astype(float),
+        'Price': pd.to_numeric(df['Price'], errors='coerce').astype(float),
+    })
+    return pd.util.hash_pandas_object(identity[TRADE_IDENTITY_COLUMNS], index=False).to_numpy()
+
+
+def update_trade_index(df, signature, fill_ids=None):
+    """Rebuilds the identity index from a freshly written book and persists it tagged with that book version.
+
+    Remembered fill ids are kept only while a trade with their identity is still in the book, so an
+    undone or deleted import can be imported again.
+    """
+    global trade_index_cache
+    hashes, counts = np.unique(trade_identity_hashes(df), return_counts=True)
+    index = {'counts': dict(zip(hashes.tolist(), counts.tolist()))}
+    index['fill_ids'] = {fill_id: identity for fill_id, identity in (fill_ids or {}).items() if identity in index['counts']}
+    trade_index_cache = dict(index, book_signature=signature)
+
+    def write(temp_path):
+        np.savez(temp_path, hashes=hashes, counts=counts,
+                 fill_ids=np.array(list(index['fill_ids']), dtype=str),
+                 fill_hashes=np.array(list(index['fill_ids'].values()), dtype=np.uint64),
+                 meta=np.array(json.dumps({'book_signature': list(signature), 'pandas': pd.__version__})))
+
+    try:
+        atomic_write(sidecar_path('.trade_index.npz'), write)
+    except OSError as e:
+        logger.warning("Could not persist the trade index: %s", e)
+
+
+def load_trade_index_file():
+    """Returns (metadata, hashes, counts, fill ids) from the persisted index, or None when it is missing or unreadable."""
+    try:
+        with np.load(sidecar_path('.trade_index.npz'), allow_pickle=False) as data:
+            fill_ids = dict(zip(data['fill_ids'].tolist(), data['fill_hashes'].tolist()))
+            return json.loads(str(data['meta'])), data['hashes'], data['counts'], fill_ids
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def remembered_fill_ids():
+    """Returns the fill ids recorded for the current book, whatever book version they were recorded with."""
+    signature = trade_index_cache.get('book_signature')
+    if signature is not None and signature[0] == os.path.abspath(EXCEL_FILE):
+        return dict(trade_index_cache['fill_ids'])
+    stored = load_trade_index_file()
+    return stored[3] if stored is not None else {}
+
+
+def get_trade_index():
+    """Returns the identity index of the current book version: {'counts': {hash: trades}, 'fill_ids': {id: hash}}.
+
+    The persisted index is used when it was written for this book version; otherwise it is rebuilt from
+    the book in one vectorized pass.
+    """
+    global trade_index_cache
+    signature = book_signature()
+    if trade_index_cache.get('book_signature') == signature:
+        return trade_index_cache
+    stored = load_trade_index_file()
+    if stored is not None:
+        meta, hashes, counts, fill_ids = stored
+        if tuple(meta.get('book_signature') or ()) == signature and meta.get('pandas') == pd.__version__:
+            trade_index_cache = {'counts': dict(zip(hashes.tolist(), counts.tolist())), 'fill_ids': fill_ids,
+                                 'book_signature': signature}
+            return trade_index_cache
+    df = read_book(EXCEL_FILE)
+    update_trade_index(df, df.attrs['book_signature'], stored[3] if stored is not None else None)
+    return trade_index_cache
+
+
+def find_duplicate_trades(rows, fill_ids=None):
+    """Marks the rows (a book-shaped DataFrame) that are already in the book, with one index lookup per row.
+
+    A row carrying an external fill id is a duplicate when that id was imported before. Other rows are
+    matched on their identity hash with multiplicity: a book holding a trade twice absorbs the first two
+    identical rows, so a genuinely repeated fill is still added. Returns (duplicate mask, identity hashes).
+    """
+    index = get_trade_index()
+    counts, known_ids = index['counts'], index['fill_ids']
+    hashes = trade_identity_hashes(rows).tolist()
+    duplicates = np.zeros(len(hashes), dtype=bool)
+    matched = {}
+    seen_ids = set()
+    for i, identity in enumerate(hashes):
+        fill_id = fill_ids[i] if fill_ids is not None else None
+        if fill_id:
+            duplicates[i] = fill_id in known_ids or fill_id in seen_ids
+            seen_ids.add(fill_id)
+        else:
+            occurrences = matched.get(identity, 0)
+            duplicates[i] = occurrences < counts.get(identity, 0)
+            matched[identity] = occurrences + 1
+    return duplicates, hashes
+
+
+# --- Display Formatting ---
+
+# Precision setting used for each numeric book column
+COLUMN_PRECISION_KEYS = {'Quantity': 'quantity', 'Price': 'price', 'Total': 'total'}
+
+def format_values(values, precision):
+    """Renders numbers as fixed-point strings in a single pass; the output matches f"{value:.{precision}f}"."""
+    pattern = f"%.{precision}f"
+    return np.array([pattern % value for value in np.asarray(values, dtype=float).tolist()], dtype=object)
+
+
+def format_number(value, precision_key):
+    """Formats one value with the display precision configured for precision_key ('pnl', 'price', ...)."""
+    return f"{value:.{decimal_precision[precision_key]}f}"
+
+
+def trade_statistic_rows(metrics):
+    """Returns the (key, caption, text) rows of the round-trip statistics shown by the summary and the PDF."""
+    holding_days = metrics['holding_days']
+    return [
+        ('closed_trades', "Closed Trades (lot slices)", str(metrics['closed_trades'])),
+        ('profit_factor', "Profit Factor", "N/A" if metrics['profit_factor'] is None else f"{metrics['profit_factor']:.2f}"),
+        ('expectancy', "Expectancy per Trade", format_number(metrics['expectancy'], 'pnl')),
+        ('max_drawdown', "Max Drawdown (realized)", format_number(metrics['max_drawdown'], 'pnl')),
+        ('sharpe_ratio', "Sharpe Ratio (daily, annualized)", "N/A" if metrics['sharpe_ratio'] is None else f"{metrics['sharpe_ratio']:.2f}"),
+        ('sortino_ratio', "Sortino Ratio (daily, annualized)", "N/A" if metrics['sortino_ratio'] is None else f"{metrics['sortino_ratio']:.2f}"),
+        ('holding_days', "Holding Days (min / median / max)",
+         f"{holding_days['min']:.1f} / {holding_days['median']:.1f} / {holding_days['max']:.1f}"),
+        ('holding_days_mean', "Avg. Holding Days", f"{holding_days['mean']:.1f}"),
+    ]
+
+
+def book_column_strings(df, column):
+    """Display strings for a whole book column, shared by the records view, the summary and reports.
+
+    Rendered columns are cached by (book version, column, precision), so a refresh or a second report
+    reuses them and a precision change re-renders only the columns that use that precision.
+    """
+    precision_key = COLUMN_PRECISION_KEYS.get(column)
+    precision = decimal_precision[precision_key] if precision_key else None
+    signature = df.attrs.get('book_signature')
+    key = (signature, len(df), column, precision)
+    if signature is not None and key in format_cache:
+        return format_cache[key]
+
+    values = df[column]
+    if precision is not None:
+        strings = format_values(values, precision)
+    elif column == 'Date':
+        strings = pd.to_datetime(values).dt.strftime('%Y-%m-%d').to_numpy(dtype=object)
+    elif column == 'Notes':
+        strings = values.where(values.notna(), "").astype(str).to_numpy(dtype=object)
     else:
-        messagebox.showerror("Error", "Invalid index for deletion.")
-        return False
+        strings = values.astype(str).to_numpy(dtype=object)
+
+    if signature is not None:
+        if len(format_cache) >= MAX_FORMAT_CACHE:
+            format_cache.pop(next(iter(format_cache)))
+        format_cache[key] = strings
+    return strings
+
+
+def book_row_ids(df):
+    """Stable ids for the rows of a book: the row's content hash plus how many identical rows precede it.
+
+    Unlike a book position, a trade keeps its id when rows are inserted or deleted before it, so views
+    can key their rows by it. Cached alongside the display strings.
+    """
+    signature = df.attrs.get('book_signature')
+    key = (signature, len(df), '#id', None)
+    if signature is not None and key in format_cache:
+        return format_cache[key]
+
+    hashes = book_row_hashes(df)
+    content = pd.Series([f"{identity:016x}{rest:016x}" for identity, rest in hashes.tolist()], dtype=object)
+    occurrence = content.groupby(content, sort=False).cumcount().astype(str)
+    ids = (content + '-' + occurrence).to_numpy(dtype=object)
+
+    if signature is not None:
+        if len(format_cache) >= MAX_FORMAT_CACHE:
+            format_cache.pop(next(iter(format_cache)))
+        format_cache[key] = ids
+    return ids
+
+
+
+def format_holdings(current_holdings, holdings_value, prices):
+    """Display strings for the holdings table of the summary and the PDF, one formatted column at a time."""
+    tickers = list(current_holdings)
+    table = pd.DataFrame({
+        "Ticker": tickers,
+        "Quantity": format_values([current_holdings[t]['quantity'] for t in tickers], decimal_precision['quantity']),
+        "Avg. Buy Price": format_values([current_holdings[t]['average_buy_price'] for t in tickers], decimal_precision['avg_buy_price']),
+    })
+    if prices is not None:
+        valuation = holdings_value.reindex(tickers)
+        last_price = format_values(valuation['price'], decimal_precision['price'])
+        table["Last Price"] = np.where(valuation['price'].isna().to_numpy(), "n/a", last_price)
+        table[f"Market Value{reporting_currency_label()}"] = format_values(valuation['market_value'], decimal_precision['total'])
+        table["Unrealized P&L"] = format_values(valuation['unrealized_pnl'], decimal_precision['pnl'])
+    return table
 
 # --- UI Functions ---
 
@@ -201,30 +1332,36 @@ def center_window(window):
     window.geometry(f'+{x}+{y}')
 
 
-def validate_input(date_str, quantity_str, price_str, trade_type):
+def check_trade_input(date_str, quantity_str, price_str, trade_type):
+    """Applies the trade entry rules. Returns (quantity, price) or raises ValueError with the message to show."""
     try:
         datetime.strptime(date_str, '%Y-%m-%d')
     except ValueError:
-        messagebox.showerror("Validation Error", "Date must be in YYYY-MM-DD format.")
-        return False, None, None
+        raise ValueError("Date must be in YYYY-MM-DD format.")
 
     try:
         quantity = float(quantity_str)
         price = float(price_str)
-        if quantity <= 0 or price <= 0:
-            messagebox.showerror("Validation Error", "Quantity and Price must be positive numbers.")
-            return False, None, None
     except ValueError:
-        messagebox.showerror("Validation Error", "Quantity and Price must be valid numbers.")
-        return False, None, None
+        raise ValueError("Quantity and Price must be valid numbers.")
+    if not (quantity > 0 and price > 0):
+        raise ValueError("Quantity and Price must be positive numbers.")
 
     if trade_type.lower() not in ['buy', 'sell']:
-        messagebox.showerror("Validation Error", "Trade Type must be 'Buy' or 'Sell'.")
+        raise ValueError("Trade Type must be 'Buy' or 'Sell'.")
+
+    return quantity, price
+
+def validate_input(date_str, quantity_str, price_str, trade_type):
+    try:
+        quantity, price = check_trade_input(date_str, quantity_str, price_str, trade_type)
+    except ValueError as e:
+        messagebox.showerror("Validation Error", str(e))
         return False, None, None
-        
+
     return True, quantity, price
 
-def add_edit_form(is_edit=False, record_index=None, current_data=None, update_callback=None):
+def add_edit_form(is_edit=False, record_index=None, current_data=None, update_callback=None, record_id=None):
     form_window = Toplevel(root)
     form_window.title("Edit Record" if is_edit else "Add Record")
     form_window.geometry("350x300")
@@ -287,7 +1424,7 @@ def add_edit_form(is_edit=False, record_index=None, current_data=None, update_ca
             return
 
         if is_edit:
-            if edit_record(record_index, date, ticker, trade_type, quantity, price, notes):
+            if edit_record(record_index, date, ticker, trade_type, quantity, price, notes, row_id=record_id):
                 messagebox.showinfo("Success", "Record edited successfully.")
                 if update_callback:
                     update_callback()
@@ -319,11 +1456,6 @@ def show_records():
 
     show_records_window.protocol("WM_DELETE_WINDOW", lambda: on_toplevel_closing(show_records_window))
 
-    df = load_data()
-    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-    df = df.dropna(subset=['Date'])
-    df['Date'] = df['Date'].dt.strftime('%Y-%m-%d')
-
     # Search and Filter Frame
     control_frame = Frame(show_records_window)
     control_frame.pack(pady=10, fill='x')
@@ -337,7 +1469,8 @@ def show_records():
     trade_type_filter.set("All")
     trade_type_filter.pack(side=LEFT, padx=5)
 
-    Button(control_frame, text="Export CSV", command=export_records_csv).pack(side=RIGHT, padx=5)
+    # Exports what the table shows: the filtered rows in their current (possibly sorted) order
+    Button(control_frame, text="Export", command=lambda: export_records([position for position in book_positions(tree.get_children())[1] if position is not None])).pack(side=RIGHT, padx=5)
 
     # Treeview for structured display
     tree_frame = Frame(show_records_window)
@@ -348,7 +1481,7 @@ def show_records():
     tree_scroll_x = Scrollbar(tree_frame, orient="horizontal")
     tree_scroll_x.pack(side="bottom", fill="x")
 
-    display_columns = df.columns.tolist()    
+    display_columns = load_data().columns.tolist()
     
     tree = ttk.Treeview(tree_frame, yscrollcommand=tree_scroll_y.set, xscrollcommand=tree_scroll_x.set,    
                          selectmode="browse", columns=display_columns)
@@ -374,30 +1507,53 @@ def show_records():
         tree.heading(col, text=col, command=lambda _col=col: treeview_sort_column(tree, _col, False))
         tree.column(col, width=column_widths.get(col, 100), anchor="center")
     
-    def populate_tree(data_frame):
-        for item in tree.get_children():
-            tree.delete(item)
-            
-        for idx, row in data_frame.iterrows():
-            display_values = []
-            for col_name in display_columns:
-                value = row[col_name]
-                if col_name == 'Quantity':
-                    display_values.append(f"{value:.{decimal_precision['quantity']}f}")
-                elif col_name == 'Price':
-                    display_values.append(f"{value:.{decimal_precision['price']}f}")
-                elif col_name == 'Total':
-                    display_values.append(f"{value:.{decimal_precision['total']}f}")
-                elif col_name == 'Notes' and pd.isna(value):
-                    display_values.append("")
-                else:
-                    display_values.append(str(value))
-            
-            tree.insert("", "end", iid=str(idx), text=str(idx), values=display_values)
+    def format_rows(book, positions):
+        """The index text and display strings for the given book positions, indexed by the rows' stable ids."""
+        rows = pd.DataFrame({col_name: book_column_strings(book, col_name)[positions] for col_name in display_columns},
+                            index=book_row_ids(book)[positions])
+        rows.insert(0, '#0', np.asarray(positions).astype(str))
+        return rows
+
+    def populate_tree(rows, append=False):
+        """Shows the formatted rows, touching only the Treeview items that differ from what is shown.
+
+        Item ids are the rows' stable ids, so the selection and scroll position stay on the same trades
+        when rows are inserted or deleted before them; only the shown index of those rows changes.
+        """
+        if append:
+            for iid, values in zip(rows.index, rows.to_numpy().tolist()):
+                tree.insert("", "end", iid=iid, text=values[0], values=values[1:])
+            shown['rows'] = pd.concat([shown['rows'], rows])
+        else:
+            old_rows = shown['rows']
+            removed = old_rows.index.difference(rows.index)
+            if len(removed):
+                tree.delete(*removed)
+
+            common = rows.index.intersection(old_rows.index)
+            changed = common[(rows.loc[common] != old_rows.loc[common]).any(axis=1).to_numpy()]
+            for iid, values in zip(changed, rows.loc[changed].to_numpy().tolist()):
+                tree.item(iid, text=values[0], values=values[1:])
+
+            # Rows are inserted in book order, so each lands after every row that precedes it
+            for position in np.flatnonzero(~rows.index.isin(old_rows.index)):
+                values = rows.iloc[position].tolist()
+                tree.insert("", int(position), iid=rows.index[position], text=values[0], values=values[1:])
+            shown['rows'] = rows
+
+        if shown['sort'] is not None:
+            treeview_sort_column(tree, *shown['sort'])
+
+    def book_positions(iids):
+        """Current book positions of the given Treeview items, or None for trades no longer in the book."""
+        book = load_data()
+        positions = pd.Index(book_row_ids(book)).get_indexer(list(iids))
+        return book, [int(position) if position >= 0 else None for position in positions]
 
     def treeview_sort_column(tv, col, reverse):
         if col == "#0":
-            l = [(int(tv.set(k, col)), k) for k in tv.get_children('')]
+            l = [(int(tv.item(k, "text")), k) for k in tv.get_children('')]
+            l.sort(reverse=reverse)
         else:
             l = [(tv.set(k, col), k) for k in tv.get_children('')]
             
@@ -409,238 +1565,1078 @@ def show_records():
         for index, (val, k) in enumerate(l):
             tv.move(k, '', index)
 
+        shown['sort'] = (col, reverse)
         tv.heading(col, command=lambda: treeview_sort_column(tv, col, not reverse))
 
-    def apply_filters_and_search():
-        current_df = load_data()
-        current_df['Date'] = pd.to_datetime(current_df['Date'], errors='coerce')
-        current_df = current_df.dropna(subset=['Date'])
-        current_df['Date'] = current_df['Date'].dt.strftime('%Y-%m-%d')
-
+    def filter_records(book, start=0):
+        """Book positions from start on that match the search term and the type filter."""
         search_term = search_entry.get().lower()
         filter_type = trade_type_filter.get()
 
-        filtered_df = current_df.copy()
+        candidates = book.iloc[start:]
+        matches = np.ones(len(candidates), dtype=bool)
 
         if filter_type != "All":
-            filtered_df = filtered_df[filtered_df['Trade_Type'].str.lower() == filter_type.lower()]
+            matches &= (candidates['Trade_Type'].astype(str).str.lower() == filter_type.lower()).to_numpy()
 
         if search_term:
-            filtered_df = filtered_df[filtered_df.apply(lambda row: row.astype(str).str.lower().str.contains(search_term).any(), axis=1)]
-            
-        populate_tree(filtered_df)
+            found = np.zeros(len(candidates), dtype=bool)
+            for col_name in candidates.columns:
+                text = pd.Series(book_column_strings(book, 'Date')[start:]) if col_name == 'Date' else candidates[col_name].astype(str)
+                found |= text.str.lower().str.contains(search_term, regex=False).to_numpy()
+            matches &= found
+
+        return candidates.index[matches]
+
+    def apply_filters_and_search():
+        current_df = load_data()
+        shown['book_length'] = len(current_df)
+        populate_tree(format_rows(current_df, filter_records(current_df)))
+
+    def refresh_records(change=None):
+        """Brings the table up to date after a book change event.
+
+        Trades appended at the end of the book (the usual case for ingested fills) are inserted
+        without comparing the rest of the table.
+        """
+        if change is None or change.get('start') is None or change['start'] != shown['book_length']:
+            apply_filters_and_search()
+            return
+        current_df = load_data()
+        populate_tree(format_rows(current_df, filter_records(current_df, change['start'])), append=True)
+        shown['book_length'] = len(current_df)
+
+    shown = {'rows': pd.DataFrame(columns=['#0'] + display_columns), 'book_length': 0, 'sort': None}
+    subscribe_book_changes(show_records_window, refresh_records)
 
     search_entry.bind("<KeyRelease>", lambda event: apply_filters_and_search())
     trade_type_filter.bind("<<ComboboxSelected>>", lambda event: apply_filters_and_search())
 
-    populate_tree(df)
+    apply_filters_and_search()
 
     # Edit and Delete Buttons
     action_frame = Frame(show_records_window)
     action_frame.pack(pady=10)
 
+    def selected_record():
+        """The book, the selected trade's stable id and its current book position (None once it is gone)."""
+        selected_id = tree.selection()[0]
+        book, (selected_index,) = book_positions([selected_id])
+        if selected_index is None:
+            messagebox.showwarning("Selection Error", "The selected record has changed. Please select it again.")
+        return book, selected_id, selected_index
+
     def edit_selected_record():
-        selected_item = tree.selection()
-        if not selected_item:
+        if not tree.selection():
             messagebox.showwarning("Selection Error", "Please select a record to edit.")
             return
-        
-        selected_index = int(tree.item(selected_item[0], "text"))
 
-        df_current = load_data()
+        df_current, selected_id, selected_index = selected_record()
+        if selected_index is None:
+            return
         current_record_data = df_current.iloc[selected_index].to_dict()
         
-        add_edit_form(is_edit=True, record_index=selected_index, current_data=current_record_data, update_callback=apply_filters_and_search)
+        add_edit_form(is_edit=True, record_index=selected_index, current_data=current_record_data, record_id=selected_id)
 
     def delete_selected_record():
-        selected_item = tree.selection()
-        if not selected_item:
+        if not tree.selection():
             messagebox.showwarning("Selection Error", "Please select a record to delete.")
             return
 
-        selected_index = int(tree.item(selected_item[0], "text"))
+        _, selected_id, selected_index = selected_record()
+        if selected_index is None:
+            return
         
         if messagebox.askyesno("Confirm Deletion", f"Are you sure you want to delete record at index {selected_index}?"):
-            if delete_record(selected_index):
+            if delete_record(selected_index, row_id=selected_id):
                 messagebox.showinfo("Success", "Record deleted successfully.")
-                apply_filters_and_search()
 
     Button(action_frame, text="Edit Selected", command=edit_selected_record).pack(side=LEFT, padx=5)
     Button(action_frame, text="Delete Selected", command=delete_selected_record).pack(side=LEFT, padx=5)
 
 
-def export_records_csv():
+def export_format(file_path):
+    """Picks the export format from the file name: 'parquet', 'arrow' or 'csv' plus its compression."""
+    name = file_path.lower()
+    if name.endswith(('.parquet', '.pq')):
+        return 'parquet', None
+    if name.endswith(('.arrow', '.feather', '.ipc')):
+        return 'arrow', None
+    for extension, compression in EXPORT_CSV_COMPRESSION.items():
+        if name.endswith(extension):
+            return 'csv', compression
+    return 'csv', None
+
+
+def export_chunks(df, positions=None):
+    """Yields the rows to export (all rows, or the given book positions in order) in EXPORT_CHUNK_ROWS slices."""
+    if positions is None:
+        positions = np.arange(len(df))
+    positions = np.asarray(positions, dtype=np.int64)
+    for start in range(0, len(positions), EXPORT_CHUNK_ROWS):
+        yield df.take(positions[start:start + EXPORT_CHUNK_ROWS])
+
+
+def arrow_export_table(chunk, schema):
+    import pyarrow as pa
+    columns = {}
+    for field in schema:
+        values = chunk[field.name]
+        if pa.types.is_string(field.type):
+            values = values.astype(str).where(values.notna(), None)
+        columns[field.name] = values
+    return pa.Table.from_pandas(pd.DataFrame(columns, index=chunk.index), schema=schema, preserve_index=False)
+
+
+def write_records(df, file_path, positions=None):
+    """Streams book rows to file_path chunk by chunk, so the export needs memory for one chunk at a time.
+
+    CSV (optionally .gz/.bz2/.xz/.zst compressed) writes dates as YYYY-MM-DD; Parquet and Arrow keep
+    typed columns and need pyarrow. The file is replaced atomically once every chunk is written.
+    """
+    file_format, compression = export_format(file_path)
+
+    def write(temp_path):
+        if file_format == 'csv':
+            with open(temp_path, 'wb') as raw:
+                stream = open_compressed(raw, compression)
+                with io.TextIOWrapper(stream, encoding='utf-8', newline='') as f:
+                    header = True
+                    for chunk in export_chunks(df, positions):
+                        chunk = chunk.assign(Date=chunk['Date'].dt.strftime('%Y-%m-%d'))
+                        chunk.to_csv(f, index=False, header=header)
+                        header = False
+                    if header: # Nothing to export; still write the column names
+                        df.iloc[:0].to_csv(f, index=False)
+            return
+
+        try:
+            import pyarrow as pa
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError("Parquet and Arrow export need the 'pyarrow' package (pip install pyarrow).")
+        schema = pa.schema([(column, pa.timestamp('ns') if column == 'Date'
+                                      else pa.float64() if column in ('Quantity', 'Price', 'Total') else pa.string())
+                            for column in df.columns])
+        if file_format == 'parquet':
+            writer = pa.parquet.ParquetWriter(temp_path, schema)
+        else:
+            writer = pa.ipc.new_file(temp_path, schema)
+        with writer:
+            for chunk in export_chunks(df, positions):
+                writer.write_table(arrow_export_table(chunk, schema))
+
+    atomic_write(file_path, write)
+
+
+def open_compressed(raw, compression):
+    """Wraps a binary file in the compressor for a .csv.* export."""
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=raw, mode='wb', mtime=0)
+    if compression == 'bz2':
+        return bz2.BZ2File(raw, mode='wb')
+    if compression == 'xz':
+        return lzma.LZMAFile(raw, mode='wb')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ValueError("Zstandard export needs the 'zstandard' package (pip install zstandard).")
+        return zstandard.ZstdCompressor().stream_writer(raw)
+    return raw
+
+
+def export_records(positions=None):
+    """Exports the book, or the given book positions in that order (the records window's current view)."""
     df = load_data()
-    if df.empty:
+    if df.empty or (positions is not None and len(positions) == 0):
         messagebox.showinfo("Export", "No records to export.")
         return
     
     file_path = filedialog.asksaveasfilename(defaultextension=".csv",
-                                             filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
-                                             title="Export Records as CSV")
+                                             filetypes=[("CSV files", "*.csv"), ("Compressed CSV", "*.csv.gz *.csv.bz2 *.csv.xz *.csv.zst"),
+                                                        ("Parquet files", "*.parquet"), ("Arrow/Feather files", "*.arrow *.feather"),
+                                                        ("All files", "*.*")],
+                                             title="Export Records")
     if file_path:
         try:
-            df['Date'] = pd.to_datetime(df['Date']).dt.strftime('%Y-%m-%d')
-            df.to_csv(file_path, index=False)
-            messagebox.showinfo("Export Success", "Records exported to CSV successfully!")
+            write_records(df, file_path, positions)
+            messagebox.showinfo("Export Success", f"{len(df) if positions is None else len(positions)} records exported successfully!")
         except Exception as e:
             messagebox.showerror("Export Error", f"Failed to export records: {e}")
 
+# --- Cost Basis Methods ---
+
+class OpenLots:
+    """Open buy lots of one ticker, matched against sells in the order of the cost-basis method.
+
+    Lots are immutable (quantity, price, date) tuples. Subclasses only choose the container and which
+    lot is consumed next; running quantity and cost totals are kept so holdings never rescan lots.
+    """
+
+    def __init__(self):
+        self.lots = self.new_container()
+        self.quantity = 0.0
+        self.cost = 0.0
+
+    def new_container(self):
+        return deque()
+
+    def push(self, lot):
+        self.lots.append(lot)
+
+    def peek(self):
+        return self.lots[0]
+
+    def pop(self):
+        self.lots.popleft()
+
+    def replace_next(self, lot):
+        self.lots[0] = lot
+
+    def add(self, quantity, price, trade_date):
+        self.push((quantity, price, trade_date))
+        self.quantity += quantity
+        self.cost += quantity * price
+
+    def remove(self, quantity):
+        """Consumes up to `quantity` from the open lots and returns the matched (quantity, price, date) slices."""
+        slices = []
+        while quantity > 0 and self.lots:
+            lot_quantity, lot_price, lot_date = self.peek()
+            if quantity >= lot_quantity:
+                self.pop()
+                matched = lot_quantity
+            else:
+                self.replace_next((lot_quantity - quantity, lot_price, lot_date))
+                matched = quantity
+            slices.append((matched, lot_price, lot_date))
+            quantity -= matched
+            self.quantity -= matched
+            self.cost -= matched * lot_price
+        if not self.lots:
+            # Reset so floating point residue never shows up as a phantom position
+            self.quantity = 0.0
+            self.cost = 0.0
+        return slices
+
+    def sell_order(self):
+        """Returns the open (quantity, price, date) lots in the order sells consume them."""
+        return list(self.lots)
+
+    def copy(self):
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        clone.lots = type(self.lots)(self.lots)
+        return clone
+
+    def to_json(self):
+        """Returns the open lots as JSON data, in container order with dates as epoch nanoseconds."""
+        return {'lots': [[quantity, price, date_to_json(lot_date)] for quantity, price, lot_date in self.lots],
+                'quantity': self.quantity, 'cost': self.cost}
+
+    @classmethod
+    def from_json(cls, data):
+        lots = cls()
+        for quantity, price, lot_date in data['lots']:
+            lots.push((quantity, price, date_from_json(lot_date)))
+        lots.quantity = data['quantity']
+        lots.cost = data['cost']
+        return lots
+
+
+class FifoLots(OpenLots):
+    """First in, first out: a deque consumed from the left."""
+
+
+class LifoLots(OpenLots):
+    """Last in, first out: a list used as a stack."""
+
+    def new_container(self):
+        return []
+
+    def peek(self):
+        return self.lots[-1]
+
+    def pop(self):
+        self.lots.pop()
+
+    def replace_next(self, lot):
+        self.lots[-1] = lot
+
+    def sell_order(self):
+        return self.lots[::-1]
+
+
+class HifoLots(OpenLots):
+    """Highest in, first out: a heap keyed by negated price, ties broken by entry order."""
+
+    def __init__(self):
+        super().__init__()
+        self.sequence = 0
+
+    def new_container(self):
+        return []
+
+    def push(self, lot):
+        heapq.heappush(self.lots, (-lot[1], self.sequence, lot))
+        self.sequence += 1
+
+    def peek(self):
+        return self.lots[0][2]
+
+    def pop(self):
+        heapq.heappop(self.lots)
+
+    def replace_next(self, lot):
+        # Same price and sequence as the entry it replaces, so the heap order still holds
+        self.lots[0] = (self.lots[0][0], self.lots[0][1], lot)
+
+    def sell_order(self):
+        return [lot for _, _, lot in sorted(self.lots)]
+
+    def to_json(self):
+        # The heap is stored as is, so ties keep their entry order after a restore
+        return {'lots': [[key, sequence, [quantity, price, date_to_json(lot_date)]]
+                         for key, sequence, (quantity, price, lot_date) in self.lots],
+                'sequence': self.sequence, 'quantity': self.quantity, 'cost': self.cost}
+
+    @classmethod
+    def from_json(cls, data):
+        lots = cls()
+        lots.lots = [(key, sequence, (quantity, price, date_from_json(lot_date)))
+                     for key, sequence, (quantity, price, lot_date) in data['lots']]
+        lots.sequence = data['sequence']
+        lots.quantity = data['quantity']
+        lots.cost = data['cost']
+        return lots
+
+
+class AverageCostLots(OpenLots):
+    """Average cost: a running quantity and cost aggregate, every sell is matched at the average price."""
+
+    def __init__(self):
+        super().__init__()
+        self.opened = None # Date the current position was first opened
+
+    def new_container(self):
+        return None
+
+    def add(self, quantity, price, trade_date):
+        if self.quantity <= 0:
+            self.opened = trade_date
+        self.quantity += quantity
+        self.cost += quantity * price
+
+    def remove(self, quantity):
+        if self.quantity <= 0:
+            return []
+        matched = min(quantity, self.quantity)
+        average_price = self.cost / self.quantity
+        if matched >= self.quantity:
+            self.quantity = 0.0
+            self.cost = 0.0
+        else:
+            self.quantity -= matched
+            self.cost -= matched * average_price
+        return [(matched, average_price, self.opened)]
+
+    def sell_order(self):
+        return [(self.quantity, self.cost / self.quantity, self.opened)] if self.quantity > 0 else []
+
+    def copy(self):
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        return clone
+
+    def to_json(self):
+        return {'opened': date_to_json(self.opened), 'quantity': self.quantity, 'cost': self.cost}
+
+    @classmethod
+    def from_json(cls, data):
+        lots = cls()
+        lots.opened = date_from_json(data['opened'])
+        lots.quantity = data['quantity']
+        lots.cost = data['cost']
+        return lots
+
+
+def date_to_json(value):
+    """Stores a lot date as integer nanoseconds since the epoch (None when unset)."""
+    return None if value is None else int(np.datetime64(value, 'ns').astype(np.int64))
+
+
+def date_from_json(value):
+    return None if value is None else np.datetime64(value, 'ns')
+
+
+COST_BASIS_METHODS = {
+    'FIFO': FifoLots,
+    'LIFO': LifoLots,
+    'HIFO': HifoLots,
+    'Average': AverageCostLots
+}
+
+
+def get_cost_basis_method():
+    """Returns the cost-basis method selected for the current book."""
+    method = book_settings.get('cost_basis_method', 'FIFO')
+    return method if method in COST_BASIS_METHODS else 'FIFO'
+
+
 # --- Analytical Functions ---
 
-def calculate_realized_pnl(df):
-    pnl = {}
-    
+def prepare_trades(df):
+    """Returns the book date-sorted with parsed dates, used by all analytics.
+
+    A book already in that form (as load_data() returns it) is passed through instead of copied,
+    so the result must be treated as read-only.
+    """
+    dates = df['Date']
+    if (pd.api.types.is_datetime64_any_dtype(dates) and not dates.hasnans and dates.is_monotonic_increasing
+            and df.index.equals(pd.RangeIndex(len(df)))):
+        return df
+    df = df.copy()
     df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-    df_cleaned = df.dropna(subset=['Date']).copy() 
-    
-    df_cleaned = df_cleaned.sort_values(by='Date').reset_index(drop=True)
+    return sort_book(df.dropna(subset=['Date']))
+
+
+def resolve_date_range(period, custom_start=None, custom_end=None, today=None):
+    """Turns a period name from PERIOD_OPTIONS into an inclusive (start, end) date range.
+
+    Returns None for "All Time" so callers can skip range handling entirely.
+    """
+    today = pd.Timestamp(today or date.today()).normalize()
+    if period == "YTD":
+        return (pd.Timestamp(year=today.year, month=1, day=1), today)
+    if period == "MTD":
+        return (pd.Timestamp(year=today.year, month=today.month, day=1), today)
+    if period == "Custom":
+        start = pd.Timestamp(custom_start).normalize() if custom_start else None
+        end = pd.Timestamp(custom_end).normalize() if custom_end else None
+        if start is not None and end is not None and start > end:
+            raise ValueError("Start date must not be after end date.")
+        return (start, end)
+    return None
+
+
+def format_date_range(date_range):
+    """Returns a human readable label for a date range."""
+    if date_range is None:
+        return "All Time"
+    start, end = date_range
+    start_text = start.strftime('%Y-%m-%d') if start is not None else "Beginning"
+    end_text = end.strftime('%Y-%m-%d') if end is not None else "Today"
+    return f"{start_text} to {end_text}"
+
+
+def get_date_range_bounds(df, date_range, column='Date'):
+    """Returns the [lo, hi) row positions of date_range in a frame sorted by `column` using binary search."""
+    if date_range is None:
+        return 0, len(df)
+    start, end = date_range
+    lo = 0 if start is None else int(df[column].searchsorted(start, side='left'))
+    # The end date is inclusive, so search for the first row of the following day
+    hi = len(df) if end is None else int(df[column].searchsorted(end + pd.Timedelta(days=1), side='left'))
+    return lo, max(lo, hi)
+
+
+def apply_trades(lot_state, df, method=None, round_trips=None):
+    """Replays date-sorted trades onto lot_state in place, matching sells with the book's cost-basis method.
+
+    Returns two arrays aligned with the rows of df: the realized P&L of each trade and the change in
+    open quantity it caused (the full size of a buy, minus the matched size of a sell). When a
+    round_trips list is given, every matched slice is appended to it as (row, quantity, entry price, entry date).
+    """
+    trade_pnl = np.zeros(len(df))
+    position_change = np.zeros(len(df))
+    if df.empty:
+        return trade_pnl, position_change
+
+    lot_class = COST_BASIS_METHODS[method or get_cost_basis_method()]
+    tickers = df['Ticker'].to_numpy()
+    dates = df['Date'].to_numpy()
+    trade_types = df['Trade_Type'].astype(str).str.lower().to_numpy()
+    quantities = pd.to_numeric(df['Quantity'], errors='coerce').to_numpy(dtype=float)
+    prices = pd.to_numeric(df['Price'], errors='coerce').to_numpy(dtype=float)
+
+    for i in range(len(df)):
+        quantity = quantities[i]
+        price = prices[i]
+        if np.isnan(quantity) or np.isnan(price):
+            continue
+
+        state = lot_state.get(tickers[i])
+        if state is None:
+            state = lot_state[tickers[i]] = {'lots': lot_class(), 'realized_pnl': 0.0}
+        lots = state['lots']
+
+        if trade_types[i] == 'buy':
+            lots.add(quantity, price, dates[i])
+            position_change[i] = quantity
+        elif trade_types[i] == 'sell':
+            realized_pnl = 0.0
+            matched_quantity = 0.0
+            for lot_quantity, lot_price, lot_date in lots.remove(quantity):
+                realized_pnl += (price - lot_price) * lot_quantity
+                matched_quantity += lot_quantity
+                if round_trips is not None:
+                    round_trips.append((i, lot_quantity, lot_price, lot_date))
+            state['realized_pnl'] += realized_pnl
+            trade_pnl[i] = realized_pnl
+            position_change[i] = -matched_quantity
+
+    return trade_pnl, position_change
+
+
+def get_lot_state_at(df, position):
+    """Returns the lot state after replaying the first `position` rows of a date-sorted book.
+
+    Replay starts from the latest year-end checkpoint before position, so only recent trades are matched.
+    Results for books returned by load_data() are cached per book version, so repeated period
+    reports only pay for replaying the history before the period once. Do not mutate the result.
+    """
+    signature = df.attrs.get('book_signature')
+    cache_key = (signature, get_cost_basis_method(), len(df), position) if signature else None
+    if cache_key in lot_state_cache:
+        return lot_state_cache[cache_key]
+
+    lot_state, start = restore_checkpoint(df, position)
+    apply_trades(lot_state, df.iloc[start:position])
+
+    if cache_key:
+        if len(lot_state_cache) >= MAX_LOT_STATE_CACHE:
+            lot_state_cache.pop(next(iter(lot_state_cache)))
+        lot_state_cache[cache_key] = lot_state
+    return lot_state
+
+
+def holdings_from_lot_state(lot_state):
+    """Summarizes open lots into {ticker: {'quantity', 'average_buy_price'}} for positive positions."""
+    holdings = {}
+    for ticker, state in lot_state.items():
+        lots = state['lots']
+        if lots.quantity > 0:
+            holdings[ticker] = {'quantity': lots.quantity, 'average_buy_price': lots.cost / lots.quantity}
+    return holdings
 
-    for ticker in df_cleaned['Ticker'].unique():
-        ticker_trades = df_cleaned[df_cleaned['Ticker'] == ticker].copy()
-        
-        ticker_trades['Quantity'] = pd.to_numeric(ticker_trades['Quantity'], errors='coerce')
-        ticker_trades['Price'] = pd.to_numeric(ticker_trades['Price'], errors='coerce')
-        ticker_trades = ticker_trades.dropna(subset=['Quantity', 'Price'])
 
-        buys = ticker_trades[ticker_trades['Trade_Type'].str.lower() == 'buy']
-        sells = ticker_trades[ticker_trades['Trade_Type'].str.lower() == 'sell']
-        
-        realized_pnl = 0
-        
-        buy_queue = [] # Stores (quantity, price) for buys (FIFO)
 
-        for index, row in buys.iterrows():
-            buy_queue.append({'quantity': row['Quantity'], 'price': row['Price']})
-        
-        for index, row in sells.iterrows():
-            sell_quantity = row['Quantity']
-            sell_price = row['Price']
-            
-            while sell_quantity > 0 and buy_queue:
-                buy_data = buy_queue[0]
-                buy_quantity = buy_data['quantity']
-                buy_price = buy_data['price']
-                
-                if sell_quantity >= buy_quantity:
-                    realized_pnl += (sell_price - buy_price) * buy_quantity
-                    sell_quantity -= buy_quantity
-                    buy_queue.pop(0)
-                else:
-                    realized_pnl += (sell_price - buy_price) * sell_quantity
-                    buy_data['quantity'] -= sell_quantity
-                    sell_quantity = 0
+# --- Lot State Checkpoints ---
 
-        pnl[ticker] = realized_pnl
-    return pnl
+def book_partitions(df, today=None):
+    """Splits a date-sorted book into calendar years and returns the closed ones as (year, end position, digest).
 
-def calculate_cumulative_pnl_per_ticker(df):
-    """Calculates cumulative P&L for each ticker over time."""
-    df_cleaned = df.dropna(subset=['Date', 'Quantity', 'Price']).copy()
-    df_cleaned['Date'] = pd.to_datetime(df_cleaned['Date'])
-    df_cleaned = df_cleaned.sort_values(by='Date')
+    The digest chains the trades of every year up to and including this one, so an edit changes the
+    digest of its own year and of all later years, never of the years before it.
+    """
+    current_year = pd.Timestamp(today or date.today()).year
+    cache_key = (df.attrs.get('book_signature'), len(df), current_year)
+    if cache_key in partition_cache:
+        return partition_cache[cache_key]
 
-    cumulative_pnl_data = {}
+    years = df['Date'].dt.year.to_numpy()
+    row_hashes = pd.util.hash_pandas_object(df[CHECKPOINT_COLUMNS], index=False).to_numpy()
+    partitions = []
+    digest = b''
+    start = 0
+    for year in np.unique(years[years < current_year]):
+        end = int(np.searchsorted(years, year, side='right'))
+        digest = hashlib.blake2b(digest + row_hashes[start:end].tobytes(), digest_size=16).digest()
+        partitions.append((int(year), end, digest.hex()))
+        start = end
 
-    for ticker in df_cleaned['Ticker'].unique():
-        ticker_trades = df_cleaned[df_cleaned['Ticker'] == ticker].copy()
-        
-        buy_queue = [] # Stores (quantity, price) for buys
-        daily_pnl = {}
-        current_cumulative_pnl = 0
-
-        for index, row in ticker_trades.iterrows():
-            trade_date = row['Date'].strftime('%Y-%m-%d')
-            quantity = row['Quantity']
-            price = row['Price']
-            trade_type = row['Trade_Type'].lower()
-
-            if trade_type == 'buy':
-                buy_queue.append({'quantity': quantity, 'price': price})
-            elif trade_type == 'sell':
-                sell_quantity = quantity
-                sell_price = price
-                
-                while sell_quantity > 0 and buy_queue:
-                    buy_data = buy_queue[0]
-                    buy_quantity_in_lot = buy_data['quantity']
-                    buy_price_in_lot = buy_data['price']
-                    
-                    if sell_quantity >= buy_quantity_in_lot:
-                        pnl_from_lot = (sell_price - buy_price_in_lot) * buy_quantity_in_lot
-                        current_cumulative_pnl += pnl_from_lot
-                        sell_quantity -= buy_quantity_in_lot
-                        buy_queue.pop(0)
-                    else:
-                        pnl_from_lot = (sell_price - buy_price_in_lot) * sell_quantity
-                        current_cumulative_pnl += pnl_from_lot
-                        buy_data['quantity'] -= sell_quantity
-                        sell_quantity = 0
-            
-            daily_pnl[trade_date] = current_cumulative_pnl
-        
-        if daily_pnl:
-            pnl_series = pd.Series(daily_pnl)
-            idx = pd.date_range(start=pnl_series.index.min(), end=pnl_series.index.max())
-            pnl_series.index = pd.to_datetime(pnl_series.index)
-            pnl_series = pnl_series.reindex(idx, method='ffill')
-            pnl_series = pnl_series.fillna(0)
-            cumulative_pnl_data[ticker] = pnl_series
-    
-    return cumulative_pnl_data
+    if len(partition_cache) >= MAX_PARTITION_CACHE:
+        partition_cache.pop(next(iter(partition_cache)))
+    partition_cache[cache_key] = partitions
+    return partitions
 
 
-def get_current_holdings(df):
-    holdings = {}
-    
-    df['Date'] = pd.to_datetime(df['Date'], errors='coerce')
-    df_cleaned = df.dropna(subset=['Date']).copy() 
-    
-    df_cleaned = df_cleaned.sort_values(by='Date').reset_index(drop=True)
+def lot_state_to_json(lot_state):
+    return [[ticker, state['lots'].to_json(), state['realized_pnl']] for ticker, state in lot_state.items()]
 
-    for ticker in df_cleaned['Ticker'].unique():
-        ticker_trades = df_cleaned[df_cleaned['Ticker'] == ticker].copy()
-        
-        ticker_trades['Quantity'] = pd.to_numeric(ticker_trades['Quantity'], errors='coerce')
-        ticker_trades['Price'] = pd.to_numeric(ticker_trades['Price'], errors='coerce')
-        ticker_trades = ticker_trades.dropna(subset=['Quantity', 'Price'])
-
-        net_quantity = 0
-        buy_queue = []    
-
-        for index, row in ticker_trades.iterrows():
-            if row['Trade_Type'].lower() == 'buy':
-                net_quantity += row['Quantity']
-                buy_queue.append({'quantity': row['Quantity'], 'price': row['Price']})
-            elif row['Trade_Type'].lower() == 'sell':
-                sell_quantity = row['Quantity']
-                while sell_quantity > 0 and buy_queue:
-                    buy_data = buy_queue[0]
-                    buy_quantity_in_lot = buy_data['quantity']
-                    
-                    if sell_quantity >= buy_quantity_in_lot:
-                        sell_quantity -= buy_quantity_in_lot
-                        net_quantity -= buy_quantity_in_lot
-                        buy_queue.pop(0)
-                    else:
-                        buy_data['quantity'] -= sell_quantity
-                        net_quantity -= sell_quantity
-                        sell_quantity = 0
-
-        if net_quantity > 0:
-            remaining_value = sum(item['quantity'] * item['price'] for item in buy_queue)
-            average_price = remaining_value / net_quantity if net_quantity != 0 else 0
-            holdings[ticker] = {'quantity': net_quantity, 'average_buy_price': average_price}
-        elif net_quantity == 0:
-            holdings[ticker] = {'quantity': 0, 'average_buy_price': 0}
-            
-    return {k: v for k, v in holdings.items() if v['quantity'] > 0}
 
-def calculate_performance_metrics(df):
-    total_buy_value = df[df['Trade_Type'].str.lower() == 'buy']['Total'].sum()
-    total_sell_value = df[df['Trade_Type'].str.lower() == 'sell']['Total'].sum()
-    
-    realized_pnl = calculate_realized_pnl(df.copy())
+def lot_state_from_json(data, lot_class):
+    return {ticker: {'lots': lot_class.from_json(lots), 'realized_pnl': realized_pnl} for ticker, lots, realized_pnl in data}
+
+
+def load_checkpoints():
+    """Returns the persisted checkpoints of the current book as {cost-basis method: [checkpoint, ...]}."""
+    path = sidecar_path('.checkpoints.json')
+    signature = file_signature(path)
+    cached = checkpoint_cache.get(path)
+    if cached is None or cached['signature'] != signature:
+        try:
+            with open(path) as f:
+                checkpoints = json.load(f)
+        except (OSError, ValueError):
+            checkpoints = {}
+        cached = checkpoint_cache[path] = {'signature': signature, 'checkpoints': checkpoints}
+    return cached['checkpoints']
+
+
+def persist_checkpoints(method, method_checkpoints):
+    """Replaces the checkpoints of one cost-basis method, keeping those of the other methods."""
+    path = sidecar_path('.checkpoints.json')
+    checkpoints = dict(load_checkpoints(), **{method: method_checkpoints})
+
+    def write_checkpoints(temp_path):
+        with open(temp_path, 'w') as f:
+            json.dump(checkpoints, f)
+
+    try:
+        atomic_write(path, write_checkpoints)
+        checkpoint_cache[path] = {'signature': file_signature(path), 'checkpoints': checkpoints}
+    except OSError as e:
+        logger.warning("Could not persist lot checkpoints: %s", e)
+
+
+def restore_checkpoint(df, position):
+    """Returns (lot state, start position) to resume a replay of the first `position` rows of a date-sorted book.
+
+    The state is the latest year-end checkpoint at or before position, holding the open lots and cumulative
+    realized P&L per ticker. Checkpoints whose partitions no longer match the book are dropped, and missing
+    ones up to position are built one year at a time from the last valid checkpoint and persisted.
+    Any DataFrame other than the current book version replays from the start.
+    """
+    signature = df.attrs.get('book_signature')
+    if signature is None or signature != book_signature():
+        return {}, 0
+
+    method = get_cost_basis_method()
+    lot_class = COST_BASIS_METHODS[method]
+    partitions = book_partitions(df)
+    stored = load_checkpoints().get(method, [])
+    checkpoints = []
+    for (year, end, digest), checkpoint in zip(partitions, stored):
+        if checkpoint['year'] != year or checkpoint['position'] != end or checkpoint['digest'] != digest:
+            break
+        checkpoints.append(checkpoint)
+    changed = len(checkpoints) != len(stored)
+
+    missing = [partition for partition in partitions[len(checkpoints):] if partition[1] <= position]
+    if missing:
+        if checkpoints:
+            lot_state = lot_state_from_json(checkpoints[-1]['lot_state'], lot_class)
+            start = checkpoints[-1]['position']
+        else:
+            lot_state, start = {}, 0
+        for year, end, digest in missing:
+            apply_trades(lot_state, df.iloc[start:end], method)
+            checkpoints.append({'year': year, 'position': end, 'digest': digest, 'lot_state': lot_state_to_json(lot_state)})
+            start = end
+        changed = True
+    if changed:
+        persist_checkpoints(method, checkpoints)
+
+    usable = [checkpoint for checkpoint in checkpoints if checkpoint['position'] <= position]
+    if not usable:
+        return {}, 0
+    return lot_state_from_json(usable[-1]['lot_state'], lot_class), usable[-1]['position']
+
+
+def build_round_trips(df):
+    """Returns one row per matched lot slice of a date-sorted book, in exit order.
+
+    P&L is converted into the reporting currency at the exit date, like the realized P&L of the rollups;
+    Holding_Days is the time between entry and exit in fractional days.
+    """
+    slices = []
+    apply_trades({}, df, round_trips=slices)
+    return round_trip_frame(df, slices)
+
+
+def round_trip_frame(df, slices):
+    """Turns the (row, quantity, entry price, entry date) slices recorded by apply_trades over df into round-trip rows."""
+    if not slices:
+        return pd.DataFrame({
+            'Ticker': pd.Series(dtype=object), 'Entry_Date': pd.Series(dtype='datetime64[ns]'),
+            'Exit_Date': pd.Series(dtype='datetime64[ns]'), **{column: pd.Series(dtype=float) for column in ROUND_TRIP_COLUMNS[3:]}
+        })[ROUND_TRIP_COLUMNS]
+
+    rows, quantities, entry_prices, entry_dates = zip(*slices)
+    rows = np.asarray(rows)
+    quantities = np.asarray(quantities, dtype=float)
+    entry_prices = np.asarray(entry_prices, dtype=float)
+    entry_dates = np.asarray(entry_dates, dtype='datetime64[ns]')
+    tickers = df['Ticker'].to_numpy()[rows]
+    exit_dates = df['Date'].to_numpy()[rows]
+    exit_prices = pd.to_numeric(df['Price'], errors='coerce').to_numpy(dtype=float)[rows]
+    rates = conversion_rates(quote_assets_for(tickers), exit_dates)
+    return pd.DataFrame({
+        'Ticker': tickers,
+        'Entry_Date': entry_dates,
+        'Exit_Date': exit_dates,
+        'Quantity': quantities,
+        'Entry_Price': entry_prices,
+        'Exit_Price': exit_prices,
+        'PnL': (exit_prices - entry_prices) * quantities * rates,
+        'Holding_Days': (exit_dates - entry_dates) / np.timedelta64(1, 'D'),
+    })
+
+
+def get_round_trips(df, date_range=None):
+    """Returns the round trips of a book that were closed inside date_range.
+
+    The full table is cached per book version and settings, so period reports only slice it.
+    """
+    df = prepare_trades(df)
+    signature = df.attrs.get('book_signature')
+    cache_key = (signature, get_cost_basis_method(), json.dumps(fx_signature()), len(df)) if signature else None
+    round_trips = round_trip_cache.get(cache_key) if cache_key else None
+    if round_trips is None:
+        round_trips = build_round_trips(df)
+        if cache_key:
+            if len(round_trip_cache) >= MAX_ROUND_TRIP_CACHE:
+                round_trip_cache.pop(next(iter(round_trip_cache)))
+            round_trip_cache[cache_key] = round_trips
+    lo, hi = get_date_range_bounds(round_trips, date_range, column='Exit_Date')
+    return round_trips.iloc[lo:hi]
+
+
+def iter_round_trips(df, date_range=None, block_rows=EXPORT_CHUNK_ROWS):
+    """Yields the round trips closed inside date_range as DataFrames, one per block of block_rows trades.
+
+    Trades before the range only rebuild the lot state (from the cached state or nearest checkpoint),
+    and each block's slices are released once yielded, so memory does not grow with the report.
+    """
+    df = prepare_trades(df)
+    lo, hi = get_date_range_bounds(df, date_range)
+    lot_state = {ticker: dict(state, lots=state['lots'].copy()) for ticker, state in get_lot_state_at(df, lo).items()}
+    for start in range(lo, hi, block_rows):
+        block = df.iloc[start:min(start + block_rows, hi)]
+        slices = []
+        apply_trades(lot_state, block, round_trips=slices)
+        if slices:
+            yield round_trip_frame(block, slices)
+
+
+def tax_lot_rows(round_trips):
+    """Turns round trips into realized-gain report rows, money converted into the reporting currency at the sale date."""
+    rates = conversion_rates(quote_assets_for(round_trips['Ticker'].to_numpy()), round_trips['Exit_Date'].to_numpy())
+    quantities = round_trips['Quantity'].to_numpy()
+    cost_basis = quantities * round_trips['Entry_Price'].to_numpy() * rates
+    proceeds = quantities * round_trips['Exit_Price'].to_numpy() * rates
+    holding_days = round_trips['Holding_Days'].to_numpy()
+    return pd.DataFrame({
+        'Ticker': round_trips['Ticker'].to_numpy(),
+        'Acquired': round_trips['Entry_Date'].to_numpy(),
+        'Sold': round_trips['Exit_Date'].to_numpy(),
+        'Quantity': quantities,
+        'Cost_Basis': cost_basis,
+        'Proceeds': proceeds,
+        'Gain': proceeds - cost_basis,
+        'Holding_Days': holding_days,
+        'Term': np.where(holding_days > LONG_TERM_DAYS, 'Long', 'Short'),
+    })
+
+
+# --- P&L Rollups ---
+
+def trade_rollup_rows(df, trade_pnl, position_change):
+    """Turns date-sorted trades and their replay results into one rollup contribution per trade.
+
+    Money columns are converted into the reporting currency at each trade's date; Volume and
+    Position_Change stay in units of the base asset.
+    """
+    trade_types = df['Trade_Type'].astype(str).str.lower().to_numpy()
+    totals = pd.to_numeric(df['Total'], errors='coerce').fillna(0).to_numpy()
+    prices = pd.to_numeric(df['Price'], errors='coerce').fillna(0).to_numpy()
+    rates = conversion_rates(quote_assets_for(df['Ticker'].to_numpy()), df['Date'].to_numpy())
+    # Cost basis added by buys, and released by sells (matched proceeds minus the P&L they realized)
+    cost_change = np.where(position_change >= 0, position_change * prices, position_change * prices + trade_pnl) * rates
+    return pd.DataFrame({
+        'Date': df['Date'].dt.normalize().to_numpy(),
+        'Ticker': df['Ticker'].to_numpy(),
+        'Bought': np.where(trade_types == 'buy', totals, 0.0) * rates,
+        'Sold': np.where(trade_types == 'sell', totals, 0.0) * rates,
+        'Realized_PnL': trade_pnl * rates,
+        'Trades': 1,
+        'Volume': pd.to_numeric(df['Quantity'], errors='coerce').fillna(0).to_numpy(),
+        'Position_Change': position_change,
+        'Cost_Change': cost_change,
+    })
+
+
+def aggregate_rollup(trade_rows, freq):
+    """Groups per-trade rollup rows by day ('D') or calendar month ('M') and ticker."""
+    if freq == 'M':
+        period = trade_rows['Date'].dt.to_period('M').dt.to_timestamp()
+    else:
+        period = trade_rows['Date']
+    grouped = trade_rows.assign(Period=period).groupby(['Period', 'Ticker'], as_index=False, sort=False)[ROLLUP_VALUES].sum()
+    return grouped[ROLLUP_COLUMNS]
+
+
+def with_rollup_totals(rollup):
+    """Recomputes the ROLLUP_TOTAL rows of a rollup from its per-ticker rows and sorts it by Period."""
+    per_ticker = rollup[rollup['Ticker'] != ROLLUP_TOTAL]
+    totals = per_ticker.groupby('Period', as_index=False)[ROLLUP_VALUES].sum()
+    totals['Ticker'] = ROLLUP_TOTAL
+    combined = pd.concat([per_ticker, totals[ROLLUP_COLUMNS]], ignore_index=True)
+    return combined.sort_values(by='Period', kind='mergesort').reset_index(drop=True)
+
+
+def build_rollups(df, tickers=None):
+    """Builds daily and monthly rollups for a date-sorted book, or only for the given tickers."""
+    if tickers is not None:
+        df = df[df['Ticker'].isin(tickers)]
+    trade_rows = trade_rollup_rows(df, *apply_trades({}, df))
+    return {
+        'daily': with_rollup_totals(aggregate_rollup(trade_rows, 'D')),
+        'monthly': with_rollup_totals(aggregate_rollup(trade_rows, 'M')),
+    }
+
+
+def update_rollups(rollups, df, tickers):
+    """Rebuilds the rollup rows of the changed tickers only, keeping every other ticker's rows.
+
+    Lots never cross tickers, so a trade change can only alter the realized P&L of its own ticker.
+    """
+    tickers = list(tickers)
+    rebuilt = build_rollups(df, tickers)
+    for key in ('daily', 'monthly'):
+        current = rollups[key]
+        kept = current[~current['Ticker'].isin(tickers + [ROLLUP_TOTAL])]
+        changed = rebuilt[key][rebuilt[key]['Ticker'] != ROLLUP_TOTAL]
+        rollups[key] = with_rollup_totals(pd.concat([kept, changed], ignore_index=True))
+    return rollups
+
+
+def rollup_settings():
+    """Returns the book settings the rollups depend on, in the JSON form they are persisted with."""
+    return {'cost_basis_method': get_cost_basis_method(), 'fx_signature': fx_signature()}
+
+
+def rollups_describe(meta, signature):
+    """Tells whether rollup metadata was produced for this book version and the current rollup settings."""
+    return (signature is not None and tuple(meta.get('book_signature') or ()) == tuple(signature)
+            and all(meta.get(key) == value for key, value in rollup_settings().items()))
+
+
+def load_persisted_rollups(signature):
+    """Loads the rollup sidecar files if they were written for this exact book version."""
+    try:
+        with open(sidecar_path('.rollups.json')) as f:
+            meta = json.load(f)
+        if not rollups_describe(meta, signature):
+            return None
+        rollups = {key: pd.read_csv(sidecar_path(f'.{key}_rollup.csv'), dtype={'Ticker': str}, parse_dates=['Period'])
+                   for key in ('daily', 'monthly')}
+        # Rollups written by an older layout are rebuilt rather than misread
+        if any(rollup.columns.tolist() != ROLLUP_COLUMNS for rollup in rollups.values()):
+            return None
+        return rollups
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def persist_rollups(rollups, signature):
+    """Writes the rollups next to the book, tagged with the book version they describe.
+
+    The metadata is removed first and written last, so a concurrent reader either finds rollups that
+    match their metadata or no metadata at all (and rebuilds).
+    """
+    def write_meta(temp_path):
+        with open(temp_path, 'w') as f:
+            json.dump(dict(rollup_settings(), book_signature=list(signature)), f)
+
+    try:
+        if os.path.exists(sidecar_path('.rollups.json')):
+            os.remove(sidecar_path('.rollups.json'))
+        for key in ('daily', 'monthly'):
+            atomic_write(sidecar_path(f'.{key}_rollup.csv'), lambda temp_path, key=key: rollups[key].to_csv(temp_path, index=False))
+        atomic_write(sidecar_path('.rollups.json'), write_meta)
+    except OSError as e:
+        logger.warning("Could not persist rollups: %s", e)
+
+
+def refresh_rollups(df, previous_signature, changed_tickers=None):
+    """Brings the materialized rollups in line with a freshly saved book.
+
+    When the rollups for the previous book version are at hand and the changed tickers are known,
+    only those tickers are recomputed; otherwise the rollups are rebuilt from scratch.
+    """
+    global rollup_cache
+    signature = book_signature()
+    if signature is None:
+        return
+    rollups = None
+    if changed_tickers is not None and previous_signature is not None:
+        if rollups_describe(rollup_cache, previous_signature):
+            rollups = {'daily': rollup_cache['daily'], 'monthly': rollup_cache['monthly']}
+        else:
+            rollups = load_persisted_rollups(previous_signature)
+    if rollups is None:
+        rollups = build_rollups(df)
+    elif changed_tickers:
+        rollups = update_rollups(rollups, df, changed_tickers)
+    persist_rollups(rollups, signature)
+    rollup_cache = dict(rollups, book_signature=signature, **rollup_settings())
+
+
+def get_rollups(df):
+    """Returns the daily and monthly rollups for a date-sorted book.
+
+    Books returned by load_data() are served from memory or the persisted sidecar files; any other
+    DataFrame gets its rollups computed on the fly.
+    """
+    global rollup_cache
+    signature = df.attrs.get('book_signature')
+    if signature is None or signature != book_signature():
+        return build_rollups(df)
+    if rollups_describe(rollup_cache, signature):
+        return rollup_cache
+
+    rollups = load_persisted_rollups(signature)
+    if rollups is None:
+        rollups = build_rollups(df)
+        persist_rollups(rollups, signature)
+    rollup_cache = dict(rollups, book_signature=signature, **rollup_settings())
+    return rollup_cache
+
+
+def get_daily_rollup(df, date_range=None, ticker=ROLLUP_TOTAL):
+    """Returns the daily rollup rows of one ticker (or the totals) inside date_range, indexed by day."""
+    daily = get_rollups(df)['daily']
+    rows = daily[daily['Ticker'] == ticker].reset_index(drop=True)
+    lo, hi = get_date_range_bounds(rows, date_range, column='Period')
+    return rows.iloc[lo:hi].set_index('Period')
+
+
+def sum_rollups(df, date_range=None):
+    """Totals the rollup values per ticker over date_range.
+
+    Whole calendar months inside the range are read from the monthly rollup and only the partial
+    months at either end from the daily rollup, so the cost tracks the number of periods, not trades.
+    """
+    rollups = get_rollups(df)
+    daily, monthly = rollups['daily'], rollups['monthly']
+    if date_range is None:
+        parts = [monthly]
+    else:
+        start, end = date_range
+        # Whole months inside the range are [first_month, end_month)
+        first_month = None if start is None else (start if start.is_month_start else start + pd.offsets.MonthBegin(1))
+        end_month = None if end is None else (end + pd.Timedelta(days=1)).to_period('M').to_timestamp()
+        if first_month is not None and end_month is not None and first_month >= end_month:
+            lo, hi = get_date_range_bounds(daily, date_range, column='Period')
+            parts = [daily.iloc[lo:hi]]
+        else:
+            parts = []
+            if first_month is not None:
+                lo, hi = get_date_range_bounds(daily, (start, first_month - pd.Timedelta(days=1)), column='Period')
+                parts.append(daily.iloc[lo:hi])
+            month_end = None if end_month is None else end_month - pd.Timedelta(days=1)
+            lo, hi = get_date_range_bounds(monthly, (first_month, month_end), column='Period')
+            parts.append(monthly.iloc[lo:hi])
+            if end_month is not None:
+                lo, hi = get_date_range_bounds(daily, (end_month, end), column='Period')
+                parts.append(daily.iloc[lo:hi])
+    combined = pd.concat(parts, ignore_index=True)
+    return combined.groupby('Ticker', sort=False)[ROLLUP_VALUES].sum()
+
+
+def calculate_realized_pnl(df, date_range=None):
+    """Returns realized P&L per ticker, optionally limited to sells inside date_range."""
+    sums = sum_rollups(prepare_trades(df), date_range)
+    return sums['Realized_PnL'].drop(ROLLUP_TOTAL, errors='ignore').to_dict()
+
+def calculate_cumulative_pnl_per_ticker(df, date_range=None, tickers=None):
+    """Calculates cumulative P&L for each ticker (or only the given tickers) over time from the daily rollup."""
+    daily = get_rollups(prepare_trades(df))['daily']
+    lo, hi = get_date_range_bounds(daily, date_range, column='Period')
+    period_rows = daily.iloc[lo:hi]
+    period_rows = period_rows[period_rows['Ticker'] != ROLLUP_TOTAL]
+    if tickers is not None:
+        period_rows = period_rows[period_rows['Ticker'].isin(tickers)]
+
+    cumulative_pnl_data = {}
+    for ticker, ticker_rows in period_rows.groupby('Ticker', sort=False):
+        pnl_series = ticker_rows.set_index('Period')['Realized_PnL'].cumsum()
+        idx = pd.date_range(start=pnl_series.index.min(), end=pnl_series.index.max())
+        cumulative_pnl_data[ticker] = pnl_series.reindex(idx, method='ffill').fillna(0)
+
+    return cumulative_pnl_data
+
+
+def calculate_total_cumulative_pnl(df, date_range=None):
+    """Returns the daily cumulative net cash flow (sells minus buys) of the whole book from the daily rollup."""
+    daily_totals = get_daily_rollup(prepare_trades(df), date_range)
+    overall_daily_pnl_df = (daily_totals['Sold'] - daily_totals['Bought']).to_frame('Trade_Value')
+    overall_daily_pnl_df['Cumulative_P&L'] = overall_daily_pnl_df['Trade_Value'].cumsum()
+    if not overall_daily_pnl_df.empty:
+        idx = pd.date_range(start=overall_daily_pnl_df.index.min(), end=overall_daily_pnl_df.index.max())
+        overall_daily_pnl_df = overall_daily_pnl_df.reindex(idx, method='ffill').fillna(0)
+    return overall_daily_pnl_df
+
+
+def get_current_holdings(df, date_range=None):
+    """Returns open positions, as of the end of date_range when one is given."""
+    df = prepare_trades(df)
+    _, hi = get_date_range_bounds(df, date_range)
+    return holdings_from_lot_state(get_lot_state_at(df, hi))
+
+def calculate_trade_statistics(round_trips):
+    """Computes per-trade statistics of a round-trip table in one pass over its columns.
+
+    Every matched lot slice counts as one closed trade. Drawdown, Sharpe and Sortino are taken on the
+    realized P&L per calendar day between the first and last exit; ratios that are undefined are None.
+    """
+    pnl = round_trips['PnL'].to_numpy(dtype=float)
+    holding_days = round_trips['Holding_Days'].to_numpy(dtype=float)
+    statistics = {
+        'closed_trades': len(pnl), 'win_rate': 0.0, 'avg_profit_per_trade': 0.0, 'avg_loss_per_trade': 0.0,
+        'profit_factor': None, 'expectancy': 0.0, 'max_drawdown': 0.0, 'sharpe_ratio': None, 'sortino_ratio': None,
+        'holding_days': {'min': 0.0, 'p25': 0.0, 'median': 0.0, 'p75': 0.0, 'max': 0.0, 'mean': 0.0},
+    }
+    if not len(pnl):
+        return statistics
+
+    wins = pnl > 0
+    losses = pnl < 0
+    gross_profit = pnl[wins].sum()
+    gross_loss = -pnl[losses].sum()
+    win_count = int(wins.sum())
+    loss_count = int(losses.sum())
+    if win_count + loss_count:
+        statistics['win_rate'] = win_count / (win_count + loss_count) * 100
+    if win_count:
+        statistics['avg_profit_per_trade'] = gross_profit / win_count
+    if loss_count:
+        statistics['avg_loss_per_trade'] = gross_loss / loss_count
+        statistics['profit_factor'] = gross_profit / gross_loss
+    statistics['expectancy'] = pnl.mean()
+
+    # Realized P&L per calendar day, days without exits counting as zero
+    exit_days = round_trips['Exit_Date'].to_numpy().astype('datetime64[D]')
+    day_offsets = (exit_days - exit_days[0]).astype(np.int64)
+    daily_pnl = np.bincount(day_offsets, weights=pnl)
+    equity = np.cumsum(daily_pnl)
+    peaks = np.maximum.accumulate(np.maximum(equity, 0.0))
+    statistics['max_drawdown'] = float((peaks - equity).max())
+    if len(daily_pnl) > 1:
+        mean_daily_pnl = daily_pnl.mean()
+        deviation = daily_pnl.std(ddof=1)
+        downside_deviation = np.sqrt(np.mean(np.minimum(daily_pnl, 0.0) ** 2))
+        if deviation > 0:
+            statistics['sharpe_ratio'] = mean_daily_pnl / deviation * np.sqrt(PERIODS_PER_YEAR)
+        if downside_deviation > 0:
+            statistics['sortino_ratio'] = mean_daily_pnl / downside_deviation * np.sqrt(PERIODS_PER_YEAR)
+
+    quantiles = np.percentile(holding_days, [0, 25, 50, 75, 100])
+    statistics['holding_days'] = dict(zip(['min', 'p25', 'median', 'p75', 'max'], quantiles.tolist()), mean=float(holding_days.mean()))
+    return {key: value.item() if isinstance(value, np.generic) else value for key, value in statistics.items()}
+
+
+def calculate_performance_metrics(df, date_range=None):
+    sums = sum_rollups(prepare_trades(df), date_range)
+
+    total_buy_value = sums['Bought'].get(ROLLUP_TOTAL, 0.0)
+    total_sell_value = sums['Sold'].get(ROLLUP_TOTAL, 0.0)
+
+    realized_pnl = sums['Realized_PnL'].drop(ROLLUP_TOTAL, errors='ignore').to_dict()
     total_realized_pnl = sum(realized_pnl.values())
 
     if total_buy_value > 0:
@@ -648,234 +2644,816 @@ def calculate_performance_metrics(df):
     else:
         total_roi = 0.0
 
-    win_trades = sum(1 for pnl in realized_pnl.values() if pnl > 0)
-    loss_trades = sum(1 for pnl in realized_pnl.values() if pnl < 0)
-    total_closed_trades = win_trades + loss_trades
-    
-    win_rate = (win_trades / total_closed_trades * 100) if total_closed_trades > 0 else 0.0
+    # Win rate, averages and risk statistics are per closed trade, from the round trips of the lot matcher
+    return dict(calculate_trade_statistics(get_round_trips(df, date_range)),
+                total_realized_pnl=total_realized_pnl, total_roi=total_roi)
 
-    avg_profit_per_trade = (sum(p for p in realized_pnl.values() if p > 0) / win_trades) if win_trades > 0 else 0.0
-    avg_loss_per_trade = (sum(abs(p) for p in realized_pnl.values() if p < 0) / loss_trades) if loss_trades > 0 else 0.0
+# --- Quote Currency Conversion ---
 
-    return {
-        'total_realized_pnl': total_realized_pnl,
-        'total_roi': total_roi,
-        'win_rate': win_rate,
-        'avg_profit_per_trade': avg_profit_per_trade,
-        'avg_loss_per_trade': avg_loss_per_trade
-    }
+@functools.lru_cache(maxsize=None)
+def parse_ticker(ticker):
+    """Splits a ticker such as 'CAKE/USDT', 'ETH-USD' or 'BTCUSDT' into (base, quote).
+
+    '/' always separates the quote asset. '-' and '_' do so only before a known quote asset, since they
+    are also part of symbols such as 'BRK-B'. Other symbols are split on the longest known quote asset
+    suffix; quote is None when it is unknown.
+    """
+    ticker = str(ticker).strip().upper()
+    if '/' in ticker:
+        base, _, quote = ticker.partition('/')
+        return base, quote
+    for separator in ('-', '_'):
+        base, found, quote = ticker.rpartition(separator)
+        if found and base and quote in KNOWN_QUOTE_ASSETS:
+            return base, quote
+    for quote in sorted(KNOWN_QUOTE_ASSETS, key=len, reverse=True):
+        if ticker.endswith(quote) and len(ticker) > len(quote):
+            return ticker[:-len(quote)], quote
+    return ticker, None
+
+
+def quote_assets_for(tickers):
+    """Maps an array of tickers to their quote assets, parsing each distinct ticker once."""
+    tickers = pd.Series(np.asarray(tickers, dtype=object))
+    quote_by_ticker = {ticker: parse_ticker(ticker)[1] for ticker in tickers.unique()}
+    return tickers.map(quote_by_ticker).to_numpy(dtype=object)
+
+
+def get_reporting_currency():
+    """Returns the reporting currency of the current book, or '' when values are left in their quote currency."""
+    return str(book_settings.get('reporting_currency') or '').strip().upper()
+
+
+def reporting_currency_label():
+    currency = get_reporting_currency()
+    return f" ({currency})" if currency else ""
+
+
+def get_fx_tables():
+    """Returns the local FX rate series and the asset conversion graph built from them.
+
+    Rates come from the book's FX rates file and price history file (ticker, timestamp, price); every
+    pair ticker found there links its base and quote assets in both directions.
+    """
+    sources = [path for path in (book_settings.get('fx_rates_file'), book_settings.get('price_history_file')) if path]
+    key = tuple(file_signature(path) for path in sources)
+    if fx_cache.get('key') == key:
+        return fx_cache
+
+    frames = []
+    for path in sources:
+        try:
+            frames.append(load_price_history(path))
+        except Exception as e:
+            logger.warning("Could not load FX rates from '%s': %s", path, e)
+    rates = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=PRICE_HISTORY_COLUMNS)
+    rates = rates.sort_values(by='timestamp', kind='mergesort')
+
+    series = {}
+    graph = {}
+    for ticker, ticker_rates in rates.groupby('ticker', sort=False):
+        base, quote = parse_ticker(ticker)
+        if quote is None:
+            continue
+        series[ticker] = (ticker_rates['timestamp'].to_numpy(dtype='datetime64[ns]'), ticker_rates['price'].to_numpy(dtype=float))
+        graph.setdefault(base, []).append((quote, ticker, False))
+        graph.setdefault(quote, []).append((base, ticker, True))
+
+    fx_cache.clear()
+    fx_cache.update({'key': key, 'series': series, 'graph': graph})
+    conversion_path_cache.clear()
+    return fx_cache
+
+
+def resolve_conversion_path(from_asset, to_asset, fx_tables):
+    """Finds the shortest chain of pair tickers converting from_asset into to_asset (e.g. IRT -> USDT -> USD).
+
+    Returns a list of (ticker, invert) hops, or None when no path exists. Paths are cached per FX table.
+    """
+    cache_key = (fx_tables['key'], from_asset, to_asset)
+    if cache_key in conversion_path_cache:
+        return conversion_path_cache[cache_key]
+
+    path = None
+    previous = {from_asset: None}
+    queue = deque([from_asset])
+    while queue:
+        asset = queue.popleft()
+        if asset == to_asset:
+            path = []
+            while previous[asset] is not None:
+                asset, ticker, invert = previous[asset]
+                path.append((ticker, invert))
+            path.reverse()
+            break
+        for neighbor, ticker, invert in fx_tables['graph'].get(asset, []):
+            if neighbor not in previous:
+                previous[neighbor] = (asset, ticker, invert)
+                queue.append(neighbor)
+
+    conversion_path_cache[cache_key] = path
+    return path
+
+
+def conversion_rates(quote_assets, timestamps):
+    """Returns, per row, the rate converting its quote asset into the reporting currency at its timestamp.
+
+    Rows are converted in one vectorized pass per distinct quote asset and hop, using the last rate at or
+    before each timestamp (or the earliest rate for older rows). Rows with an unknown quote or no
+    conversion path keep a rate of 1; quote assets without a path are logged once, and the views that
+    show converted totals flag them (see unconvertible_quote_assets).
+    """
+    rates = np.ones(len(quote_assets))
+    target = get_reporting_currency()
+    if not target or len(quote_assets) == 0:
+        return rates
+
+    fx_tables = get_fx_tables()
+    quote_assets = np.asarray(quote_assets, dtype=object)
+    timestamps = np.asarray(timestamps, dtype='datetime64[ns]')
+    for quote in pd.unique(quote_assets):
+        if quote is None or quote == target:
+            continue
+        path = resolve_conversion_path(quote, target, fx_tables)
+        if path is None:
+            if (quote, target) not in unconvertible_logged:
+                unconvertible_logged.add((quote, target))
+                logger.warning("No FX rates convert %s into %s; %s amounts are left unconverted.", quote, target, quote)
+            continue
+        mask = quote_assets == quote
+        row_rates = np.ones(mask.sum())
+        for ticker, invert in path:
+            rate_times, rate_values = fx_tables['series'][ticker]
+            idx = np.clip(np.searchsorted(rate_times, timestamps[mask], side='right') - 1, 0, len(rate_times) - 1)
+            hop = rate_values[idx]
+            row_rates *= (1.0 / hop) if invert else hop
+        rates[mask] = row_rates
+    return rates
+
+
+def unconvertible_quote_assets(tickers):
+    """Returns the quote assets of the given tickers that have no conversion path into the reporting currency.
+
+    Amounts in these assets are summed unconverted, so every view showing converted totals must flag them.
+    """
+    target = get_reporting_currency()
+    if not target or len(tickers) == 0:
+        return []
+    fx_tables = get_fx_tables()
+    quotes = set(quote_assets_for(pd.unique(np.asarray(tickers, dtype=object)))) - {None, target}
+    return sorted(quote for quote in quotes if isinstance(quote, str) and resolve_conversion_path(quote, target, fx_tables) is None)
+
+
+def unconverted_note(tickers):
+    """A warning naming the quote assets of tickers that are not converted into the reporting currency, or ''."""
+    quotes = unconvertible_quote_assets(tickers)
+    if not quotes:
+        return ""
+    return (f"No FX rates convert {', '.join(quotes)} into {get_reporting_currency()}: "
+            f"those amounts are included unconverted in the totals.")
+
+
+def fx_signature():
+    """Identifies the inputs of reporting currency conversion, used to key derived rollups."""
+    currency = get_reporting_currency()
+    if not currency:
+        return None
+    sources = [path for path in (book_settings.get('fx_rates_file'), book_settings.get('price_history_file')) if path]
+    return [currency] + [list(file_signature(path) or ()) for path in sources]
+
+
+# --- Mark-to-Market Valuation ---
+
+def load_price_history(file_path):
+    """Loads a local price history file (CSV or Parquet with ticker, timestamp and price columns).
+
+    The result is sorted by timestamp, as merge_asof requires, and cached per file version so
+    multi-million row files are only parsed once.
+    """
+    cache_key = file_signature(file_path)
+    if cache_key is None:
+        raise FileNotFoundError(f"Price history file '{file_path}' not found.")
+    if cache_key in price_history_cache:
+        return price_history_cache[cache_key]
+
+    if file_path.lower().endswith(('.parquet', '.pq')):
+        prices = pd.read_parquet(file_path)
+    else:
+        prices = pd.read_csv(file_path)
+    prices = prices.rename(columns={col: str(col).strip().lower() for col in prices.columns})
+    missing = [col for col in PRICE_HISTORY_COLUMNS if col not in prices.columns]
+    if missing:
+        raise ValueError(f"Price history file is missing columns: {', '.join(missing)}")
+
+    prices = pd.DataFrame({
+        'ticker': prices['ticker'].astype(str),
+        'timestamp': pd.to_datetime(prices['timestamp'], errors='coerce').astype('datetime64[ns]'),
+        'price': pd.to_numeric(prices['price'], errors='coerce'),
+    }).dropna(subset=['timestamp', 'price'])
+    prices = prices.sort_values(by='timestamp', kind='mergesort').reset_index(drop=True)
+
+    if len(price_history_cache) >= MAX_PRICE_HISTORY_CACHE:
+        price_history_cache.pop(next(iter(price_history_cache)))
+    price_history_cache[cache_key] = prices
+    return prices
+
+
+def get_price_history():
+    """Returns the price history configured for the current book, or None when there is none."""
+    file_path = book_settings.get('price_history_file')
+    if not file_path:
+        return None
+    try:
+        return load_price_history(file_path)
+    except Exception as e:
+        logger.warning("Could not load price history '%s': %s", file_path, e)
+        return None
+
+
+def asof_prices(frame, prices):
+    """Adds the last known 'price' at or before each row's 'timestamp' for its 'ticker' (vectorized)."""
+    prices = prices[prices['ticker'].isin(frame['ticker'].unique())]
+    frame = frame.assign(ticker=frame['ticker'].astype(str),
+                         timestamp=frame['timestamp'].astype('datetime64[ns]'))
+    return pd.merge_asof(frame.sort_values(by='timestamp', kind='mergesort'), prices,
+                         on='timestamp', by='ticker', direction='backward')
+
+
+def valuation_time(date_range=None):
+    """Returns the instant holdings are marked at: the end of the range's last day, or now."""
+    if date_range is None or date_range[1] is None:
+        return pd.Timestamp.now()
+    return date_range[1] + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1)
+
+
+def value_holdings(holdings, prices, as_of):
+    """Marks holdings to market at as_of.
+
+    Returns a DataFrame indexed by ticker with quantity, average buy price, last price, market value,
+    cost basis and unrealized P&L. Tickers without a known price are valued at cost. Prices stay in the
+    quote currency while the value columns are converted into the reporting currency.
+    """
+    frame = pd.DataFrame({
+        'ticker': list(holdings.keys()),
+        'quantity': [data['quantity'] for data in holdings.values()],
+        'average_buy_price': [data['average_buy_price'] for data in holdings.values()],
+    })
+    frame['timestamp'] = as_of
+    if prices is not None and not frame.empty:
+        frame = asof_prices(frame, prices)
+    else:
+        frame['price'] = np.nan
+    rates = conversion_rates(quote_assets_for(frame['ticker'].to_numpy()), frame['timestamp'].to_numpy())
+    frame['cost_basis'] = frame['quantity'] * frame['average_buy_price'] * rates
+    frame['market_value'] = (frame['quantity'] * frame['price'] * rates).fillna(frame['cost_basis'])
+    frame['unrealized_pnl'] = frame['market_value'] - frame['cost_basis']
+    return frame.drop(columns='timestamp').set_index('ticker')
+
+
+def calculate_daily_positions(df, date_range=None):
+    """Returns the open quantity and cost basis of every ticker at the end of every day.
+
+    Built from the daily rollup with a pivot and cumulative sums, so no trade is replayed.
+    """
+    daily = get_rollups(prepare_trades(df))['daily']
+    daily = daily[daily['Ticker'] != ROLLUP_TOTAL]
+    if daily.empty:
+        return pd.DataFrame(columns=['Period', 'ticker', 'position', 'cost_basis'])
+
+    end = date_range[1] if date_range is not None and date_range[1] is not None else pd.Timestamp.now().normalize()
+    idx = pd.date_range(start=daily['Period'].min(), end=max(end, daily['Period'].max()))
+    positions = daily.pivot_table(index='Period', columns='Ticker', values='Position_Change', aggfunc='sum')
+    costs = daily.pivot_table(index='Period', columns='Ticker', values='Cost_Change', aggfunc='sum')
+    positions = positions.reindex(idx).fillna(0).cumsum()
+    costs = costs.reindex(idx).fillna(0).cumsum()
+
+    if date_range is not None:
+        lo, hi = get_date_range_bounds(pd.DataFrame({'Period': idx}), date_range, column='Period')
+        positions, costs = positions.iloc[lo:hi], costs.iloc[lo:hi]
+
+    long_positions = positions.stack().rename('position').to_frame()
+    long_positions['cost_basis'] = costs.stack()
+    long_positions.index.names = ['Period', 'ticker']
+    long_positions = long_positions.reset_index()
+    return long_positions[long_positions['position'] > 0].reset_index(drop=True)
+
+
+def calculate_equity_curve(df, prices, date_range=None):
+    """Marks the daily position series to market with an as-of price join.
+
+    Returns a daily DataFrame with the market value, cost basis and unrealized P&L of all open positions.
+    """
+    positions = calculate_daily_positions(df, date_range)
+    if positions.empty or prices is None:
+        return pd.DataFrame(columns=['market_value', 'cost_basis', 'unrealized_pnl'])
+
+    positions['timestamp'] = positions['Period'] + pd.Timedelta(days=1) - pd.Timedelta(microseconds=1)
+    valued = asof_prices(positions, prices)
+    rates = conversion_rates(quote_assets_for(valued['ticker'].to_numpy()), valued['timestamp'].to_numpy())
+    valued['market_value'] = (valued['position'] * valued['price'] * rates).fillna(valued['cost_basis'])
+    equity = valued.groupby('Period')[['market_value', 'cost_basis']].sum()
+    equity['unrealized_pnl'] = equity['market_value'] - equity['cost_basis']
+    return equity
+
+
+def hash_chart_data(digest, data):
+    """Feeds chart inputs (pandas objects, scalars, or tuples and dicts of them) into a hash."""
+    if isinstance(data, (tuple, list)):
+        digest.update(b'(%d' % len(data))
+        for item in data:
+            hash_chart_data(digest, item)
+    elif isinstance(data, dict):
+        digest.update(b'{%d' % len(data))
+        for key, value in data.items():
+            digest.update(repr(key).encode())
+            hash_chart_data(digest, value)
+    elif isinstance(data, (pd.Series, pd.DataFrame)):
+        labels = data.columns.tolist() if isinstance(data, pd.DataFrame) else [data.name]
+        digest.update(repr((type(data).__name__, len(data), labels)).encode())
+        digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    else:
+        digest.update(repr(data).encode())
 
-def show_portfolio_summary():
+
+def chart_key(plot, data, figsize=CHART_FIGSIZE):
+    """Identifies a rendered chart by its plot function, size, matplotlib version and a hash of its inputs."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((plot.__name__, figsize, CHART_DPI, matplotlib.__version__)).encode())
+    hash_chart_data(digest, data)
+    return digest.hexdigest()
+
+
+def chart_png(plot, data, figsize=CHART_FIGSIZE, key=None):
+    """Returns plot(ax, data) rendered as PNG bytes.
+
+    Renders are cached on disk by chart_key, so a chart drawn before, by the summary window or a PDF
+    export in this or an earlier session, is read back without running matplotlib. The figure is not
+    registered with pyplot, so charts can be rendered off the Tk thread.
+    """
+    path = os.path.join(sidecar_path('.charts'), (key or chart_key(plot, data, figsize)) + '.png')
+    try:
+        with open(path, 'rb') as f:
+            png = f.read()
+        os.utime(path) # Marks the entry as recently used
+        return png
+    except OSError:
+        pass
+
+    fig = Figure(figsize=figsize)
+    plot(fig.add_subplot(), data)
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', dpi=CHART_DPI)
+    png = buffer.getvalue()
+    store_chart_png(path, png)
+    return png
+
+
+def store_chart_png(path, png):
+    """Adds a render to the chart cache and evicts the least recently used ones beyond CHART_CACHE_MAX_BYTES."""
+    def write(temp_path):
+        with open(temp_path, 'wb') as f:
+            f.write(png)
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, write)
+        entries = sorted((entry.stat().st_mtime_ns, entry.stat().st_size, entry.path) for entry in os.scandir(os.path.dirname(path))
+                         if entry.name.endswith('.png') and not entry.name.startswith('.'))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in entries:
+            if total_size <= CHART_CACHE_MAX_BYTES:
+                break
+            os.remove(entry_path)
+            total_size -= size
+    except OSError as e:
+        logger.warning("Could not cache chart: %s", e)
+
+
+def embed_chart(parent, plot):
+    """Shows a chart in parent and returns update(data, message, rendered) to keep it current.
+
+    The chart is displayed as its cached PNG (see chart_png), and update does nothing while the chart
+    inputs hash to what is shown, so unchanged charts are left alone on refresh. rendered is the
+    (key, png) of data when it was already rendered off the Tk thread (see render_chart). With data
+    None the image is replaced by a label showing message.
+    """
+    chart_label = Label(parent)
+    message_label = Label(parent)
+    drawn = {'key': None, 'message': None}
+
+    def update(data, message="", rendered=None):
+        if data is None:
+            if drawn['key'] is not None or drawn['message'] != message:
+                chart_label.pack_forget()
+                message_label.config(text=message)
+                message_label.pack(expand=True)
+                drawn.update(key=None, message=message)
+            return
+        key, png = rendered or (chart_key(plot, data), None)
+        if key == drawn['key']:
+            return
+        image = PhotoImage(data=base64.b64encode(png or chart_png(plot, data, key=key)))
+        chart_label.config(image=image)
+        chart_label.image = image # Tk does not keep a reference to the image
+        message_label.pack_forget()
+        chart_label.pack(fill='both', expand=True)
+        drawn.update(key=key, message=None)
+
+    return update
+
+
+def render_chart(plot, data):
+    """Returns the (key, png) of a chart for embed_chart's update; safe to call off the Tk thread."""
+    key = chart_key(plot, data)
+    return key, chart_png(plot, data, key=key)
+
+
+def plot_allocation(ax, market_values):
+    ax.pie(market_values.tolist(), labels=market_values.index.tolist(), autopct='%1.1f%%', startangle=90, textprops={'fontsize': 8})
+    ax.axis('equal')
+    ax.set_title("Portfolio Allocation by Value", fontsize=10)
+
+
+def plot_line_axes(ax, title, ylabel):
+    ax.set_title(title, fontsize=10)
+    ax.set_xlabel("Date", fontsize=8)
+    ax.set_ylabel(ylabel, fontsize=8)
+    ax.tick_params(axis='x', rotation=45, labelsize=7)
+    ax.tick_params(axis='y', labelsize=7)
+
+
+def plot_total_pnl(ax, overall_daily_pnl_df):
+    sns.lineplot(x=overall_daily_pnl_df.index, y=overall_daily_pnl_df['Cumulative_P&L'], ax=ax)
+    plot_line_axes(ax, "Total Cumulative P&L Over Time", "Cumulative P&L")
+    ax.grid(True)
+
+
+def plot_equity_curve(ax, equity_curve):
+    sns.lineplot(x=equity_curve.index, y=equity_curve['market_value'], ax=ax, label="Market Value")
+    sns.lineplot(x=equity_curve.index, y=equity_curve['cost_basis'], ax=ax, label="Cost Basis")
+    plot_line_axes(ax, "Holdings Market Value Over Time", "Value")
+    ax.grid(True)
+    ax.legend(fontsize=7)
+
+
+def plot_trade_volume(ax, daily_volume):
+    sns.barplot(x=daily_volume.index, y=daily_volume.values, ax=ax, hue=daily_volume.index, palette="viridis", legend=False)
+    plot_line_axes(ax, "Trade Volume Over Time", "Total Quantity Traded")
+    ax.grid(axis='y', linestyle='--')
+
+
+def plot_ticker_pnl(ax, ticker_pnl):
+    selected_ticker, pnl_series = ticker_pnl
+    sns.lineplot(x=pnl_series.index, y=pnl_series.values, ax=ax, marker='o', markersize=3)
+    plot_line_axes(ax, f"Cumulative P&L for {selected_ticker}", "Cumulative P&L")
+    ax.grid(True)
+
+
+def plot_all_ticker_pnl(ax, cumulative_pnl_per_ticker):
+    for ticker, pnl_series in cumulative_pnl_per_ticker.items():
+        sns.lineplot(x=pnl_series.index, y=pnl_series.values, ax=ax, label=ticker, marker='o', markersize=2)
+    plot_line_axes(ax, "Cumulative P&L per Ticker Over Time", "Cumulative P&L")
+    ax.grid(True)
+    ax.legend(fontsize=6, loc='upper left')
+
+
+def show_portfolio_summary(date_range=None, period="All Time"):
     global summary_window
     if summary_window and summary_window.winfo_exists():
         summary_window.lift()
         return
 
     summary_window = Toplevel(root)
-    summary_window.title("Portfolio Summary")
-    summary_window.geometry("700x750")
+    summary_window.geometry("700x900")
     center_window(summary_window)
 
     summary_window.protocol("WM_DELETE_WINDOW", lambda: on_toplevel_closing(summary_window))
 
-    df = load_data()
-    
-    # --- Performance Metrics ---
-    metrics = calculate_performance_metrics(df.copy())
-    metrics_frame = LabelFrame(summary_window, text="Performance Metrics", padx=10, pady=10)
-    metrics_frame.pack(pady=10, padx=10, fill='x')
+    # The widgets below are built once; update_summary() re-sets only what a book change affects
+    view = {'date_range': date_range, 'ticker_pnl': {}}
+
+    # --- Reporting Period ---
+    period_frame = Frame(summary_window)
+    period_frame.pack(pady=5, padx=10, fill='x')
+
+    Label(period_frame, text="Period:").pack(side=LEFT, padx=5)
+    period_combobox = ttk.Combobox(period_frame, values=PERIOD_OPTIONS, state="readonly", width=10)
+    period_combobox.set(period)
+    period_combobox.pack(side=LEFT, padx=5)
+
+    Label(period_frame, text="From:").pack(side=LEFT, padx=5)
+    start_entry = DateEntry(period_frame, width=10, date_pattern='yyyy-mm-dd')
+    start_entry.pack(side=LEFT, padx=2)
+    Label(period_frame, text="To:").pack(side=LEFT, padx=5)
+    end_entry = DateEntry(period_frame, width=10, date_pattern='yyyy-mm-dd')
+    end_entry.pack(side=LEFT, padx=2)
+    if date_range is not None:
+        if date_range[0] is not None:
+            start_entry.set_date(date_range[0].to_pydatetime())
+        if date_range[1] is not None:
+            end_entry.set_date(date_range[1].to_pydatetime())
+
+    def apply_period():
+        selected_period = period_combobox.get()
+        try:
+            view['date_range'] = resolve_date_range(selected_period, start_entry.get_date(), end_entry.get_date())
+        except ValueError as e:
+            messagebox.showerror("Period Error", str(e))
+            return
+        update_summary()
 
-    Label(metrics_frame, text="Total Realized P&L:").grid(row=0, column=0, sticky="w", padx=5, pady=2)
-    pnl_color = "green" if metrics['total_realized_pnl'] >= 0 else "red"
-    Label(metrics_frame, text=f"{metrics['total_realized_pnl']:.{decimal_precision['pnl']}f}", fg=pnl_color).grid(row=0, column=1, sticky="e", padx=5, pady=2)
+    Button(period_frame, text="Apply", command=apply_period).pack(side=LEFT, padx=5)
+    Button(period_frame, text="Export PDF", command=lambda: export_summary_pdf(view['date_range'])).pack(side=RIGHT, padx=5)
+    Button(period_frame, text="Tax Lots", command=lambda: export_tax_lot_report(view['date_range'])).pack(side=RIGHT, padx=5)
 
-    Label(metrics_frame, text="Total ROI:").grid(row=1, column=0, sticky="w", padx=5, pady=2)
-    roi_color = "green" if metrics['total_roi'] >= 0 else "red"
-    Label(metrics_frame, text=f"{metrics['total_roi']:.2f}%", fg=roi_color).grid(row=1, column=1, sticky="e", padx=5, pady=2)
+    # --- Performance Metrics ---
+    metrics_frame = LabelFrame(summary_window, padx=10, pady=10)
+    metrics_frame.pack(pady=10, padx=10, fill='x')
 
-    Label(metrics_frame, text="Win Rate:").grid(row=2, column=0, sticky="w", padx=5, pady=2)
-    Label(metrics_frame, text=f"{metrics['win_rate']:.2f}%").grid(row=2, column=1, sticky="e", padx=5, pady=2)
-    
-    Label(metrics_frame, text="Avg. Profit per Win:").grid(row=3, column=0, sticky="w", padx=5, pady=2)
-    Label(metrics_frame, text=f"{metrics['avg_profit_per_trade']:.{decimal_precision['pnl']}f}").grid(row=3, column=1, sticky="e", padx=5, pady=2)
+    currency_note_label = Label(metrics_frame, fg="red", justify=LEFT, wraplength=500)
+    currency_note_label.grid(row=0, column=0, columnspan=2, sticky="w", padx=5, pady=2)
 
-    Label(metrics_frame, text="Avg. Loss per Loss:").grid(row=4, column=0, sticky="w", padx=5, pady=2)
-    Label(metrics_frame, text=f"{metrics['avg_loss_per_trade']:.{decimal_precision['pnl']}f}").grid(row=4, column=1, sticky="e", padx=5, pady=2)
+    metric_labels = {}
+    metric_keys = ['total_realized_pnl', 'total_roi', 'win_rate', 'avg_profit_per_trade', 'avg_loss_per_trade', 'total_unrealized_pnl']
+    metric_keys += ['closed_trades', 'profit_factor', 'expectancy', 'max_drawdown', 'sharpe_ratio', 'sortino_ratio', 'holding_days', 'holding_days_mean']
+    for row, key in enumerate(metric_keys, start=1):
+        caption_label = Label(metrics_frame)
+        caption_label.grid(row=row, column=0, sticky="w", padx=5, pady=2)
+        value_label = Label(metrics_frame)
+        value_label.grid(row=row, column=1, sticky="e", padx=5, pady=2)
+        metric_labels[key] = (caption_label, value_label)
 
+    def set_label(label, **options):
+        if any(str(label.cget(name)) != str(value) for name, value in options.items()):
+            label.config(**options)
 
     # --- Current Holdings ---
-    current_holdings = get_current_holdings(df.copy())
-    
     holdings_frame = LabelFrame(summary_window, text="Current Holdings", padx=10, pady=10)
     holdings_frame.pack(pady=10, padx=10, fill='x')
-
-    if current_holdings:
-        ttk.Label(holdings_frame, text="Ticker", font=("Arial", 10, "bold")).grid(row=0, column=0, padx=5, pady=2)
-        ttk.Label(holdings_frame, text="Quantity", font=("Arial", 10, "bold")).grid(row=0, column=1, padx=5, pady=2)
-        ttk.Label(holdings_frame, text="Avg. Buy Price", font=("Arial", 10, "bold")).grid(row=0, column=2, padx=5, pady=2)
-
-        for i, (ticker, data) in enumerate(current_holdings.items()):
-            ttk.Label(holdings_frame, text=ticker).grid(row=i+1, column=0, padx=5, pady=2, sticky="w")
-            ttk.Label(holdings_frame, text=f"{data['quantity']:.{decimal_precision['quantity']}f}").grid(row=i+1, column=1, padx=5, pady=2)
-            ttk.Label(holdings_frame, text=f"{data['average_buy_price']:.{decimal_precision['avg_buy_price']}f}").grid(row=i+1, column=2, padx=5, pady=2)
-    else:
-        Label(holdings_frame, text="No current holdings.").pack(pady=5)
+    holdings_cells = {} # (row, column) -> label, for the current layout
+    holdings_layout = [None] # Header and tickers the cells were built for
+
+    def update_holdings(header, rows):
+        layout = (tuple(header), tuple(values[0] for values in rows))
+        if layout != holdings_layout[0]:
+            for child in holdings_frame.winfo_children():
+                child.destroy()
+            holdings_cells.clear()
+            holdings_layout[0] = layout
+            if not rows:
+                Label(holdings_frame, text="No current holdings.").pack(pady=5)
+                return
+            for column, text in enumerate(header):
+                ttk.Label(holdings_frame, text=text, font=("Arial", 10, "bold")).grid(row=0, column=column, padx=5, pady=2)
+            for row, values in enumerate(rows, start=1):
+                for column, text in enumerate(values):
+                    holdings_cells[row, column] = ttk.Label(holdings_frame, text=text)
+                    holdings_cells[row, column].grid(row=row, column=column, padx=5, pady=2, sticky="w" if column == 0 else "")
+            return
+        for row, values in enumerate(rows, start=1):
+            for column, text in enumerate(values):
+                set_label(holdings_cells[row, column], text=text)
 
     # --- Charts ---
+    # A tab's chart is prepared only once the tab is shown. Its inputs are computed on the Tk thread, which
+    # owns the analytics caches, and the chart is rendered on a worker thread while a placeholder is shown
     chart_notebook = ttk.Notebook(summary_window)
     chart_notebook.pack(pady=10, padx=10, fill='both', expand=True)
+    chart_tabs = {} # Tab frame -> (prepare(context) returning (data, message), plot, embed_chart update)
+    view.update(context=None, ticker_pnl={}, ticker_pnl_pending=None, stale=set(), drawn=set(), requests={}, pending=0, results=queue.Queue())
+
+    def add_chart_tab(frame, text, plot, prepare):
+        chart_notebook.add(frame, text=text)
+        chart_tabs[frame] = (prepare, plot, embed_chart(frame, plot))
+
+    def prepare_allocation(context):
+        if not context['current_holdings']:
+            return None, "No holdings to generate allocation chart."
+        if context['holdings_value']['market_value'].sum() <= 0: # Market value, or cost where no price is known
+            return None, "No positive portfolio value to display chart."
+        return context['holdings_value']['market_value'], ""
+
+    def prepare_total_pnl(context):
+        if context['period_df'].empty:
+            return None, "No data to generate Total P&L over time chart."
+        overall_daily_pnl_df = calculate_total_cumulative_pnl(context['df'], context['date_range'])
+        if overall_daily_pnl_df.empty:
+            return None, "Not enough data to generate Total P&L over time chart."
+        return overall_daily_pnl_df, ""
+
+    def prepare_equity_curve(context):
+        equity_curve = calculate_equity_curve(context['df'], context['prices'], context['date_range'])
+        if equity_curve.empty:
+            return None, "No open positions to generate equity curve."
+        return equity_curve, ""
+
+    def prepare_trade_volume(context):
+        if context['period_df'].empty:
+            return None, "No data to generate Trade Volume chart."
+        daily_volume = get_daily_rollup(context['df'], context['date_range'])['Volume']
+        if daily_volume.empty:
+            return None, "Not enough data to generate Trade Volume chart."
+        return daily_volume, ""
 
-    # Pie Chart for Allocation
     pie_chart_frame = Frame(chart_notebook)
-    chart_notebook.add(pie_chart_frame, text="Portfolio Allocation")
-    
-    if current_holdings:
-        labels = [ticker for ticker in current_holdings.keys()]
-        sizes = [data['quantity'] * data['average_buy_price'] for data in current_holdings.values()] # Value-based allocation
-
-        if sum(sizes) > 0:
-            fig_pie, ax_pie = plt.subplots(figsize=(5, 4))
-            ax_pie.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90, textprops={'fontsize': 8})
-            ax_pie.axis('equal')
-            ax_pie.set_title("Portfolio Allocation by Value", fontsize=10)
-            fig_pie.tight_layout()
-
-            canvas_pie = FigureCanvasTkAgg(fig_pie, master=pie_chart_frame)
-            canvas_pie_widget = canvas_pie.get_tk_widget()
-            canvas_pie_widget.pack(fill='both', expand=True)
-            canvas_pie.draw()
-        else:
-            Label(pie_chart_frame, text="No positive portfolio value to display chart.").pack(expand=True)
-    else:
-        Label(pie_chart_frame, text="No holdings to generate allocation chart.").pack(expand=True)
+    add_chart_tab(pie_chart_frame, "Portfolio Allocation", plot_allocation, prepare_allocation)
 
-    # Total P&L Over Time Chart (Line Chart)
     total_pnl_over_time_frame = Frame(chart_notebook)
-    chart_notebook.add(total_pnl_over_time_frame, text="Total P&L Over Time")
-
-    if not df.empty:
-        daily_trades = df.copy()
-        daily_trades['Date'] = pd.to_datetime(daily_trades['Date'])
-        daily_trades['Trade_Value'] = daily_trades.apply(lambda row: row['Total'] if row['Trade_Type'].lower() == 'sell' else -row['Total'], axis=1)
-        
-        overall_daily_pnl_df = daily_trades.groupby('Date')['Trade_Value'].sum().to_frame()
-        overall_daily_pnl_df['Cumulative_P&L'] = overall_daily_pnl_df['Trade_Value'].cumsum()
-
-        if not overall_daily_pnl_df.empty:
-            idx = pd.date_range(start=overall_daily_pnl_df.index.min(), end=overall_daily_pnl_df.index.max())
-            overall_daily_pnl_df = overall_daily_pnl_df.reindex(idx, method='ffill').fillna(0)
-
-            fig_total_pnl, ax_total_pnl = plt.subplots(figsize=(5, 4))
-            sns.lineplot(x=overall_daily_pnl_df.index, y=overall_daily_pnl_df['Cumulative_P&L'], ax=ax_total_pnl)
-            ax_total_pnl.set_title("Total Cumulative P&L Over Time", fontsize=10)
-            ax_total_pnl.set_xlabel("Date", fontsize=8)
-            ax_total_pnl.set_ylabel("Cumulative P&L", fontsize=8)
-            ax_total_pnl.tick_params(axis='x', rotation=45, labelsize=7)
-            ax_total_pnl.tick_params(axis='y', labelsize=7)
-            ax_total_pnl.grid(True)
-            fig_total_pnl.tight_layout()
-
-            canvas_total_pnl = FigureCanvasTkAgg(fig_total_pnl, master=total_pnl_over_time_frame)
-            canvas_total_pnl_widget = canvas_total_pnl.get_tk_widget()
-            canvas_total_pnl_widget.pack(fill='both', expand=True)
-            canvas_total_pnl.draw()
-        else:
-            Label(total_pnl_over_time_frame, text="Not enough data to generate Total P&L over time chart.").pack(expand=True)
-    else:
-        Label(total_pnl_over_time_frame, text="No data to generate Total P&L over time chart.").pack(expand=True)
+    add_chart_tab(total_pnl_over_time_frame, "Total P&L Over Time", plot_total_pnl, prepare_total_pnl)
 
+    # Equity Curve, shown only while a price history file is configured
+    equity_curve_frame = Frame(chart_notebook)
+    add_chart_tab(equity_curve_frame, "Equity Curve", plot_equity_curve, prepare_equity_curve)
 
-    # Trade Volume Over Time (Bar Chart)
     volume_over_time_frame = Frame(chart_notebook)
-    chart_notebook.add(volume_over_time_frame, text="Trade Volume")
-
-    if not df.empty:
-        df_volume = df.copy()
-        df_volume['Date'] = pd.to_datetime(df_volume['Date'])
-        daily_volume = df_volume.groupby('Date')['Quantity'].sum()
-
-        if not daily_volume.empty:
-            fig_vol, ax_vol = plt.subplots(figsize=(5, 4))
-            sns.barplot(x=daily_volume.index, y=daily_volume.values, ax=ax_vol, hue=daily_volume.index, palette="viridis", legend=False)
-            ax_vol.set_title("Trade Volume Over Time", fontsize=10)
-            ax_vol.set_xlabel("Date", fontsize=8)
-            ax_vol.set_ylabel("Total Quantity Traded", fontsize=8)
-            ax_vol.tick_params(axis='x', rotation=45, labelsize=7)
-            ax_vol.tick_params(axis='y', labelsize=7)
-            ax_vol.grid(axis='y', linestyle='--')
-            fig_vol.tight_layout()
-
-            canvas_vol = FigureCanvasTkAgg(fig_vol, master=volume_over_time_frame)
-            canvas_vol_widget = canvas_vol.get_tk_widget()
-            canvas_vol_widget.pack(fill='both', expand=True)
-            canvas_vol.draw()
-        else:
-            Label(volume_over_time_frame, text="Not enough data to generate Trade Volume chart.").pack(expand=True)
-    else:
-        Label(volume_over_time_frame, text="No data to generate Trade Volume chart.").pack(expand=True)
+    add_chart_tab(volume_over_time_frame, "Trade Volume", plot_trade_volume, prepare_trade_volume)
 
-    # Ticker Specific Cumulative P&L Chart (Line Chart) - UPDATED with dropdown
+    # Ticker Specific Cumulative P&L Chart (Line Chart) with dropdown
     ticker_cumulative_pnl_frame = Frame(chart_notebook)
     chart_notebook.add(ticker_cumulative_pnl_frame, text="Ticker Cumulative P&L")
 
-    # Widgets for Ticker Specific P&L
     ticker_pnl_control_frame = Frame(ticker_cumulative_pnl_frame)
     ticker_pnl_control_frame.pack(pady=5)
 
     Label(ticker_pnl_control_frame, text="Select Ticker:").pack(side=LEFT, padx=5)
-    
-    tickers = ["Select a Ticker"] + sorted(df['Ticker'].unique().tolist())
-    ticker_select_combobox = ttk.Combobox(ticker_pnl_control_frame, values=tickers, state="readonly", width=20)
+    ticker_select_combobox = ttk.Combobox(ticker_pnl_control_frame, state="readonly", width=20)
     ticker_select_combobox.set("Select a Ticker")
     ticker_select_combobox.pack(side=LEFT, padx=5)
 
-    ticker_plot_canvas = None
-    ticker_plot_fig = None
-    ticker_plot_ax = None
-    
-    def update_ticker_pnl_chart(event=None):
-        nonlocal ticker_plot_canvas, ticker_plot_fig, ticker_plot_ax
+    def refresh_ticker_pnl():
+        """Recomputes the per-ticker P&L of the tickers changed since it was last used (None: all of them)."""
+        pending, context = view['ticker_pnl_pending'], view['context']
+        if pending is None:
+            view['ticker_pnl'] = {} if context['period_df'].empty else calculate_cumulative_pnl_per_ticker(context['df'], context['date_range'])
+        elif pending:
+            refreshed = calculate_cumulative_pnl_per_ticker(context['df'], context['date_range'], pending)
+            view['ticker_pnl'] = {ticker: series for ticker, series in view['ticker_pnl'].items() if ticker not in pending}
+            view['ticker_pnl'].update(refreshed)
+        view['ticker_pnl_pending'] = set()
+
+    def selected_ticker_pnl():
+        refresh_ticker_pnl()
         selected_ticker = ticker_select_combobox.get()
-        
-        if ticker_plot_canvas:
-            ticker_plot_canvas.get_tk_widget().destroy()
-            plt.close(ticker_plot_fig)
-
-        if selected_ticker == "Select a Ticker" or df.empty:
-            Label(ticker_cumulative_pnl_frame, text="Please select a ticker to view its cumulative P&L.").pack(expand=True)
+        if selected_ticker == "Select a Ticker" or selected_ticker not in ticker_select_combobox['values']:
+            return None, "Please select a ticker to view its cumulative P&L."
+        if selected_ticker in view['ticker_pnl']:
+            return (selected_ticker, view['ticker_pnl'][selected_ticker]), ""
+        return None, f"No cumulative P&L data for {selected_ticker}."
+
+    def prepare_ticker_pnl(context):
+        return selected_ticker_pnl()
+
+    chart_tabs[ticker_cumulative_pnl_frame] = (prepare_ticker_pnl, plot_ticker_pnl, embed_chart(ticker_cumulative_pnl_frame, plot_ticker_pnl))
+    ticker_select_combobox.bind("<<ComboboxSelected>>", lambda event: show_chart(ticker_cumulative_pnl_frame, *selected_ticker_pnl()))
+
+    def show_chart(frame, data, message=""):
+        """Shows message in a tab, or renders its chart on a worker thread and shows it once rendered."""
+        _, plot, update = chart_tabs[frame]
+        view['requests'][frame] = request = view['requests'].get(frame, 0) + 1
+        if data is None:
+            update(None, message)
+            view['drawn'].add(frame)
             return
+        if frame not in view['drawn']:
+            update(None, "Loading chart...")
+        results = view['results']
 
-        cumulative_pnl_data = calculate_cumulative_pnl_per_ticker(df.copy())
-        if selected_ticker in cumulative_pnl_data:
-            pnl_series = cumulative_pnl_data[selected_ticker]
-
-            ticker_plot_fig, ticker_plot_ax = plt.subplots(figsize=(5, 4))
-            sns.lineplot(x=pnl_series.index, y=pnl_series.values, ax=ticker_plot_ax, marker='o', markersize=3)
-            
-            ticker_plot_ax.set_title(f"Cumulative P&L for {selected_ticker}", fontsize=10)
-            ticker_plot_ax.set_xlabel("Date", fontsize=8)
-            ticker_plot_ax.set_ylabel("Cumulative P&L", fontsize=8)
-            ticker_plot_ax.tick_params(axis='x', rotation=45, labelsize=7)
-            ticker_plot_ax.tick_params(axis='y', labelsize=7)
-            ticker_plot_ax.grid(True)
-            ticker_plot_fig.tight_layout()
-
-            ticker_plot_canvas = FigureCanvasTkAgg(ticker_plot_fig, master=ticker_cumulative_pnl_frame)
-            ticker_plot_canvas_widget = ticker_plot_canvas.get_tk_widget()
-            ticker_plot_canvas_widget.pack(fill='both', expand=True)
-            ticker_plot_canvas.draw()
+        def work():
+            try:
+                results.put((frame, request, data, render_chart(plot, data), None))
+            except Exception as e:
+                results.put((frame, request, data, None, str(e)))
+
+        threading.Thread(target=work, daemon=True).start()
+        if not view['pending']:
+            root.after(CHART_POLL_MS, show_rendered_charts)
+        view['pending'] += 1
+
+    def show_rendered_charts():
+        """Runs on the Tk thread: shows the charts the worker threads have finished rendering."""
+        if not summary_window.winfo_exists():
+            return
+        while not view['results'].empty():
+            frame, request, data, rendered, error = view['results'].get_nowait()
+            view['pending'] -= 1
+            if request != view['requests'][frame]:
+                continue # Superseded by a newer chart for the same tab
+            update = chart_tabs[frame][2]
+            if error is not None:
+                update(None, f"Could not render chart: {error}")
+            else:
+                update(data, "", rendered)
+            view['drawn'].add(frame)
+        if view['pending']:
+            root.after(CHART_POLL_MS, show_rendered_charts)
+
+    def prepare_selected_tab(event=None):
+        """Prepares the shown tab if its chart is out of date; the other tabs wait until they are shown."""
+        selected = chart_notebook.select()
+        frame = chart_notebook.nametowidget(selected) if selected else None
+        if frame not in view['stale']:
+            return
+        view['stale'].discard(frame)
+        show_chart(frame, *chart_tabs[frame][0](view['context']))
+
+    chart_notebook.bind("<<NotebookTabChanged>>", prepare_selected_tab)
+
+    def update_summary(change=None):
+        """Recomputes the summary for the current period and re-sets the widgets whose values changed.
+
+        For a book change that names its tickers, holdings of the other tickers keep their valuation,
+        only those tickers' P&L series are recomputed, and the ticker chart is redrawn only when it shows
+        one of them. Book-wide metrics and charts are always recomputed.
+        """
+        date_range = view['date_range']
+        previous = view['context']
+        tickers = change.get('tickers') if change is not None and previous is not None and previous['date_range'] == date_range else None
+        if tickers is not None and not tickers:
+            return # Nothing in the book changed
+        df = load_data()
+        lo, hi = get_date_range_bounds(df, date_range)
+        period_df = df.iloc[lo:hi]
+        currency_label = reporting_currency_label()
+        summary_window.title(f"Portfolio Summary - {format_date_range(date_range)}")
+        set_label(metrics_frame, text=f"Performance Metrics ({get_cost_basis_method()} cost basis)")
+        currency_note = unconverted_note(df['Ticker'])
+        set_label(currency_note_label, text=currency_note)
+        if currency_note:
+            currency_note_label.grid()
+        else:
+            currency_note_label.grid_remove()
+
+        metrics = calculate_performance_metrics(df, date_range)
+        current_holdings = get_current_holdings(df, date_range)
+        prices = get_price_history()
+        if tickers is not None and prices is previous['prices']:
+            # Unchanged tickers keep their marks; only the changed ones are valued again
+            kept = [ticker for ticker in current_holdings if ticker not in tickers and ticker in previous['holdings_value'].index]
+            valued = value_holdings({ticker: data for ticker, data in current_holdings.items() if ticker not in kept},
+                                    prices, valuation_time(date_range))
+            holdings_value = pd.concat([previous['holdings_value'].loc[kept], valued]).reindex(list(current_holdings))
         else:
-            Label(ticker_cumulative_pnl_frame, text=f"No cumulative P&L data for {selected_ticker}.").pack(expand=True)
+            holdings_value = value_holdings(current_holdings, prices, valuation_time(date_range))
+
+        metric_values = {
+            'total_realized_pnl': (f"Total Realized P&L{currency_label}:", format_number(metrics['total_realized_pnl'], 'pnl'),
+                                   "green" if metrics['total_realized_pnl'] >= 0 else "red"),
+            'total_roi': ("Total ROI:", f"{metrics['total_roi']:.2f}%", "green" if metrics['total_roi'] >= 0 else "red"),
+            'win_rate': ("Win Rate:", f"{metrics['win_rate']:.2f}%", None),
+            'avg_profit_per_trade': ("Avg. Profit per Win:", format_number(metrics['avg_profit_per_trade'], 'pnl'), None),
+            'avg_loss_per_trade': ("Avg. Loss per Loss:", format_number(metrics['avg_loss_per_trade'], 'pnl'), None),
+        }
+        if prices is not None:
+            total_unrealized_pnl = holdings_value['unrealized_pnl'].sum()
+            metric_values['total_unrealized_pnl'] = (f"Total Unrealized P&L{currency_label}:", format_number(total_unrealized_pnl, 'pnl'),
+                                                     "green" if total_unrealized_pnl >= 0 else "red")
+        for key, caption, text in trade_statistic_rows(metrics):
+            metric_values[key] = (f"{caption}:", text, None)
+        for key, (caption_label, value_label) in metric_labels.items():
+            if key in metric_values:
+                caption, value, color = metric_values[key]
+                set_label(caption_label, text=caption)
+                set_label(value_label, text=value, fg=color or caption_label.cget('fg'))
+                caption_label.grid()
+                value_label.grid()
+            else:
+                caption_label.grid_remove()
+                value_label.grid_remove()
+
+        holdings_table = format_holdings(current_holdings, holdings_value, prices)
+        update_holdings(holdings_table.columns.tolist(), holdings_table.to_numpy().tolist())
+
+        if prices is None:
+            chart_notebook.hide(equity_curve_frame)
+        else:
+            chart_notebook.add(equity_curve_frame) # Restores a hidden tab at its original position
+        ticker_select_combobox['values'] = ["Select a Ticker"] + sorted(period_df['Ticker'].astype(str).unique().tolist())
+
+        # The book-wide charts are now out of date; only the shown one is prepared right away
+        view['context'] = {'df': df, 'date_range': date_range, 'period_df': period_df, 'prices': prices,
+                           'current_holdings': current_holdings, 'holdings_value': holdings_value}
+        was_stale, view['stale'] = view['stale'], set(chart_tabs)
+        if tickers is None:
+            view['ticker_pnl_pending'] = None
+        else:
+            if view['ticker_pnl_pending'] is not None:
+                view['ticker_pnl_pending'].update(tickers)
+            if ticker_select_combobox.get() not in tickers and ticker_cumulative_pnl_frame not in was_stale:
+                view['stale'].discard(ticker_cumulative_pnl_frame) # Still shows an unchanged ticker
+        prepare_selected_tab()
 
-    ticker_select_combobox.bind("<<ComboboxSelected>>", update_ticker_pnl_chart)
-    update_ticker_pnl_chart()
+    subscribe_book_changes(summary_window, update_summary)
+    update_summary()
 
 
-def export_summary_pdf():
+def export_summary_pdf(date_range=None):
     df = load_data()
     if df.empty:
         messagebox.showinfo("Export", "No data to export summary.")
         return
+    lo, hi = get_date_range_bounds(df, date_range)
+    period_df = df.iloc[lo:hi]
 
     file_path = filedialog.asksaveasfilename(defaultextension=".pdf",
                                              filetypes=[("PDF files", "*.pdf"), ("All files", "*.*")],
@@ -894,19 +3472,30 @@ def export_summary_pdf():
 
         # Date of Report
         elements.append(Paragraph(f"Report Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", styles['Normal']))
+        elements.append(Paragraph(f"Period: {format_date_range(date_range)}", styles['Normal']))
+        elements.append(Paragraph(f"Cost Basis Method: {get_cost_basis_method()}", styles['Normal']))
+        currency_note = unconverted_note(df['Ticker'])
+        if currency_note:
+            elements.append(Paragraph(f"Note: {currency_note}", styles['Normal']))
         elements.append(Spacer(1, 0.2 * inch))
 
         # Performance Metrics
         elements.append(Paragraph("Performance Metrics", styles['h2']))
-        metrics = calculate_performance_metrics(df.copy())
+        metrics = calculate_performance_metrics(df, date_range)
         metrics_data = [
             ["Metric", "Value"],
-            ["Total Realized P&L", f"{metrics['total_realized_pnl']:.{decimal_precision['pnl']}f}"],
+            [f"Total Realized P&L{reporting_currency_label()}", format_number(metrics['total_realized_pnl'], 'pnl')],
             ["Total ROI", f"{metrics['total_roi']:.2f}%"],
             ["Win Rate", f"{metrics['win_rate']:.2f}%"],
-            ["Avg. Profit per Win", f"{metrics['avg_profit_per_trade']:.{decimal_precision['pnl']}f}"],
-            ["Avg. Loss per Loss", f"{metrics['avg_loss_per_trade']:.{decimal_precision['pnl']}f}"]
+            ["Avg. Profit per Win", format_number(metrics['avg_profit_per_trade'], 'pnl')],
+            ["Avg. Loss per Loss", format_number(metrics['avg_loss_per_trade'], 'pnl')]
         ]
+        current_holdings = get_current_holdings(df, date_range)
+        prices = get_price_history()
+        holdings_value = value_holdings(current_holdings, prices, valuation_time(date_range))
+        if prices is not None:
+            metrics_data.append([f"Total Unrealized P&L{reporting_currency_label()}", format_number(holdings_value['unrealized_pnl'].sum(), 'pnl')])
+        metrics_data.extend([caption, text] for _, caption, text in trade_statistic_rows(metrics))
         metrics_table = Table(metrics_data, colWidths=[2.5*inch, 2.5*inch])
         metrics_table.setStyle(TableStyle([
             ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
@@ -923,16 +3512,12 @@ def export_summary_pdf():
 
         # Current Holdings
         elements.append(Paragraph("Current Holdings", styles['h2']))
-        current_holdings = get_current_holdings(df.copy())
         if current_holdings:
-            holdings_data = [["Ticker", "Quantity", "Avg. Buy Price"]]
-            for ticker, data in current_holdings.items():
-                holdings_data.append([
-                    ticker,
-                    f"{data['quantity']:.{decimal_precision['quantity']}f}",
-                    f"{data['average_buy_price']:.{decimal_precision['avg_buy_price']}f}"
-                ])
-            holdings_table = Table(holdings_data, colWidths=[1.5*inch, 1.5*inch, 2*inch])
+            holdings_table = format_holdings(current_holdings, holdings_value, prices)
+            holdings_table = holdings_table.drop(columns=["Last Price"], errors='ignore')
+            holdings_data = [holdings_table.columns.tolist()] + holdings_table.to_numpy().tolist()
+            col_widths = [1.5*inch, 1.5*inch, 2*inch] if prices is None else [1.2*inch, 1.2*inch, 1.2*inch, 1.2*inch, 1.2*inch]
+            holdings_table = Table(holdings_data, colWidths=col_widths)
             holdings_table.setStyle(TableStyle([
                 ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
                 ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
@@ -949,65 +3534,21 @@ def export_summary_pdf():
         elements.append(Spacer(1, 0.2 * inch))
 
         # Cumulative P&L Plot (Total) for PDF
-        daily_trades_pdf = df.copy()
-        daily_trades_pdf['Date'] = pd.to_datetime(daily_trades_pdf['Date'])
-        daily_trades_pdf['Trade_Value'] = daily_trades_pdf.apply(lambda row: row['Total'] if row['Trade_Type'].lower() == 'sell' else -row['Total'], axis=1)
-        overall_daily_pnl_df_pdf = daily_trades_pdf.groupby('Date')['Trade_Value'].sum().to_frame()
-        overall_daily_pnl_df_pdf['Cumulative_P&L'] = overall_daily_pnl_df_pdf['Trade_Value'].cumsum()
-        
+        overall_daily_pnl_df_pdf = calculate_total_cumulative_pnl(df, date_range)
         if not overall_daily_pnl_df_pdf.empty:
-            idx_pdf = pd.date_range(start=overall_daily_pnl_df_pdf.index.min(), end=overall_daily_pnl_df_pdf.index.max())
-            overall_daily_pnl_df_pdf = overall_daily_pnl_df_pdf.reindex(idx_pdf, method='ffill').fillna(0)
-
-            fig_pdf_total_pnl, ax_pdf_total_pnl = plt.subplots(figsize=(6, 3)) 
-            sns.lineplot(x=overall_daily_pnl_df_pdf.index, y=overall_daily_pnl_df_pdf['Cumulative_P&L'], ax=ax_pdf_total_pnl)
-            ax_pdf_total_pnl.set_title("Total Cumulative P&L Over Time", fontsize=10)
-            ax_pdf_total_pnl.set_xlabel("Date", fontsize=8)
-            ax_pdf_total_pnl.set_ylabel("Cumulative P&L", fontsize=8)
-            ax_pdf_total_pnl.tick_params(axis='x', rotation=45, labelsize=7)
-            ax_pdf_total_pnl.tick_params(axis='y', labelsize=7)
-            ax_pdf_total_pnl.grid(True)
-            fig_pdf_total_pnl.tight_layout()
-
-            from io import BytesIO
-            img_data = BytesIO()
-            fig_pdf_total_pnl.savefig(img_data, format='png')
-            img_data.seek(0)
-            plt.close(fig_pdf_total_pnl)
-
-            # --- CORRECTED LINE FOR TOTAL PNL PLOT ---
             elements.append(Paragraph("Total Cumulative P&L Over Time", styles['h2']))
-            elements.append(Image(img_data)) # Use Image class
+            elements.append(Image(io.BytesIO(chart_png(plot_total_pnl, overall_daily_pnl_df_pdf)),
+                                  width=CHART_FIGSIZE[0] * inch, height=CHART_FIGSIZE[1] * inch))
             elements.append(Spacer(1, 0.2 * inch))
-            # --- END CORRECTED LINE ---
         else:
             elements.append(Paragraph("No data to plot Total Cumulative P&L for PDF.", styles['Normal']))
 
         # Ticker Specific Cumulative P&L Plot (for PDF - all tickers on one plot if data exists)
-        cumulative_pnl_per_ticker_pdf = calculate_cumulative_pnl_per_ticker(df.copy())
+        cumulative_pnl_per_ticker_pdf = calculate_cumulative_pnl_per_ticker(df, date_range)
         if cumulative_pnl_per_ticker_pdf:
-            fig_pdf_ticker_cum_pnl, ax_pdf_ticker_cum_pnl = plt.subplots(figsize=(6, 3))
-            for ticker, pnl_series in cumulative_pnl_per_ticker_pdf.items():
-                sns.lineplot(x=pnl_series.index, y=pnl_series.values, ax=ax_pdf_ticker_cum_pnl, label=ticker, marker='o', markersize=2)
-            
-            ax_pdf_ticker_cum_pnl.set_title("Cumulative P&L per Ticker Over Time", fontsize=10)
-            ax_pdf_ticker_cum_pnl.set_xlabel("Date", fontsize=8)
-            ax_pdf_ticker_cum_pnl.set_ylabel("Cumulative P&L", fontsize=8)
-            ax_pdf_ticker_cum_pnl.tick_params(axis='x', rotation=45, labelsize=7)
-            ax_pdf_ticker_cum_pnl.tick_params(axis='y', labelsize=7)
-            ax_pdf_ticker_cum_pnl.grid(True)
-            ax_pdf_ticker_cum_pnl.legend(fontsize=6, loc='upper left')
-            fig_pdf_ticker_cum_pnl.tight_layout()
-
-            img_data_ticker_pnl = BytesIO()
-            fig_pdf_ticker_cum_pnl.savefig(img_data_ticker_pnl, format='png')
-            img_data_ticker_pnl.seek(0)
-            plt.close(fig_pdf_ticker_cum_pnl)
-
-            # --- CORRECTED LINE FOR TICKER PNL PLOT ---
             elements.append(Paragraph("Cumulative P&L per Ticker", styles['h2']))
-            elements.append(Image(img_data_ticker_pnl)) # Use Image class
-            # --- END CORRECTED LINE ---
+            elements.append(Image(io.BytesIO(chart_png(plot_all_ticker_pnl, cumulative_pnl_per_ticker_pdf)),
+                                  width=CHART_FIGSIZE[0] * inch, height=CHART_FIGSIZE[1] * inch))
         else:
             elements.append(Paragraph("No data to plot Cumulative P&L per Ticker for PDF.", styles['Normal']))
         
@@ -1017,15 +3558,144 @@ def export_summary_pdf():
     except Exception as e:
         messagebox.showerror("Export Error", f"Failed to export summary: {e}")
 
+def write_tax_lot_report(df, file_path, date_range=None):
+    """Streams the lots realized inside date_range to a CSV (optionally compressed), XLSX or PDF report.
+
+    Rows are written block by block as iter_round_trips yields them: XLSX through openpyxl's write-only
+    mode, PDF drawn page by page on a canvas. Returns the report totals.
+    """
+    name = file_path.lower()
+    file_format, compression = ('xlsx', None) if name.endswith('.xlsx') else ('pdf', None) if name.endswith('.pdf') else export_format(file_path)
+    if file_format not in ('csv', 'xlsx', 'pdf'):
+        raise ValueError("Tax-lot reports are written as CSV, XLSX or PDF.")
+    totals = {'lots': 0, 'quantity': 0.0, 'cost_basis': 0.0, 'proceeds': 0.0, 'gain': 0.0, 'short_term_gain': 0.0, 'long_term_gain': 0.0}
+
+    def report_blocks():
+        for round_trips in iter_round_trips(df, date_range):
+            rows = tax_lot_rows(round_trips)
+            totals['lots'] += len(rows)
+            for key, column in (('quantity', 'Quantity'), ('cost_basis', 'Cost_Basis'), ('proceeds', 'Proceeds'), ('gain', 'Gain')):
+                totals[key] += rows[column].sum()
+            long_term = rows['Term'] == 'Long'
+            totals['long_term_gain'] += rows['Gain'][long_term].sum()
+            totals['short_term_gain'] += rows['Gain'][~long_term].sum()
+            yield rows
+
+    def write(temp_path):
+        if file_format == 'csv':
+            with open(temp_path, 'wb') as raw:
+                stream = open_compressed(raw, compression)
+                with io.TextIOWrapper(stream, encoding='utf-8', newline='') as f:
+                    csv.writer(f).writerow(TAX_LOT_COLUMNS)
+                    for rows in report_blocks():
+                        rows.assign(Acquired=rows['Acquired'].dt.strftime('%Y-%m-%d'),
+                                    Sold=rows['Sold'].dt.strftime('%Y-%m-%d')).to_csv(f, index=False, header=False)
+        elif file_format == 'xlsx':
+            from openpyxl import Workbook
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet("Realized Gains")
+            sheet.append(TAX_LOT_COLUMNS)
+            for rows in report_blocks():
+                for record in rows.itertuples(index=False):
+                    sheet.append([record[0], record[1].to_pydatetime(), record[2].to_pydatetime(), *record[3:]])
+            workbook.save(temp_path)
+        else:
+            write_tax_lot_pdf(temp_path, report_blocks(), totals, date_range)
+
+    atomic_write(file_path, write)
+    return totals
+
+
+def write_tax_lot_pdf(file_path, blocks, totals, date_range):
+    """Draws tax-lot rows straight onto PDF pages, ending with the report totals."""
+    from reportlab.pdfgen import canvas
+    pdf = canvas.Canvas(file_path, pagesize=letter, pageCompression=1)
+    width, height = letter
+    column_x = [0.5, 1.45, 2.3, 3.15, 4.25, 5.25, 6.25, 7.2, 7.75] # Left edge of each column, in inches
+    captions = ["Ticker", "Acquired", "Sold", "Quantity", f"Cost Basis{reporting_currency_label()}", "Proceeds", "Gain", "Days", "Term"]
+    state = {'y': 0.0, 'page': 0}
+
+    def start_page():
+        if state['page']:
+            pdf.showPage()
+        state['page'] += 1
+        pdf.setFont('Helvetica-Bold', 12)
+        pdf.drawString(0.5 * inch, height - 0.6 * inch, "Realized Gains (Tax Lots)")
+        pdf.setFont('Helvetica', 8)
+        pdf.drawString(0.5 * inch, height - 0.8 * inch,
+                       f"Period: {format_date_range(date_range)}   Cost Basis Method: {get_cost_basis_method()}   Page {state['page']}")
+        pdf.setFont('Helvetica-Bold', 7)
+        for x, caption in zip(column_x, captions):
+            pdf.drawString(x * inch, height - 1.1 * inch, caption)
+        pdf.setFont('Helvetica', 7)
+        state['y'] = height - 1.3 * inch
+
+    start_page()
+    for rows in blocks:
+        texts = [rows['Ticker'].astype(str).str.slice(0, 14).to_numpy(),
+                 rows['Acquired'].dt.strftime('%Y-%m-%d').to_numpy(),
+                 rows['Sold'].dt.strftime('%Y-%m-%d').to_numpy(),
+                 format_values(rows['Quantity'].to_numpy(), decimal_precision['quantity']),
+                 format_values(rows['Cost_Basis'].to_numpy(), decimal_precision['pnl']),
+                 format_values(rows['Proceeds'].to_numpy(), decimal_precision['pnl']),
+                 format_values(rows['Gain'].to_numpy(), decimal_precision['pnl']),
+                 format_values(rows['Holding_Days'].to_numpy(), 1),
+                 rows['Term'].to_numpy()]
+        for record in zip(*texts):
+            if state['y'] < 0.6 * inch:
+                start_page()
+            for x, text in zip(column_x, record):
+                pdf.drawString(x * inch, state['y'], str(text))
+            state['y'] -= 10
+
+    if state['y'] < 1.6 * inch:
+        start_page()
+    pdf.setFont('Helvetica-Bold', 8)
+    lines = [f"Lots: {totals['lots']}",
+             f"Proceeds: {format_number(totals['proceeds'], 'pnl')}   Cost Basis: {format_number(totals['cost_basis'], 'pnl')}   "
+             f"Gain: {format_number(totals['gain'], 'pnl')}",
+             f"Short-term Gain: {format_number(totals['short_term_gain'], 'pnl')}   "
+             f"Long-term Gain (held over {LONG_TERM_DAYS} days): {format_number(totals['long_term_gain'], 'pnl')}"]
+    y = state['y'] - 10
+    for line in lines:
+        pdf.drawString(0.5 * inch, y, line)
+        y -= 12
+    pdf.save()
+
+
+def export_tax_lot_report(date_range=None):
+    """Exports the lots realized in date_range (the summary window's period) as a realized-gains report."""
+    df = load_data()
+    if df.empty:
+        messagebox.showinfo("Export", "No data to export tax lots.")
+        return
+
+    file_path = filedialog.asksaveasfilename(defaultextension=".csv",
+                                             filetypes=[("CSV files", "*.csv"), ("Compressed CSV", "*.csv.gz *.csv.bz2 *.csv.xz *.csv.zst"),
+                                                        ("Excel files", "*.xlsx"), ("PDF files", "*.pdf"), ("All files", "*.*")],
+                                             title="Export Realized Gains (Tax Lots)")
+    if file_path:
+        try:
+            totals = write_tax_lot_report(df, file_path, date_range)
+            messagebox.showinfo("Export Success", f"{totals['lots']} realized lots exported, total gain "
+                                                  f"{format_number(totals['gain'], 'pnl')}{reporting_currency_label()}.")
+        except Exception as e:
+            messagebox.showerror("Export Error", f"Failed to export tax lots: {e}")
+
 def on_toplevel_closing(toplevel_window):
     """Handles the closing of Toplevel windows and resets their global variables."""
-    global show_records_window, summary_window, settings_window, book_selection_window
+    global show_records_window, summary_window, settings_window, book_selection_window, ingest_window, simulation_window
+    book_change_listeners.pop(toplevel_window, None)
     if toplevel_window == show_records_window:
         show_records_window = None
     elif toplevel_window == summary_window:
         summary_window = None
     elif toplevel_window == settings_window:
         settings_window = None
+    elif toplevel_window == ingest_window:
+        ingest_window = None
+    elif toplevel_window == simulation_window:
+        simulation_window = None
     elif toplevel_window == book_selection_window:
         # If the book selection window is closed, it usually means the user cancelled.
         # In this case, we should exit the main application as no book was chosen.
@@ -1033,6 +3703,22 @@ def on_toplevel_closing(toplevel_window):
         return
     toplevel_window.destroy()
 
+def subscribe_book_changes(window, callback):
+    """Registers callback(change) to be called on the Tk thread whenever the book changes while window is open."""
+    book_change_listeners[window] = callback
+
+def publish_book_change(change=None):
+    """Tells the open windows that the book, or a setting they display, changed.
+
+    change may carry 'tickers' (the tickers touched) and 'start'/'count' (rows appended at the end of
+    the book); None means the change is unknown and every view recomputes what it shows.
+    """
+    for window, callback in list(book_change_listeners.items()):
+        if window.winfo_exists():
+            callback(change)
+        else:
+            del book_change_listeners[window]
+
 def open_settings_window():
     global settings_window
     if settings_window and settings_window.winfo_exists():
@@ -1040,8 +3726,8 @@ def open_settings_window():
         return
 
     settings_window = Toplevel(root)
-    settings_window.title("Decimal Precision Settings")
-    settings_window.geometry("300x250")
+    settings_window.title("Settings")
+    settings_window.geometry("360x480")
     center_window(settings_window) # Changed
 
     settings_window.protocol("WM_DELETE_WINDOW", lambda: on_toplevel_closing(settings_window))
@@ -1064,6 +3750,43 @@ def open_settings_window():
 
         spinbox_entries[key] = spinbox
 
+    Label(settings_window, text="Book Settings:").pack(pady=10)
+
+    def add_file_setting(label_text, key, title):
+        frame = Frame(settings_window)
+        frame.pack(fill='x', padx=20, pady=5)
+        Label(frame, text=label_text).pack(side='left')
+        entry = Entry(frame, width=20)
+        entry.insert(0, book_settings.get(key, ''))
+
+        def browse():
+            file_path = filedialog.askopenfilename(filetypes=[("Price tables", "*.csv *.parquet"), ("All files", "*.*")],
+                                                   title=title)
+            if file_path:
+                entry.delete(0, END)
+                entry.insert(0, file_path)
+
+        Button(frame, text="...", command=browse).pack(side='right')
+        entry.pack(side='right', padx=5)
+        return entry
+
+    price_history_entry = add_file_setting("Price History:", 'price_history_file', "Select Price History File")
+    fx_rates_entry = add_file_setting("FX Rates:", 'fx_rates_file', "Select FX Rates File")
+
+    currency_frame = Frame(settings_window)
+    currency_frame.pack(fill='x', padx=20, pady=5)
+    Label(currency_frame, text="Reporting Currency:").pack(side='left')
+    currency_entry = Entry(currency_frame, width=10)
+    currency_entry.insert(0, get_reporting_currency())
+    currency_entry.pack(side='right')
+
+    cost_basis_frame = Frame(settings_window)
+    cost_basis_frame.pack(fill='x', padx=20, pady=5)
+    Label(cost_basis_frame, text="Cost Basis Method:").pack(side='left')
+    cost_basis_combobox = ttk.Combobox(cost_basis_frame, values=list(COST_BASIS_METHODS), state="readonly", width=10)
+    cost_basis_combobox.set(get_cost_basis_method())
+    cost_basis_combobox.pack(side='right')
+
     def save_precision_settings():
         for key, spinbox in spinbox_entries.items():
             try:
@@ -1076,22 +3799,267 @@ def open_settings_window():
             except ValueError:
                 messagebox.showwarning("Input Error", f"Precision for {key.replace('_', ' ')} must be a whole number.")
                 return
+
+        price_history_file = price_history_entry.get().strip()
+        fx_rates_file = fx_rates_entry.get().strip()
+        for file_path in (price_history_file, fx_rates_file):
+            if file_path:
+                try:
+                    load_price_history(file_path)
+                except Exception as e:
+                    messagebox.showwarning("Input Error", f"Could not read '{file_path}': {e}")
+                    return
+        book_settings['price_history_file'] = price_history_file
+        book_settings['fx_rates_file'] = fx_rates_file
+        book_settings['reporting_currency'] = currency_entry.get().strip().upper()
+        book_settings['cost_basis_method'] = cost_basis_combobox.get()
+        save_book_settings()
         
-        messagebox.showinfo("Settings Saved", "Decimal precision settings updated successfully!")
-        
-        # Re-open relevant windows to apply new precision if they are open
-        if show_records_window and show_records_window.winfo_exists():
-            show_records_window.destroy()
-            show_records()
-        if summary_window and summary_window.winfo_exists():
-            summary_window.destroy()
-            show_portfolio_summary()
-        
+        messagebox.showinfo("Settings Saved", "Settings updated successfully!")
+
+        # Open windows re-format and recompute in place for the new precision and book settings
+        publish_book_change()
+
         settings_window.destroy()
 
     Button(settings_window, text="Save Settings", command=save_precision_settings).pack(pady=10)
     settings_window.grab_set()
-    root.wait_window(settings_win)
+    root.wait_window(settings_window)
+
+
+# --- What-If Simulation ---
+
+def simulation_time(df):
+    """Date given to hypothetical trades: now, or the last trade of a book that runs into the future."""
+    now = pd.Timestamp.now()
+    return max(now, df['Date'].iloc[-1]) if len(df) else now
+
+
+def simulation_rates(tickers, as_of):
+    """Rates converting each ticker's quote currency into the reporting currency at as_of."""
+    return conversion_rates(quote_assets_for(tickers), np.full(len(tickers), np.datetime64(as_of, 'ns')))
+
+
+def simulate_trades(df, trades):
+    """Projects a batch of hypothetical trades placed after the end of the book, without touching the book.
+
+    trades has Ticker, Trade_Type, Quantity and Price columns and is applied in order to copies of the
+    current open lots of the tickers it trades. Returns the trades with their realized P&L, the total
+    realized P&L and the holdings the batch would leave.
+    """
+    df = prepare_trades(df)
+    lot_state = get_lot_state_at(df, len(df))
+    as_of = simulation_time(df)
+    trades = trades[['Ticker', 'Trade_Type', 'Quantity', 'Price']].reset_index(drop=True)
+    trades.insert(0, 'Date', as_of)
+    simulated = {ticker: {'lots': lot_state[ticker]['lots'].copy(), 'realized_pnl': 0.0}
+                 for ticker in trades['Ticker'].unique() if ticker in lot_state}
+    trade_pnl, _ = apply_trades(simulated, trades)
+    trades['PnL'] = trade_pnl * simulation_rates(trades['Ticker'].to_numpy(), as_of)
+    return {'trades': trades, 'realized_pnl': float(trades['PnL'].sum()),
+            'holdings': holdings_from_lot_state({**lot_state, **simulated})}
+
+
+def simulate_price_scenarios(df, prices, quantities=None):
+    """Projects selling each position at every scenario price, for all scenarios at once.
+
+    prices maps tickers to their scenario prices; arrays must share one length (the scenario count) and
+    scalars apply to every scenario. quantities maps tickers to the quantity sold, a scalar or one per
+    scenario; missing or None sells the whole position. A sell consumes the same lots whatever its price,
+    so a ticker's P&L in every scenario is one vectorized expression over the cumulative quantity and
+    cost of its lots in sell order. Returns (scenario x ticker) DataFrames of prices, realized P&L and
+    remaining quantity and cost basis, and the total realized P&L per scenario.
+    """
+    df = prepare_trades(df)
+    lot_state = get_lot_state_at(df, len(df))
+    quantities = quantities or {}
+    tickers = list(prices)
+    grids = {ticker: np.atleast_1d(np.asarray(prices[ticker], dtype=float)) for ticker in tickers}
+    grids.update({f"{ticker} quantity": np.atleast_1d(np.asarray(quantities[ticker], dtype=float))
+                  for ticker in tickers if quantities.get(ticker) is not None})
+    scenario_count = max((len(grid) for grid in grids.values()), default=0)
+    for name, grid in grids.items():
+        if len(grid) not in (1, scenario_count):
+            raise ValueError(f"{name} has {len(grid)} scenarios, expected 1 or {scenario_count}.")
+        if np.isnan(grid).any() or (grid < 0).any():
+            raise ValueError(f"{name} must contain non-negative numbers.")
+
+    scenario_prices, realized_pnl, remaining_quantity, remaining_cost = {}, {}, {}, {}
+    rates = simulation_rates(tickers, simulation_time(df))
+    for ticker, rate in zip(tickers, rates):
+        state = lot_state.get(ticker)
+        lots = state['lots'].sell_order() if state else []
+        lot_quantities = np.array([lot[0] for lot in lots], dtype=float)
+        lot_prices = np.array([lot[1] for lot in lots], dtype=float)
+        cumulative_quantity = np.concatenate([[0.0], np.cumsum(lot_quantities)])
+        cumulative_cost = np.concatenate([[0.0], np.cumsum(lot_quantities * lot_prices)])
+        held = cumulative_quantity[-1]
+
+        sold = grids.get(f"{ticker} quantity", np.array([held]))
+        matched = np.broadcast_to(np.minimum(sold, held), scenario_count)
+        matched_cost = np.interp(matched, cumulative_quantity, cumulative_cost) # Cost is linear within a lot
+        scenario_prices[ticker] = np.broadcast_to(grids[ticker], scenario_count)
+        realized_pnl[ticker] = (matched * scenario_prices[ticker] - matched_cost) * rate
+        remaining_quantity[ticker] = held - matched
+        remaining_cost[ticker] = cumulative_cost[-1] - matched_cost
+
+    index = pd.RangeIndex(1, scenario_count + 1, name='Scenario')
+    realized_pnl = pd.DataFrame(realized_pnl, index=index, columns=tickers)
+    return {'prices': pd.DataFrame(scenario_prices, index=index, columns=tickers), 'realized_pnl': realized_pnl,
+            'total_realized_pnl': realized_pnl.sum(axis=1),
+            'remaining_quantity': pd.DataFrame(remaining_quantity, index=index, columns=tickers),
+            'remaining_cost': pd.DataFrame(remaining_cost, index=index, columns=tickers)}
+
+
+def parse_scenario_prices(text):
+    """Reads scenario prices written as a list ("95, 100, 105") or a range "start:stop:count".
+
+    At most SIMULATION_MAX_SCENARIOS prices are accepted, so a request cannot allocate an arbitrary grid.
+    """
+    if ':' in text:
+        start, stop, count = text.split(':')
+        if not 1 <= int(count) <= SIMULATION_MAX_SCENARIOS:
+            raise ValueError(f"A price range needs a count between 1 and {SIMULATION_MAX_SCENARIOS}.")
+        return np.linspace(float(start), float(stop), int(count))
+    values = [value for value in text.split(',') if value.strip()]
+    if len(values) > SIMULATION_MAX_SCENARIOS:
+        raise ValueError(f"At most {SIMULATION_MAX_SCENARIOS} scenario prices are allowed.")
+    return np.array([float(value) for value in values])
+
+
+def parse_simulated_trades(text):
+    """Reads hypothetical trades written one per line or separated by ';', as "Ticker, Buy|Sell, Quantity, Price"."""
+    entries = [entry.strip() for entry in re.split(r'[;\n]', text) if entry.strip()]
+    if not entries:
+        raise ValueError("Enter at least one trade as Ticker, Buy|Sell, Quantity, Price.")
+    if len(entries) > SIMULATION_MAX_TRADES:
+        raise ValueError(f"At most {SIMULATION_MAX_TRADES} trades can be simulated at once.")
+    rows = []
+    for entry in entries:
+        fields = [field.strip() for field in entry.split(',')]
+        if len(fields) != 4 or fields[1].capitalize() not in ('Buy', 'Sell'):
+            raise ValueError(f"'{entry}' is not Ticker, Buy|Sell, Quantity, Price.")
+        quantity, price = float(fields[2]), float(fields[3])
+        if not (quantity > 0 and price >= 0):
+            raise ValueError(f"'{entry}' needs a positive quantity and a non-negative price.")
+        rows.append((fields[0], fields[1].capitalize(), quantity, price))
+    return pd.DataFrame(rows, columns=['Ticker', 'Trade_Type', 'Quantity', 'Price'])
+
+
+def open_simulation_window():
+    global simulation_window
+    if simulation_window and simulation_window.winfo_exists():
+        simulation_window.lift()
+        return
+
+    simulation_window = Toplevel(root)
+    simulation_window.title("What-If Simulation")
+    simulation_window.geometry("700x600")
+    center_window(simulation_window)
+    simulation_window.protocol("WM_DELETE_WINDOW", lambda: on_toplevel_closing(simulation_window))
+
+    Label(simulation_window, text="Sell quantity (blank sells the whole position) and scenario prices for each position,\n"
+                                  "as a list (95, 100, 105) or a range start:stop:count. The book is not changed.",
+          justify=LEFT).pack(pady=10, padx=10)
+
+    positions_frame = LabelFrame(simulation_window, text="Current Holdings", padx=10, pady=10)
+    positions_frame.pack(pady=5, padx=10, fill='x')
+    holdings = get_current_holdings(load_data())
+    if not holdings:
+        Label(positions_frame, text="No current holdings.").grid(row=0, column=0)
+    else:
+        for column, text in enumerate(["Ticker", "Quantity", "Avg. Buy Price", "Sell Quantity", "Scenario Prices"]):
+            ttk.Label(positions_frame, text=text, font=("Arial", 10, "bold")).grid(row=0, column=column, padx=5, pady=2)
+    entries = {}
+    for row, (ticker, holding) in enumerate(holdings.items(), start=1):
+        ttk.Label(positions_frame, text=ticker).grid(row=row, column=0, padx=5, pady=2, sticky="w")
+        ttk.Label(positions_frame, text=format_number(holding['quantity'], 'quantity')).grid(row=row, column=1, padx=5, pady=2)
+        ttk.Label(positions_frame, text=format_number(holding['average_buy_price'], 'avg_buy_price')).grid(row=row, column=2, padx=5, pady=2)
+        quantity_entry = Entry(positions_frame, width=12)
+        quantity_entry.grid(row=row, column=3, padx=5, pady=2)
+        prices_entry = Entry(positions_frame, width=24)
+        prices_entry.grid(row=row, column=4, padx=5, pady=2)
+        entries[ticker] = (quantity_entry, prices_entry)
+
+    trades_frame = LabelFrame(simulation_window, text="Hypothetical Trades (Ticker, Buy|Sell, Quantity, Price per line)",
+                              padx=10, pady=10)
+    trades_text = Text(trades_frame, height=4, width=60)
+    trades_text.pack(side=LEFT, fill='x', expand=True)
+
+    result_label = Label(simulation_window, text="", justify=LEFT, wraplength=660)
+    result_tree = ttk.Treeview(simulation_window, show="headings")
+
+    def show_results(columns, rows):
+        result_tree.delete(*result_tree.get_children())
+        result_tree['columns'] = columns
+        for column in columns:
+            result_tree.heading(column, text=column)
+            result_tree.column(column, width=100, anchor="center")
+        for values in rows:
+            result_tree.insert("", "end", values=values)
+
+    def run_simulation():
+        prices, quantities = {}, {}
+        try:
+            for ticker, (quantity_entry, prices_entry) in entries.items():
+                if not prices_entry.get().strip():
+                    continue
+                prices[ticker] = parse_scenario_prices(prices_entry.get())
+                quantities[ticker] = float(quantity_entry.get()) if quantity_entry.get().strip() else None
+            if not prices:
+                messagebox.showwarning("Simulation", "Please enter scenario prices for at least one position.")
+                return
+            result = simulate_price_scenarios(load_data(), prices, quantities)
+        except ValueError as e:
+            messagebox.showerror("Simulation Error", f"Invalid scenario: {e}")
+            return
+
+        columns = ["Scenario"] + [f"{ticker} Price" for ticker in prices] + [f"Realized P&L{reporting_currency_label()}"]
+        shown = result['prices'].iloc[:SIMULATION_MAX_ROWS]
+        price_strings = [format_values(shown[ticker], decimal_precision['price']) for ticker in prices]
+        pnl_strings = format_values(result['total_realized_pnl'].iloc[:SIMULATION_MAX_ROWS], decimal_precision['pnl'])
+        show_results(columns, [[scenario] + [strings[row] for strings in price_strings] + [pnl_strings[row]]
+                               for row, scenario in enumerate(shown.index)])
+
+        total = result['total_realized_pnl']
+        lines = [f"{len(total)} scenarios: realized P&L from {format_number(total.min(), 'pnl')} (scenario {total.idxmin()}) "
+                 f"to {format_number(total.max(), 'pnl')} (scenario {total.idxmax()})."]
+        if len(total) > SIMULATION_MAX_ROWS:
+            lines.append(f"Showing the first {SIMULATION_MAX_ROWS} scenarios.")
+        for ticker in prices:
+            remaining = result['remaining_quantity'][ticker].iloc[0]
+            lines.append(f"{ticker}: {format_number(remaining, 'quantity')} left"
+                         + (f" at {format_number(result['remaining_cost'][ticker].iloc[0] / remaining, 'avg_buy_price')} average cost"
+                            if remaining > 0 else "") + ".")
+        result_label.config(text="\n".join(lines))
+
+    def run_trade_simulation():
+        try:
+            result = simulate_trades(load_data(), parse_simulated_trades(trades_text.get("1.0", END)))
+        except ValueError as e:
+            messagebox.showerror("Simulation Error", f"Invalid trades: {e}")
+            return
+
+        trades = result['trades']
+        columns = ["Ticker", "Type", "Quantity", "Price", f"Realized P&L{reporting_currency_label()}"]
+        show_results(columns, zip(trades['Ticker'], trades['Trade_Type'],
+                                  format_values(trades['Quantity'], decimal_precision['quantity']),
+                                  format_values(trades['Price'], decimal_precision['price']),
+                                  format_values(trades['PnL'], decimal_precision['pnl'])))
+
+        lines = [f"{len(trades)} trades: realized P&L {format_number(result['realized_pnl'], 'pnl')}."]
+        for ticker in trades['Ticker'].unique():
+            holding = result['holdings'].get(ticker)
+            lines.append(f"{ticker}: " + (f"{format_number(holding['quantity'], 'quantity')} left at "
+                                          f"{format_number(holding['average_buy_price'], 'avg_buy_price')} average cost."
+                                          if holding else "no position left."))
+        result_label.config(text="\n".join(lines))
+
+    Button(simulation_window, text="Simulate", command=run_simulation).pack(pady=5)
+    Button(trades_frame, text="Simulate Trades", command=run_trade_simulation).pack(side=LEFT, padx=5)
+    trades_frame.pack(pady=5, padx=10, fill='x')
+    result_label.pack(pady=5, padx=10, fill='x')
+    result_tree.pack(pady=5, padx=10, fill='both', expand=True)
 
 
 # --- Initial Book Selection Window ---
@@ -1141,31 +4109,866 @@ def show_book_selection_window():
     root.wait_window(book_selection_window) # Wait for this window to close
 
 
-# --- Main Application Window ---
-# Don't call init_excel_file here directly anymore
-root = Tk()
-root.title("Trading Book Manager")
-root.geometry("400x300")
-root.resizable(False, False) # Disable resizing for a fixed layout
+# --- Fill Ingestion ---
+
+def parse_fill(record):
+    """Turns one fill (a dict keyed by book columns or common aliases) into a book row.
+
+    The trade entry rules of the Add Record form apply; a rejected fill raises ValueError.
+    """
+    fields = {}
+    for key, value in record.items():
+        column = INGEST_FIELD_NAMES.get(str(key).strip().lower())
+        if column:
+            fields[column] = value
+    ticker = str(fields.get('Ticker') or '').strip()
+    if not ticker:
+        raise ValueError("Ticker is required.")
+    date_str = str(fields.get('Date') or '').strip()
+    trade_type = str(fields.get('Trade_Type') or '').strip()
+    quantity, price = check_trade_input(date_str, str(fields.get('Quantity', '')), str(fields.get('Price', '')), trade_type)
+    notes = fields.get('Notes')
+    fill_id = fields.get('Fill_Id')
+    fill_id = None if fill_id is None or pd.isna(fill_id) else str(fill_id).strip() or None
+    return {'Date': pd.Timestamp(date_str), 'Ticker': ticker, 'Trade_Type': trade_type.capitalize(),
+            'Quantity': quantity, 'Price': price, 'Total': quantity * price,
+            'Notes': '' if notes is None or pd.isna(notes) else str(notes), 'Fill_Id': fill_id}
+
+
+def parse_fill_line(line, csv_header=None):
+    """Parses one JSON object line, or one CSV row when the file's header is given."""
+    if csv_header is not None:
+        return parse_fill(dict(zip(csv_header, next(csv.reader([line])))))
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("A fill must be a JSON object.")
+    return parse_fill(record)
+
+
+def load_ingest_offsets():
+    """Returns how far each fill file has been committed to the current book, keyed by absolute path."""
+    try:
+        with open(sidecar_path('.ingest.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_ingest_offset(source, offset):
+    offsets = load_ingest_offsets()
+    offsets[os.path.abspath(source)] = offset
+
+    def write(temp_path):
+        with open(temp_path, 'w') as f:
+            json.dump(offsets, f, indent=2)
+
+    atomic_write(sidecar_path('.ingest.json'), write)
+
+
+def commit_fills(fills, source=None):
+    """Appends a batch of (row, file offset) fills to the current book with a single write.
+
+    The file offset of the last fill is recorded with the batch so a restarted ingestion resumes after it.
+    Fills already in the book (see find_duplicate_trades) are skipped and counted as duplicates.
+    Returns a change description for publish_book_change: 'start' is the book position of the first new
+    row when the batch landed at the end of the book, None when it was back-dated.
+    """
+    rows = pd.DataFrame([row for row, _ in fills], columns=['Date', 'Ticker', 'Trade_Type', 'Quantity', 'Price', 'Total', 'Notes'])
+    fill_ids = [row.get('Fill_Id') for row, _ in fills]
+    with book_write_lock():
+        duplicates, hashes = find_duplicate_trades(rows, fill_ids)
+        new_rows = rows[~duplicates]
+        df = read_book(EXCEL_FILE)
+        start = len(df)
+        if len(new_rows):
+            if not df.empty and new_rows['Date'].min() < df['Date'].iloc[-1]:
+                start = None
+            new_fill_ids = {fill_ids[i]: hashes[i] for i in np.flatnonzero(~duplicates) if fill_ids[i]}
+            store_book(pd.concat([df, new_rows], ignore_index=True) if not df.empty else new_rows.reset_index(drop=True),
+                       changed_tickers=set(new_rows['Ticker']), fill_ids=new_fill_ids)
+        offsets = [offset for _, offset in fills if offset is not None]
+        if source is not None and offsets:
+            save_ingest_offset(source, max(offsets))
+    return {'start': start, 'count': len(new_rows), 'duplicates': int(duplicates.sum()), 'tickers': sorted(set(new_rows['Ticker']))}
+
+
+def reject_fill(stats, error, line):
+    """Counts a malformed fill; the count and the last error are shown with the ingestion status."""
+    stats['rejected'] += 1
+    stats['last_error'] = f"{error} ({line.strip()[:80]})"
+    # Only the first rejection is a warning, so a feed of bad lines does not flood the log
+    logger.log(logging.WARNING if stats['rejected'] == 1 else logging.DEBUG, "Rejected fill: %s", stats['last_error'])
+
+
+async def tail_fill_file(file_path, fills, stop, stats):
+    """Follows a JSONL or CSV fill file like 'tail -f', starting after the last committed fill."""
+    is_csv = os.path.splitext(file_path)[1].lower() == '.csv'
+    offset = load_ingest_offsets().get(os.path.abspath(file_path), 0)
+    csv_header = None
+    with open(file_path, 'rb') as f:
+        if is_csv and offset:
+            csv_header = next(csv.reader([f.readline().decode('utf-8-sig', errors='replace')]))
+        f.seek(offset)
+        pending = b''
+        while not stop.is_set():
+            chunk = f.read(1 << 16)
+            if not chunk:
+                if os.path.getsize(file_path) < offset:
+                    # The file was truncated or replaced; start again from its beginning
+                    f.seek(0)
+                    offset, pending, csv_header = 0, b'', None
+                await asyncio.sleep(INGEST_POLL_INTERVAL)
+                continue
+            # Only complete lines are parsed; a partially written last line waits for the next read
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for raw_line in lines:
+                offset += len(raw_line) + 1
+                try:
+                    line = raw_line.decode('utf-8-sig').strip() # A line that is not UTF-8 is rejected like any other
+                    if not line:
+                        continue
+                    if is_csv and csv_header is None:
+                        csv_header = next(csv.reader([line]))
+                        continue
+                    fill = parse_fill_line(line, csv_header)
+                except ValueError as e:
+                    reject_fill(stats, e, raw_line.decode('utf-8', errors='replace'))
+                    continue
+                await fills.put((fill, offset))
+
+
+async def serve_fill_socket(host, port, fills, stop, stats):
+    """Accepts JSONL fills from local producers on a loopback TCP port."""
+    if not ipaddress.ip_address(host).is_loopback:
+        raise ValueError("Fill ingestion only listens on loopback addresses.")
+
+    async def handle_producer(reader, writer):
+        try:
+            while not stop.is_set():
+                raw_line = await reader.readline()
+                if not raw_line:
+                    break
+                line = raw_line.decode('utf-8', errors='replace').strip()
+                if not line:
+                    continue
+                try:
+                    fill = parse_fill_line(line)
+                except ValueError as e:
+                    reject_fill(stats, e, line)
+                    continue
+                await fills.put((fill, None))
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle_producer, host, port)
+    logger.info("Accepting fills on tcp://%s:%s", host, port)
+    async with server:
+        while not stop.is_set():
+            await asyncio.sleep(INGEST_POLL_INTERVAL)
+
+
+def read_fill_source(source, fills, stop, stats):
+    """Returns the coroutine that reads fills from source: 'tcp://host:port' or a .jsonl/.csv file path."""
+    if source.startswith('tcp://'):
+        address = urllib.parse.urlsplit(source)
+        return serve_fill_socket(address.hostname or '127.0.0.1', address.port or INGEST_DEFAULT_PORT, fills, stop, stats)
+    if not os.path.isfile(source):
+        raise FileNotFoundError(f"Fill file '{source}' not found.")
+    return tail_fill_file(source, fills, stop, stats)
+
+
+async def ingest_fills(source, stop, stats=None, on_commit=None):
+    """Reads fills from source until stop (a threading.Event) is set and appends them to the current book.
+
+    Fills are committed in micro-batches: a batch is written once it holds INGEST_BATCH_SIZE fills or its
+    first fill has waited INGEST_BATCH_INTERVAL seconds. Reading continues while a batch is being written,
+    so a slow write only makes the next batch larger instead of falling behind one write per fill.
+    """
+    if stats is None:
+        stats = {'committed': 0, 'duplicates': 0, 'rejected': 0, 'batches': 0, 'last_error': ''}
+    loop = asyncio.get_running_loop()
+    fills = asyncio.Queue()
+    file_source = None if source.startswith('tcp://') else source
+    reader = asyncio.create_task(read_fill_source(source, fills, stop, stats))
+    batch = []
+    try:
+        while True:
+            if not batch:
+                try:
+                    batch.append(await asyncio.wait_for(fills.get(), INGEST_POLL_INTERVAL))
+                except asyncio.TimeoutError:
+                    if reader.done():
+                        break
+                    continue
+                deadline = loop.time() + INGEST_BATCH_INTERVAL
+
+            while len(batch) < INGEST_BATCH_SIZE and not fills.empty():
+                batch.append(fills.get_nowait())
+            remaining = deadline - loop.time()
+            if len(batch) < INGEST_BATCH_SIZE and remaining > 0:
+                try:
+                    batch.append(await asyncio.wait_for(fills.get(), remaining))
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+
+            committing, batch = batch, []
+            change = await asyncio.to_thread(commit_fills, committing, file_source)
+            stats['committed'] += change['count']
+            stats['duplicates'] += change['duplicates']
+            stats['batches'] += 1
+            if on_commit is not None:
+                on_commit(change)
+        reader.result()
+    finally:
+        reader.cancel()
+        while not fills.empty():
+            batch.append(fills.get_nowait())
+        if batch:
+            # Stopped or interrupted: write what was already read rather than dropping it
+            change = commit_fills(batch, file_source)
+            stats['committed'] += change['count']
+            stats['duplicates'] += change['duplicates']
+            stats['batches'] += 1
+            if on_commit is not None:
+                on_commit(change)
+    return stats
+
+
+def run_ingestion_job(job):
+    """Thread body for GUI ingestion; progress and errors are reported through job['events']."""
+    try:
+        asyncio.run(ingest_fills(job['source'], job['stop'], job['stats'], on_commit=job['events'].put))
+    except Exception as e:
+        job['events'].put({'error': str(e)})
+
+
+def start_ingestion(source):
+    global ingest_job
+    ingest_job = {'source': source, 'stop': threading.Event(), 'events': queue.Queue(),
+                  'stats': {'committed': 0, 'duplicates': 0, 'rejected': 0, 'batches': 0, 'last_error': ''}}
+    ingest_job['thread'] = threading.Thread(target=run_ingestion_job, args=(ingest_job,), daemon=True)
+    ingest_job['thread'].start()
+    root.after(INGEST_VIEW_REFRESH_MS, poll_ingestion, ingest_job)
+
+
+def stop_ingestion(wait=True):
+    """Stops the running ingestion; the fills it has already read are still committed."""
+    if ingest_job is None:
+        return
+    ingest_job['stop'].set()
+    if wait:
+        ingest_job['thread'].join(timeout=BOOK_LOCK_TIMEOUT + 5)
+
+
+def poll_ingestion(job):
+    """Runs on the Tk thread: applies committed batches to the open windows, at most once per interval."""
+    changes = []
+    while not job['events'].empty():
+        event = job['events'].get_nowait()
+        if 'error' in event:
+            messagebox.showerror("Ingestion Error", event['error'])
+        else:
+            changes.append(event)
+
+    if changes:
+        # Consecutive appended batches merge into one change starting at the first batch
+        merged = {'start': changes[0]['start'] if all(change['start'] is not None for change in changes) else None,
+                  'count': sum(change['count'] for change in changes),
+                  'tickers': sorted({ticker for change in changes for ticker in change['tickers']})}
+        publish_book_change(merged)
+
+    if ingest_window is not None and ingest_window.winfo_exists():
+        ingest_window.update_status(job)
+    if job['thread'].is_alive() or not job['events'].empty():
+        root.after(INGEST_VIEW_REFRESH_MS, poll_ingestion, job)
+
+
+def open_ingest_window():
+    global ingest_window
+    if ingest_window and ingest_window.winfo_exists():
+        ingest_window.lift()
+        return
 
-# Bind the close protocol for the main window
-root.protocol("WM_DELETE_WINDOW", lambda: on_toplevel_closing(root)) # Use on_toplevel_closing for root too
+    ingest_window = Toplevel(root)
+    ingest_window.title("Ingest Fills")
+    ingest_window.geometry("460x200")
+    center_window(ingest_window)
+    ingest_window.protocol("WM_DELETE_WINDOW", lambda: on_toplevel_closing(ingest_window))
+
+    Label(ingest_window, text="Fill file (.jsonl or .csv) or tcp://127.0.0.1:port").pack(pady=(10, 0))
+    source_frame = Frame(ingest_window)
+    source_frame.pack(pady=5, padx=10, fill='x')
+    source_entry = Entry(source_frame)
+    source_entry.pack(side=LEFT, expand=True, fill='x')
+
+    def browse_source():
+        file_path = filedialog.askopenfilename(filetypes=[("Fill files", "*.jsonl *.ndjson *.json *.csv"), ("All files", "*.*")],
+                                               title="Select Fill File")
+        if file_path:
+            source_entry.delete(0, END)
+            source_entry.insert(0, file_path)
+
+    Button(source_frame, text="Browse", command=browse_source).pack(side=LEFT, padx=5)
 
-# Main buttons
-Button(root, text="Add Record", command=lambda: add_edit_form(update_callback=show_records)).pack(pady=10, fill='x', padx=50)
-Button(root, text="Show Records", command=show_records).pack(pady=10, fill='x', padx=50)
-Button(root, text="Show Portfolio Summary", command=show_portfolio_summary).pack(pady=10, fill='x', padx=50)
-Button(root, text="Undo Last Action", command=undo_last_action).pack(pady=10, fill='x', padx=50)
-Button(root, text="Redo Last Undo", command=redo_last_undo).pack(pady=10, fill='x', padx=50)
-Button(root, text="Export Summary to PDF", command=export_summary_pdf).pack(pady=10, fill='x', padx=50)
-Button(root, text="Settings", command=open_settings_window).pack(pady=10, fill='x', padx=50)
+    status_label = Label(ingest_window, text="Not running.", justify=LEFT)
+    status_label.pack(pady=5)
 
-# Add an Exit button
-Button(root, text="Exit", command=lambda: on_toplevel_closing(root), bg="red", fg="white").pack(pady=20, fill='x', padx=50)
+    def running():
+        return ingest_job is not None and ingest_job['thread'].is_alive()
+
+    def toggle_ingestion():
+        if running():
+            stop_ingestion(wait=False)
+            return
+        source = source_entry.get().strip()
+        if not source:
+            messagebox.showwarning("Ingestion", "Please choose a fill file or socket address.")
+            return
+        start_ingestion(source)
+        update_status(ingest_job)
+
+    toggle_button = Button(ingest_window, text="Start", command=toggle_ingestion)
+    toggle_button.pack(pady=5)
+
+    def update_status(job):
+        stats = job['stats']
+        state = "Running" if job['thread'].is_alive() else "Stopped"
+        if job['thread'].is_alive() and job['stop'].is_set():
+            state = "Stopping"
+        text = (f"{state}: {stats['committed']} fills committed in {stats['batches']} batches, "
+                f"{stats['duplicates']} duplicates skipped, {stats['rejected']} rejected.")
+        if stats['last_error']:
+            text += f"\nLast rejected: {stats['last_error']}"
+        status_label.config(text=text, wraplength=420)
+        toggle_button.config(text="Stop" if job['thread'].is_alive() else "Start")
+
+    ingest_window.update_status = update_status
+    if ingest_job is not None:
+        source_entry.insert(0, ingest_job['source'])
+        update_status(ingest_job)
+
+
+# --- Out-of-Core Analytics ---
+
+def iter_xlsx_frames(file_path):
+    """Yields a workbook's trades as typed DataFrames, one per scanned piece of sheet XML."""
+    with zipfile.ZipFile(file_path) as archive:
+        date1904 = xlsx_date1904(archive)
+        shared_strings = xlsx_shared_strings(archive)
+        header = None
+        for chunk in iter_xlsx_chunks(archive):
+            parts = {letters: [column] for letters, column in scan_xlsx_cells(chunk, shared_strings).items()}
+            if not parts:
+                continue
+            if header is None:
+                header = xlsx_header(parts)
+                if not header:
+                    raise ValueError(f"'{file_path}' has no header row.")
+            first_row = max(2, min(int(rows.min()) for [(rows, _, _)] in parts.values()))
+            last_row = max(int(rows.max()) for [(rows, _, _)] in parts.values())
+            if last_row >= first_row:
+                yield pd.DataFrame(xlsx_book_columns(header, parts, first_row, last_row, date1904))
+
+
+def iter_source_frames(file_path, chunk_rows=STREAM_CHUNK_ROWS):
+    """Yields the trades of a book or archive file piece by piece, with parsed dates.
+
+    Workbooks are scanned one piece of sheet XML at a time; CSV (optionally compressed), Parquet and
+    Arrow files are read chunk_rows rows at a time. Parquet and Arrow need pyarrow.
+    """
+    if file_path.lower().endswith(('.xlsx', '.xlsm')):
+        frames = iter_xlsx_frames(file_path)
+    else:
+        file_format, compression = export_format(file_path)
+        if file_format == 'csv':
+            frames = iter_csv_frames(file_path, compression, chunk_rows)
+        else:
+            try:
+                import pyarrow as pa
+                import pyarrow.ipc
+                import pyarrow.parquet
+            except ImportError:
+                raise ValueError("Reading Parquet and Arrow archives needs the 'pyarrow' package (pip install pyarrow).")
+            if file_format == 'parquet':
+                batches = pa.parquet.ParquetFile(file_path).iter_batches(batch_size=chunk_rows)
+            else:
+                reader = pa.ipc.open_file(pa.memory_map(file_path))
+                batches = (reader.get_batch(index).slice(start, chunk_rows)
+                           for index in range(reader.num_record_batches)
+                           for start in range(0, reader.get_batch(index).num_rows, chunk_rows))
+            frames = (batch.to_pandas() for batch in batches)
+    for frame in frames:
+        frame['Date'] = pd.to_datetime(frame['Date'], errors='coerce')
+        yield frame.dropna(subset=['Date'])
+
+
+def iter_csv_frames(file_path, compression, chunk_rows):
+    with pd.read_csv(file_path, compression=compression, chunksize=chunk_rows) as reader:
+        yield from reader
+
+
+class UnsortedSourceError(ValueError):
+    """A streamed source whose dates go backwards."""
+
+
+def iter_sorted_trades(file_paths, chunk_rows=STREAM_CHUNK_ROWS):
+    """Merges date-sorted sources (e.g. one archive per account) into one date-sorted stream of chunks.
+
+    Rows are released once no source can still produce an earlier date, so memory holds about one
+    piece per source. Trades with the same date keep their source and file order, like the stable
+    book sort. A source whose dates go backwards raises UnsortedSourceError.
+    """
+    sources = [iter_source_frames(file_path, chunk_rows) for file_path in file_paths]
+    buffers = [None] * len(sources) # Unreleased rows per source
+    last_dates = [None] * len(sources)
+    active = set(range(len(sources)))
+
+    def read_next(index):
+        """Appends the next non-empty piece of a source to its buffer; False once the source is exhausted."""
+        for frame in sources[index]:
+            if frame.empty:
+                continue
+            dates = frame['Date']
+            if not dates.is_monotonic_increasing or (last_dates[index] is not None and dates.iloc[0] < last_dates[index]):
+                raise UnsortedSourceError(f"'{file_paths[index]}' is not sorted by date. Archives backfilled together must each be "
+                                          f"sorted: sort its rows by Date (oldest first) and save it, or backfill it on its own.")
+            last_dates[index] = dates.iloc[-1]
+            buffers[index] = frame if buffers[index] is None else pd.concat([buffers[index], frame], ignore_index=True)
+            return True
+        active.discard(index)
+        return False
 
-# Show the book selection window first
-show_book_selection_window()
+    for index in range(len(sources)):
+        read_next(index)
+    while active:
+        # Everything before the earliest last-buffered date of the open sources can be released. Exhausted
+        # sources hold their rows at the watermark too: an open source may still read rows of that day,
+        # and those must come first when the open source is listed earlier
+        watermark = min(last_dates[index] for index in active)
+        released = []
+        for index, buffer in enumerate(buffers):
+            if buffer is None:
+                continue
+            cut = int(buffer['Date'].searchsorted(watermark, side='left'))
+            if cut:
+                released.append(buffer.iloc[:cut])
+                buffers[index] = buffer.iloc[cut:] if cut < len(buffer) else None
+        if released:
+            yield pd.concat(released, ignore_index=True).sort_values(by='Date', kind='mergesort', ignore_index=True)
+        for index in list(active):
+            if buffers[index] is None or (not released and last_dates[index] == watermark):
+                read_next(index)
+    remaining = [buffer for buffer in buffers if buffer is not None]
+    if remaining:
+        yield pd.concat(remaining, ignore_index=True).sort_values(by='Date', kind='mergesort', ignore_index=True)
+
+
+def iter_sorted_in_memory(file_path, chunk_rows=STREAM_CHUNK_ROWS):
+    """Reads a whole source, sorts it stably by date and yields it in chunks of chunk_rows rows."""
+    df = sort_book(pd.concat(list(iter_source_frames(file_path, chunk_rows)), ignore_index=True))
+    for start in range(0, len(df), chunk_rows):
+        yield df.iloc[start:start + chunk_rows]
+
+
+def stream_book_analytics(file_paths, chunk_rows=STREAM_CHUNK_ROWS, progress=None):
+    """Computes holdings, realized P&L and the daily and monthly rollups of archives without loading them whole.
+
+    Trades are matched chunk by chunk against one running lot state with the current book settings
+    (cost-basis method, reporting currency, FX rates), so the results equal those of the in-memory
+    analytics. Memory holds a piece per source, the open lots and one rollup row per ticker and day.
+    Several archives must each be sorted by date; a single unsorted archive (such as a book saved by an
+    older version) is instead read whole and sorted in memory, starting over. progress(trades) is called
+    after every chunk.
+    """
+    try:
+        return analyze_trade_chunks(iter_sorted_trades(file_paths, chunk_rows), progress)
+    except UnsortedSourceError:
+        if len(file_paths) != 1:
+            raise
+    logger.warning("'%s' is not sorted by date; sorting it in memory.", file_paths[0])
+    return analyze_trade_chunks(iter_sorted_in_memory(file_paths[0], chunk_rows), progress)
+
+
+def analyze_trade_chunks(chunks, progress=None):
+    """Runs date-sorted chunks of trades through the streamed analytics of stream_book_analytics."""
+    method = get_cost_basis_method()
+    lot_state = {}
+    daily_parts = []
+    trades = 0
+    for chunk in chunks:
+        trade_rows = trade_rollup_rows(chunk, *apply_trades(lot_state, chunk, method))
+        daily_parts.append(aggregate_rollup(trade_rows, 'D'))
+        if len(daily_parts) >= 64:
+            # Only the days that straddle chunks repeat, so folding keeps the parts near the rollup size
+            daily_parts = [aggregate_rollup(pd.concat(daily_parts, ignore_index=True).rename(columns={'Period': 'Date'}), 'D')]
+        trades += len(chunk)
+        if progress:
+            progress(trades)
+
+    if daily_parts:
+        daily = aggregate_rollup(pd.concat(daily_parts, ignore_index=True).rename(columns={'Period': 'Date'}), 'D')
+    else:
+        daily = pd.DataFrame({column: pd.Series(dtype='datetime64[ns]' if column == 'Period' else object if column == 'Ticker' else float)
+                              for column in ROLLUP_COLUMNS})
+    monthly = aggregate_rollup(daily.rename(columns={'Period': 'Date'}), 'M')
+    realized_pnl = daily.groupby('Ticker', sort=False)['Realized_PnL'].sum().to_dict()
+    return {
+        'trades': trades,
+        'cost_basis_method': method,
+        'holdings': holdings_from_lot_state(lot_state),
+        'realized_pnl': realized_pnl,
+        'rollups': {'daily': with_rollup_totals(daily), 'monthly': with_rollup_totals(monthly)},
+    }
 
-# Start the Tkinter event loop only after a book is selected/created
-root.mainloop()
 
+def write_stream_analytics(result, output_dir):
+    """Writes streamed analytics as daily/monthly rollup CSV files and a summary.json with holdings and realized P&L."""
+    os.makedirs(output_dir, exist_ok=True)
+    for key in ('daily', 'monthly'):
+        atomic_write(os.path.join(output_dir, f'{key}_rollup.csv'),
+                     lambda temp_path, key=key: result['rollups'][key].to_csv(temp_path, index=False))
+
+    def write_summary(temp_path):
+        with open(temp_path, 'w') as f:
+            json.dump({key: result[key] for key in ('trades', 'cost_basis_method', 'holdings', 'realized_pnl')},
+                      f, indent=2, default=json_default)
+
+    atomic_write(os.path.join(output_dir, 'summary.json'), write_summary)
+
+
+# --- Local Read API ---
+
+@contextmanager
+def active_book(file_path):
+    """Temporarily points the module-level book state (EXCEL_FILE and its settings) at another book."""
+    global EXCEL_FILE, book_settings
+    previous_file, previous_settings = EXCEL_FILE, book_settings
+    EXCEL_FILE = file_path
+    load_book_settings()
+    try:
+        yield
+    finally:
+        EXCEL_FILE, book_settings = previous_file, previous_settings
+
+
+def json_default(value):
+    """Serializes numpy and pandas scalars for API responses."""
+    if isinstance(value, (np.integer, np.floating)):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, datetime, date)):
+        return value.strftime('%Y-%m-%d')
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def api_book_inputs(file_path):
+    """Identifies everything a served book's responses depend on: the book file, its settings file and
+    the FX and price history files the settings point at."""
+    with active_book(file_path):
+        price_history_file = book_settings.get('price_history_file')
+        return [list(file_signature(file_path) or ()), list(file_signature(sidecar_path('.settings.json')) or ()),
+                fx_signature(), list(file_signature(price_history_file) or ()) if price_history_file else None]
+
+
+def load_api_book(book):
+    """(Re)loads a served book and precomputes the state every client asks for."""
+    inputs = api_book_inputs(book['path'])
+    with active_book(book['path']):
+        df = read_book(book['path'])
+        book.update({
+            'signature': df.attrs['book_signature'],
+            'inputs': inputs,
+            'settings': dict(book_settings),
+            'version': book.get('version', 0) + 1,
+            'df': df,
+            'trade_types': df['Trade_Type'].astype(str).str.lower(),
+            'holdings': get_current_holdings(df),
+            'realized_pnl': calculate_realized_pnl(df),
+            'metrics': calculate_performance_metrics(df),
+            'unconverted_quote_assets': unconvertible_quote_assets(df['Ticker']),
+            'responses': {},
+        })
+
+
+def api_date_range(query):
+    """Reads period=All Time|YTD|MTD or start/end (YYYY-MM-DD) query parameters into a date range."""
+    start, end = query.get('start'), query.get('end')
+    period = query.get('period') or ("Custom" if start or end else "All Time")
+    if period not in PERIOD_OPTIONS:
+        raise ValueError(f"Unknown period '{period}'.")
+    return resolve_date_range(period, start, end)
+
+
+def api_trades_page(book, query):
+    """Returns one page of the book's trades after the ticker/type/date/search filters in query."""
+    df = book['df']
+    lo, hi = get_date_range_bounds(df, api_date_range(query))
+    trades = df.iloc[lo:hi]
+    mask = np.ones(len(trades), dtype=bool)
+    if query.get('ticker'):
+        mask &= (trades['Ticker'].astype(str) == query['ticker']).to_numpy()
+    if query.get('type'):
+        mask &= (book['trade_types'].iloc[lo:hi] == query['type'].lower()).to_numpy()
+    if query.get('search'):
+        search_term = query['search'].lower()
+        mask &= (trades['Ticker'].astype(str).str.lower().str.contains(search_term, regex=False)
+                 | trades['Notes'].astype(str).str.lower().str.contains(search_term, regex=False)).to_numpy()
+    trades = trades[mask]
+
+    page = max(int(query.get('page', 1)), 1)
+    page_size = min(max(int(query.get('page_size', API_DEFAULT_PAGE_SIZE)), 1), API_MAX_PAGE_SIZE)
+    page_rows = trades.iloc[(page - 1) * page_size:page * page_size]
+    records = page_rows.astype(object).where(page_rows.notna(), None)
+    records.insert(0, 'Index', page_rows.index)
+    return {'page': page, 'page_size': page_size, 'total': len(trades), 'trades': records.to_dict('records')}
+
+
+def api_book_payload(book, resource, query):
+    """Builds the JSON payload of one book resource."""
+    if resource == '':
+        df = book['df']
+        return {'id': book['id'], 'path': book['path'], 'version': book['version'], 'trades': len(df),
+                'first_date': df['Date'].iloc[0] if len(df) else None,
+                'last_date': df['Date'].iloc[-1] if len(df) else None}
+    if resource == 'trades':
+        return api_trades_page(book, query)
+
+    date_range = api_date_range(query)
+    with active_book(book['path']):
+        if resource == 'holdings':
+            holdings = book['holdings'] if date_range is None else get_current_holdings(book['df'], date_range)
+            return {'as_of': format_date_range(date_range), 'cost_basis_method': get_cost_basis_method(), 'holdings': holdings,
+                    'unconverted_quote_assets': book['unconverted_quote_assets']}
+        if resource == 'realized_pnl':
+            realized_pnl = book['realized_pnl'] if date_range is None else calculate_realized_pnl(book['df'], date_range)
+            return {'period': format_date_range(date_range), 'realized_pnl': realized_pnl,
+                    'unconverted_quote_assets': book['unconverted_quote_assets']}
+        if resource == 'metrics':
+            metrics = book['metrics'] if date_range is None else calculate_performance_metrics(book['df'], date_range)
+            return {'period': format_date_range(date_range), 'metrics': metrics,
+                    'unconverted_quote_assets': book['unconverted_quote_assets']}
+        if resource == 'simulation' and query.get('trades'):
+            # e.g. simulation?trades=BTCUSDT,Sell,0.5,60000;ETHUSDT,Buy,1,3000 (trades applied in order)
+            result = simulate_trades(book['df'], parse_simulated_trades(query['trades']))
+            trades = result['trades'].drop(columns='Date').rename(columns={'PnL': 'realized_pnl'})
+            return {'cost_basis_method': get_cost_basis_method(), 'trades': trades.to_dict('records'),
+                    'realized_pnl': result['realized_pnl'],
+                    'unconverted_quote_assets': unconvertible_quote_assets(pd.concat([book['df']['Ticker'], trades['Ticker']])),
+                    'holdings': {ticker: result['holdings'][ticker] for ticker in trades['Ticker'].unique()
+                                 if ticker in result['holdings']}}
+        if resource == 'simulation':
+            # e.g. simulation?ticker=BTCUSDT&prices=50000:70000:41&quantity=0.5 (quantity defaults to the position)
+            ticker = query.get('ticker')
+            if not ticker or not query.get('prices'):
+                raise ValueError("A simulation needs a trades parameter, or ticker and prices parameters.")
+            quantity = float(query['quantity']) if query.get('quantity') else None
+            result = simulate_price_scenarios(book['df'], {ticker: parse_scenario_prices(query['prices'])}, {ticker: quantity})
+            scenarios = pd.DataFrame({'price': result['prices'][ticker], 'realized_pnl': result['realized_pnl'][ticker],
+                                      'remaining_quantity': result['remaining_quantity'][ticker],
+                                      'remaining_cost': result['remaining_cost'][ticker]})
+            return {'ticker': ticker, 'cost_basis_method': get_cost_basis_method(), 'scenarios': scenarios.to_dict('records')}
+    raise KeyError(resource)
+
+
+def api_response(books, method, target, if_none_match=None):
+    """Routes one request to (status, body, etag). Bodies are cached per ETag.
+
+    ETags are derived from the book's inputs (see api_book_inputs) and the request target, not the
+    in-process version counter, so they stay valid across server restarts and change whenever the
+    served data can. YTD and MTD queries also depend on the current date.
+    """
+    if method != 'GET':
+        return 405, b'{"error": "Only GET is supported."}', None
+
+    url = urllib.parse.urlsplit(target)
+    parts = [part for part in url.path.split('/') if part]
+    if parts == ['books']:
+        payload = [{'id': book['id'], 'version': book['version'], 'trades': len(book['df'])} for book in books.values()]
+        return 200, json.dumps(payload).encode(), None
+    if len(parts) not in (2, 3) or parts[0] != 'books' or parts[1] not in books:
+        return 404, b'{"error": "Not found."}', None
+
+    book = books[parts[1]]
+    query = {key: values[-1] for key, values in urllib.parse.parse_qs(url.query).items()}
+    today = date.today().isoformat() if query.get('period') in ("YTD", "MTD") else None
+    etag_source = json.dumps([book['inputs'], book['settings'], target, today], sort_keys=True, default=str)
+    etag = f'"{hashlib.blake2b(etag_source.encode(), digest_size=12).hexdigest()}"'
+    if if_none_match == etag:
+        return 304, b'', etag
+    if etag in book['responses']:
+        return 200, book['responses'][etag], etag
+
+    try:
+        payload = api_book_payload(book, parts[2] if len(parts) == 3 else '', query)
+    except KeyError:
+        return 404, b'{"error": "Not found."}', None
+    except ValueError as e:
+        return 400, json.dumps({'error': str(e)}).encode(), None
+
+    body = json.dumps(dict(payload, version=book['version']), default=json_default).encode()
+    if len(book['responses']) >= MAX_API_CACHED_RESPONSES:
+        book['responses'].pop(next(iter(book['responses'])))
+    book['responses'][etag] = body
+    return 200, body, etag
+
+
+async def handle_api_connection(reader, writer, books):
+    """Serves HTTP/1.1 requests (with keep-alive) on one client connection."""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target, http_version = request_line.decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            try:
+                status, body, etag = api_response(books, method, target, headers.get('if-none-match'))
+            except Exception:
+                logger.exception("Could not answer %s %s", method, target)
+                status, body, etag = 500, b'{"error": "Internal server error."}', None
+            response_headers = [f"HTTP/1.1 {status} {API_STATUS_TEXT[status]}",
+                                "Content-Type: application/json",
+                                f"Content-Length: {len(body)}",
+                                "Cache-Control: no-cache"]
+            if etag:
+                response_headers.append(f"ETag: {etag}")
+            writer.write(("\r\n".join(response_headers) + "\r\n\r\n").encode('latin-1') + body)
+            await writer.drain()
+
+            if headers.get('connection', '').lower() == 'close' or http_version == 'HTTP/1.0':
+                break
+    except (ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+def reload_changed_api_books(books):
+    """Reloads the served books whose file, settings or FX/price files changed since they were loaded."""
+    for book in books.values():
+        try:
+            if api_book_inputs(book['path']) != book['inputs']:
+                load_api_book(book)
+        except Exception as e:
+            # Keep serving the last good state until the book can be read again
+            logger.warning("Could not reload '%s': %s", book['path'], e)
+
+
+async def watch_api_books(books):
+    """Reloads served books whenever their inputs change, so requests never touch the disk."""
+    while True:
+        await asyncio.sleep(API_POLL_INTERVAL)
+        reload_changed_api_books(books)
+
+
+async def serve_books(file_paths, port=API_DEFAULT_PORT, host='127.0.0.1'):
+    """Runs the read-only JSON API for the given books on a loopback address."""
+    if not ipaddress.ip_address(host).is_loopback:
+        raise ValueError("The read API only listens on loopback addresses.")
+    books = {}
+    for file_path in file_paths:
+        book = {'id': os.path.splitext(os.path.basename(file_path))[0], 'path': os.path.abspath(file_path)}
+        load_api_book(book)
+        books[book['id']] = book
+
+    server = await asyncio.start_server(lambda reader, writer: handle_api_connection(reader, writer, books), host, port)
+    print(f"Serving {', '.join(books)} on http://{host}:{port}/books")
+    async with server:
+        await asyncio.gather(server.serve_forever(), watch_api_books(books))
+
+
+# --- Main Application Window ---
+def parse_command_line(argv):
+    parser = argparse.ArgumentParser(description="Trading Book Manager")
+    parser.add_argument('--serve', nargs='+', metavar='BOOK', help="serve the given books over a local read-only JSON API instead of opening the GUI")
+    parser.add_argument('--port', type=int, default=API_DEFAULT_PORT, help="port for --serve (loopback only)")
+    parser.add_argument('--ingest', metavar='SOURCE', help="append fills from a .jsonl/.csv file (followed as it grows) or tcp://127.0.0.1:PORT to --book instead of opening the GUI")
+    parser.add_argument('--book', help="book that --ingest writes to, or whose settings --backfill uses")
+    parser.add_argument('--backfill', nargs='+', metavar='ARCHIVE', help="stream .xlsx/.csv[.gz]/.parquet/.arrow archives (each date-sorted when several are given) "
+                                                                        "through the analytics with bounded memory instead of opening the GUI")
+    parser.add_argument('--output', help="directory --backfill writes its rollups and summary to")
+    parser.add_argument('--chunk-rows', type=int, default=STREAM_CHUNK_ROWS, help="rows --backfill reads per piece")
+    args = parser.parse_args(argv)
+    if args.ingest and not args.book:
+        parser.error("--ingest requires --book")
+    if args.backfill and not args.output:
+        parser.error("--backfill requires --output")
+    return args
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    command_line = parse_command_line(sys.argv[1:])
+    if command_line.serve:
+        try:
+            asyncio.run(serve_books(command_line.serve, command_line.port))
+        except KeyboardInterrupt:
+            pass
+        sys.exit()
+    if command_line.ingest:
+        with active_book(os.path.abspath(command_line.book)):
+            if not os.path.exists(EXCEL_FILE):
+                write_book(pd.DataFrame(columns=['Date', 'Ticker', 'Trade_Type', 'Quantity', 'Price', 'Total', 'Notes']))
+            recovery_message = recover_book()
+            if recovery_message:
+                print(recovery_message)
+            ingest_stats = {'committed': 0, 'duplicates': 0, 'rejected': 0, 'batches': 0, 'last_error': ''}
+            try:
+                asyncio.run(ingest_fills(command_line.ingest, threading.Event(), ingest_stats,
+                                         on_commit=lambda change: print(f"Committed {change['count']} fills, skipped {change['duplicates']} duplicates "
+                                                                       f"({ingest_stats['rejected']} rejected so far)")))
+            except KeyboardInterrupt:
+                pass
+        sys.exit()
+
+    if command_line.backfill:
+        with active_book(os.path.abspath(command_line.book)) if command_line.book else nullcontext():
+            try:
+                backfill = stream_book_analytics(command_line.backfill, command_line.chunk_rows,
+                                                 progress=lambda trades: print(f"Processed {trades} trades", end='\r'))
+                write_stream_analytics(backfill, command_line.output)
+            except (OSError, ValueError) as e:
+                sys.exit(f"Backfill failed: {e}")
+        print(f"Processed {backfill['trades']} trades; results written to {command_line.output}")
+        sys.exit()
+
+    # Don't call init_excel_file here directly anymore
+    root = Tk()
+    root.title("Trading Book Manager")
+    root.geometry("400x550")
+    root.resizable(False, False) # Disable resizing for a fixed layout
+
+    # Bind the close protocol for the main window
+    root.protocol("WM_DELETE_WINDOW", lambda: on_toplevel_closing(root)) # Use on_toplevel_closing for root too
+
+    # Main buttons
+    Button(root, text="Add Record", command=lambda: add_edit_form(update_callback=show_records)).pack(pady=10, fill='x', padx=50)
+    Button(root, text="Show Records", command=show_records).pack(pady=10, fill='x', padx=50)
+    Button(root, text="Show Portfolio Summary", command=show_portfolio_summary).pack(pady=10, fill='x', padx=50)
+    Button(root, text="Undo Last Action", command=undo_last_action).pack(pady=10, fill='x', padx=50)
+    Button(root, text="Redo Last Undo", command=redo_last_undo).pack(pady=10, fill='x', padx=50)
+    Button(root, text="Export Summary to PDF", command=lambda: export_summary_pdf()).pack(pady=10, fill='x', padx=50)
+    Button(root, text="Ingest Fills", command=open_ingest_window).pack(pady=10, fill='x', padx=50)
+    Button(root, text="What-If Simulation", command=open_simulation_window).pack(pady=10, fill='x', padx=50)
+    Button(root, text="Settings", command=open_settings_window).pack(pady=10, fill='x', padx=50)
+
+    # Add an Exit button
+    Button(root, text="Exit", command=lambda: on_toplevel_closing(root), bg="red", fg="white").pack(pady=20, fill='x', padx=50)
+
+    # Show the book selection window first
+    show_book_selection_window()
+
+    # Start the Tkinter event loop only after a book is selected/created
+    root.mainloop()
+
+    # Let a running ingestion write the fills it has already read
+    stop_ingestion()
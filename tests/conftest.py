@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import run  # noqa: E402
+
+
+def make_trades(rows):
+    """Builds a book frame from (date, ticker, trade type, quantity, price) tuples."""
+    df = pd.DataFrame(rows, columns=['Date', 'Ticker', 'Trade_Type', 'Quantity', 'Price'])
+    df['Date'] = pd.to_datetime(df['Date'])
+    df['Total'] = df['Quantity'] * df['Price']
+    df['Notes'] = ''
+    return df[run.BOOK_COLUMNS]
+
+
+@pytest.fixture
+def book_path(tmp_path):
+    """A small book on disk, active for the duration of the test."""
+    path = str(tmp_path / 'book.xlsx')
+    with run.active_book(path):
+        run.write_book(make_trades([
+            ('2024-01-02', 'BTC/USDT', 'Buy', 1.0, 40000.0),
+            ('2024-01-05', 'ETH/USDT', 'Buy', 10.0, 2000.0),
+            ('2024-02-01', 'BTC/USDT', 'Sell', 0.5, 45000.0),
+            ('2024-03-01', 'ETH/USDT', 'Sell', 4.0, 2500.0),
+        ]))
+        yield path
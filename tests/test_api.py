@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+import run
+
+
+def serve(path):
+    book = {'id': 'book', 'path': path}
+    run.load_api_book(book)
+    return {'book': book}
+
+
+def get(books, target, if_none_match=None):
+    status, body, etag = run.api_response(books, 'GET', target, if_none_match)
+    return status, (json.loads(body) if body else None), etag
+
+
+def test_resources(book_path):
+    books = serve(book_path)
+    status, payload, _ = get(books, '/books')
+    assert status == 200 and payload == [{'id': 'book', 'version': 1, 'trades': 4}]
+
+    status, payload, _ = get(books, '/books/book/holdings')
+    assert status == 200
+    assert payload['holdings']['BTC/USDT']['quantity'] == 0.5
+    assert payload['holdings']['ETH/USDT']['quantity'] == 6.0
+
+    status, payload, _ = get(books, '/books/book/realized_pnl')
+    assert payload['realized_pnl']['BTC/USDT'] == 2500.0
+
+    status, payload, _ = get(books, '/books/book/trades?ticker=ETH/USDT&page_size=1')
+    assert payload['total'] == 2 and len(payload['trades']) == 1 and payload['trades'][0]['Index'] == 1
+
+
+def test_errors(book_path):
+    books = serve(book_path)
+    assert run.api_response(books, 'POST', '/books/book')[0] == 405
+    assert get(books, '/books/other')[0] == 404
+    assert get(books, '/books/book/unknown')[0] == 404
+    assert get(books, '/books/book/metrics?period=Weekly')[0] == 400
+
+
+def test_etag_revalidation(book_path):
+    books = serve(book_path)
+    status, _, etag = get(books, '/books/book/holdings')
+    assert status == 200 and etag
+    assert get(books, '/books/book/holdings', etag)[0] == 304
+    assert get(books, '/books/book/metrics', etag)[0] == 200
+
+
+def test_etag_survives_restart_of_unchanged_book(book_path):
+    _, _, etag = get(serve(book_path), '/books/book/holdings')
+    assert get(serve(book_path), '/books/book/holdings', etag)[0] == 304
+
+
+def test_etag_changes_with_book_across_restart(book_path):
+    _, _, etag = get(serve(book_path), '/books/book/holdings')
+
+    with run.active_book(book_path):
+        df = run.load_data()
+        run.write_book(df.iloc[:3])
+    restarted = serve(book_path) # Its version counter starts at 1 again
+    assert restarted['book']['version'] == 1
+    status, payload, new_etag = get(restarted, '/books/book/holdings', etag)
+    assert status == 200 and new_etag != etag
+    assert payload['holdings']['ETH/USDT']['quantity'] == 10.0
+
+
+def test_etag_changes_with_settings(book_path):
+    _, _, etag = get(serve(book_path), '/books/book/holdings')
+    with run.active_book(book_path):
+        run.book_settings['cost_basis_method'] = 'LIFO'
+        run.save_book_settings()
+    assert get(serve(book_path), '/books/book/holdings', etag)[0] == 200
+
+
+def test_watcher_reloads_on_settings_change(book_path):
+    with run.active_book(book_path):
+        run.add_record('2024-01-03', 'BTC/USDT', 'Buy', 1.0, 50000.0, '') # Two lots, so FIFO and LIFO differ
+    books = serve(book_path)
+    _, payload, etag = get(books, '/books/book/holdings')
+    fifo_price = payload['holdings']['BTC/USDT']['average_buy_price']
+
+    run.reload_changed_api_books(books)
+    assert books['book']['version'] == 1 # Nothing changed yet
+    with run.active_book(book_path):
+        run.book_settings['cost_basis_method'] = 'LIFO'
+        run.save_book_settings()
+    run.reload_changed_api_books(books)
+
+    status, payload, new_etag = get(books, '/books/book/holdings', etag)
+    assert status == 200 and new_etag != etag
+    assert payload['holdings']['BTC/USDT']['average_buy_price'] < fifo_price
+    restarted = get(serve(book_path), '/books/book/holdings')[1]
+    assert dict(payload, version=None) == dict(restarted, version=None)
+
+
+def test_watcher_reloads_on_fx_file_change(book_path, tmp_path):
+    rates = tmp_path / 'fx.csv'
+    rates.write_text('ticker,timestamp,price\nUSDT/EUR,2024-01-01,0.9\n')
+    with run.active_book(book_path):
+        run.book_settings.update(reporting_currency='EUR', fx_rates_file=str(rates))
+        run.save_book_settings()
+    books = serve(book_path)
+    _, payload, etag = get(books, '/books/book/realized_pnl')
+    assert payload['realized_pnl']['BTC/USDT'] == pytest.approx(2250.0)
+
+    rates.write_text('ticker,timestamp,price\nUSDT/EUR,2024-01-01,0.5\n')
+    os.utime(rates, ns=(0, 10 ** 18)) # A different mtime even on coarse file systems
+    run.reload_changed_api_books(books)
+    status, payload, new_etag = get(books, '/books/book/realized_pnl', etag)
+    assert status == 200 and new_etag != etag
+    assert payload['realized_pnl']['BTC/USDT'] == pytest.approx(1250.0)
+
+
+def test_period_etag_changes_with_the_day(book_path, monkeypatch):
+    books = serve(book_path)
+    _, _, etag = get(books, '/books/book/metrics?period=YTD')
+    assert get(books, '/books/book/metrics?period=YTD', etag)[0] == 304
+    assert get(books, '/books/book/metrics', etag)[0] == 200
+
+    class Tomorrow(run.date):
+        @classmethod
+        def today(cls):
+            return run.date.fromordinal(super().today().toordinal() + 1)
+
+    monkeypatch.setattr(run, 'date', Tomorrow)
+    assert get(books, '/books/book/metrics?period=YTD', etag)[0] == 200
+
+
+def exchange(books, target):
+    """Sends one GET over a real socket and returns the raw response."""
+    async def request():
+        server = await asyncio.start_server(lambda reader, writer: run.handle_api_connection(reader, writer, books),
+                                            '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(f'GET {target} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n'.encode())
+            response = await reader.read()
+            writer.close()
+            return response
+
+    return asyncio.run(request())
+
+
+def test_http_connection(book_path):
+    books = serve(book_path)
+    head, _, body = exchange(books, '/books/book').partition(b'\r\n\r\n')
+    assert head.startswith(b'HTTP/1.1 200 OK')
+    assert b'ETag: "' in head
+    assert json.loads(body)['trades'] == 4
+    assert os.path.samefile(json.loads(body)['path'], book_path)
+
+
+def test_unexpected_error_is_answered_with_500(book_path, monkeypatch):
+    books = serve(book_path)
+
+    def broken(*args):
+        raise RuntimeError("corrupt book")
+
+    monkeypatch.setattr(run, 'calculate_performance_metrics', broken)
+    head, _, body = exchange(books, '/books/book/metrics?period=MTD').partition(b'\r\n\r\n')
+    assert head.startswith(b'HTTP/1.1 500 Internal Server Error')
+    assert json.loads(body) == {'error': 'Internal server error.'}
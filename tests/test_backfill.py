@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import run
+from conftest import make_trades
+
+
+def write_sources(tmp_path, sources):
+    paths = []
+    for index, rows in enumerate(sources):
+        path = str(tmp_path / f'account{index}.csv.gz')
+        make_trades(rows).to_csv(path, index=False)
+        paths.append(path)
+    return paths
+
+
+def in_memory(sources):
+    """The book the sources make when concatenated in order and stably sorted, as the stream promises."""
+    frames = [make_trades(rows) for rows in sources]
+    return pd.concat(frames, ignore_index=True).sort_values(by='Date', kind='mergesort', ignore_index=True)
+
+
+def assert_matches_in_memory(result, df):
+    expected = run.get_rollups(run.prepare_trades(df))
+    for key in ('daily', 'monthly'):
+        streamed = result['rollups'][key].sort_values(['Period', 'Ticker'], ignore_index=True)
+        built = expected[key].sort_values(['Period', 'Ticker'], ignore_index=True)
+        assert streamed[['Period', 'Ticker']].equals(built[['Period', 'Ticker']]), key
+        assert np.allclose(streamed[run.ROLLUP_VALUES].to_numpy(float), built[run.ROLLUP_VALUES].to_numpy(float)), key
+
+    holdings = run.get_current_holdings(df)
+    assert result['holdings'].keys() == holdings.keys()
+    for ticker, holding in holdings.items():
+        assert result['holdings'][ticker]['quantity'] == pytest.approx(holding['quantity'])
+        assert result['holdings'][ticker]['average_buy_price'] == pytest.approx(holding['average_buy_price'])
+    assert result['trades'] == len(df)
+
+
+def test_exhausted_source_waits_for_same_day_trades_of_earlier_sources(tmp_path):
+    # The second account runs out first; its sell must still follow the first account's buy on the same day
+    sources = [
+        [('2024-01-01', 'BTC/USDT', 'Buy', 1.0, 10.0), ('2024-01-02', 'BTC/USDT', 'Buy', 0.5, 20.0),
+         ('2024-01-02', 'BTC/USDT', 'Buy', 0.5, 20.0), ('2024-01-03', 'ETH/USDT', 'Buy', 1.0, 5.0)],
+        [('2024-01-02', 'BTC/USDT', 'Sell', 2.0, 30.0)],
+    ]
+    result = run.stream_book_analytics(write_sources(tmp_path, sources), chunk_rows=1)
+    assert result['realized_pnl']['BTC/USDT'] == 30.0
+    assert_matches_in_memory(result, in_memory(sources))
+
+
+@pytest.mark.parametrize('method', ['FIFO', 'LIFO', 'HIFO', 'Average'])
+def test_stream_matches_in_memory_analytics(tmp_path, monkeypatch, method):
+    monkeypatch.setitem(run.book_settings, 'cost_basis_method', method)
+    rng = np.random.default_rng(4)
+    sources = []
+    for size in (60, 25, 8): # Few distinct days, so every source has ties with the others
+        days = np.sort(rng.integers(0, 12, size))
+        sources.append([(pd.Timestamp('2024-01-01') + pd.Timedelta(days=int(day)), str(rng.choice(['A/USDT', 'B/USDT'])),
+                         str(rng.choice(['Buy', 'Buy', 'Sell'])), float(rng.integers(1, 5)), float(rng.integers(1, 100)))
+                        for day in days])
+    result = run.stream_book_analytics(write_sources(tmp_path, sources), chunk_rows=4)
+    assert_matches_in_memory(result, in_memory(sources))
+
+
+def test_single_unsorted_source_is_sorted_in_memory(tmp_path):
+    # The first chunk is in order, so the stream has already used it when the second goes backwards
+    rows = [('2024-01-01', 'BTC/USDT', 'Buy', 1.0, 10.0), ('2024-01-03', 'BTC/USDT', 'Sell', 1.0, 30.0),
+            ('2024-01-02', 'BTC/USDT', 'Buy', 1.0, 20.0), ('2024-01-01', 'ETH/USDT', 'Buy', 1.0, 5.0)]
+    result = run.stream_book_analytics(write_sources(tmp_path, [rows]), chunk_rows=2)
+    assert result['realized_pnl']['BTC/USDT'] == 20.0
+    assert_matches_in_memory(result, in_memory([rows]))
+
+
+def test_unsorted_source_among_several_is_rejected(tmp_path):
+    sources = [[('2024-01-02', 'BTC/USDT', 'Buy', 1.0, 10.0), ('2024-01-01', 'BTC/USDT', 'Buy', 1.0, 20.0)],
+               [('2024-01-01', 'ETH/USDT', 'Buy', 1.0, 5.0)]]
+    with pytest.raises(ValueError, match="account0.csv.gz' is not sorted by date.*sort its rows by Date"):
+        run.stream_book_analytics(write_sources(tmp_path, sources))
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl.utils.datetime import MAC_EPOCH, from_excel
+
+import run
+
+
+def sub_second_book(rows=2000, seed=7):
+    """Trades at random millisecond timestamps, with numeric and empty Notes and a few empty cells."""
+    rng = np.random.default_rng(seed)
+    dates = (pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 400 * 86400000, rows), unit='ms')).tolist()
+    dates[0] = pd.Timestamp('2024-02-03 23:59:59.500')
+    dates[1] = pd.Timestamp('2024-02-03 23:59:59.999')
+    df = pd.DataFrame({
+        'Date': dates,
+        'Ticker': rng.choice(['BTC/USDT', 'ETH/USDT', 'BRK-B'], rows),
+        'Trade_Type': rng.choice(['Buy', 'Sell'], rows),
+        'Quantity': rng.random(rows).round(6),
+        'Price': (rng.random(rows) * 1000).round(2),
+    })
+    df['Total'] = df['Quantity'] * df['Price']
+    notes = np.array(['', 'hedge', 42, 3.5, None, '007'], dtype=object)
+    df['Notes'] = notes[rng.integers(0, len(notes), rows)]
+    df.loc[5, 'Quantity'] = np.nan
+    df.loc[6, 'Price'] = np.nan
+    df.loc[7, 'Total'] = np.nan
+    return df
+
+
+def test_excel_serials_match_openpyxl():
+    serials = np.array([45325.999994212965, 1.5, 59.25, 60.75, 61.0, 45000.123456789])
+    expected = [from_excel(serial) for serial in serials]
+    assert run.excel_serials_to_datetimes(serials).tolist() == expected
+    assert run.excel_serials_to_datetimes(serials, date1904=True).tolist() == [from_excel(serial, MAC_EPOCH) for serial in serials]
+    assert np.isnat(run.excel_serials_to_datetimes(np.array([np.nan]))[0])
+
+
+@pytest.mark.parametrize('writer', ['to_excel', 'write_book'])
+def test_parsed_book_matches_read_excel(tmp_path, writer):
+    path = str(tmp_path / 'book.xlsx')
+    df = sub_second_book()
+    if writer == 'to_excel':
+        df.to_excel(path, index=False)
+    else:
+        with run.active_book(path):
+            run.write_book(df)
+
+    with open(path, 'rb') as f:
+        parsed = run.parse_book_bytes(f.read())
+    expected = pd.read_excel(path)
+    pd.testing.assert_frame_equal(parsed, expected, check_dtype=False)
+    assert (parsed['Date'] == expected['Date']).all()
+    assert parsed['Date'].iloc[0] == pd.Timestamp('2024-02-03 23:59:59.500')
+
+
+def test_book_round_trips_millisecond_dates(tmp_path):
+    path = str(tmp_path / 'book.xlsx')
+    df = run.sort_book(sub_second_book().dropna(subset=['Quantity', 'Price']))
+    with run.active_book(path):
+        run.write_book(df)
+        run.book_cache.clear()
+        read_back = run.read_book(path)
+    assert (read_back['Date'].to_numpy() == df['Date'].to_numpy()).all()
+    assert (run.trade_identity_hashes(read_back) == run.trade_identity_hashes(df)).all()
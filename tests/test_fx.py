@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+import run
+
+
+@pytest.mark.parametrize('ticker, expected', [
+    ('CAKE/USDT', ('CAKE', 'USDT')),
+    ('btcusdt', ('BTC', 'USDT')),
+    ('ETH-USD', ('ETH', 'USD')),
+    ('SOL_EUR', ('SOL', 'EUR')),
+    ('ETH_BTC', ('ETH', 'BTC')),
+    ('BRK-B', ('BRK-B', None)),
+    ('BF_A', ('BF_A', None)),
+    ('BRK-B/USD', ('BRK-B', 'USD')),
+    ('AAPL', ('AAPL', None)),
+])
+def test_parse_ticker_splits_only_before_known_quote_assets(ticker, expected):
+    assert run.parse_ticker(ticker) == expected
+
+
+def test_quote_assets_for_keeps_dashed_symbols_unquoted():
+    quotes = run.quote_assets_for(['BRK-B', 'ETH-USD', 'BTCUSDT'])
+    assert pd.isna(quotes[0]) and list(quotes[1:]) == ['USD', 'USDT']
+
+
+def test_unconvertible_quote_assets_are_flagged_and_logged_once(tmp_path, monkeypatch, caplog):
+    from conftest import make_trades
+    path = str(tmp_path / 'book.xlsx')
+    monkeypatch.setattr(run, 'unconvertible_logged', set())
+    with run.active_book(path):
+        run.write_book(make_trades([
+            ('2024-01-02', 'BTC/USDT', 'Buy', 1.0, 40000.0),
+            ('2024-01-03', 'BTC/IRT', 'Buy', 1.0, 2.0e9),
+        ]))
+        run.book_settings.update(reporting_currency='USDT')
+        run.save_book_settings()
+        assert run.unconvertible_quote_assets(['BTC/USDT', 'BTC/IRT']) == ['IRT']
+        assert 'IRT' in run.unconverted_note(['BTC/IRT'])
+        assert run.unconverted_note(['BTC/USDT']) == ''
+
+        with caplog.at_level('WARNING', logger=run.logger.name):
+            run.conversion_rates(['IRT', 'USDT'], pd.to_datetime(['2024-01-03', '2024-01-03']))
+            run.conversion_rates(['IRT'], pd.to_datetime(['2024-01-04']))
+        assert sum('IRT' in record.getMessage() for record in caplog.records) == 1
+
+    book = {'id': 'book', 'path': path}
+    run.load_api_book(book)
+    for resource in ('holdings', 'realized_pnl', 'metrics'):
+        assert run.api_book_payload(book, resource, {})['unconverted_quote_assets'] == ['IRT']
@@ -0,0 +1,29 @@
+import asyncio
+import threading
+
+import run
+
+
+def ingest(path):
+    stop = threading.Event()
+    stats = {'committed': 0, 'duplicates': 0, 'rejected': 0, 'batches': 0, 'last_error': ''}
+
+    async def run_until_idle():
+        task = asyncio.create_task(run.ingest_fills(str(path), stop, stats))
+        while stats['committed'] + stats['rejected'] < 3 and not task.done():
+            await asyncio.sleep(0.05)
+        stop.set()
+        await task
+
+    asyncio.run(asyncio.wait_for(run_until_idle(), 30))
+    return stats
+
+
+def test_line_that_is_not_utf8_is_rejected_and_skipped(book_path, tmp_path):
+    fills = tmp_path / 'fills.jsonl'
+    fills.write_bytes(b'{"date": "2024-04-01", "ticker": "SOL/USDT", "type": "Buy", "quantity": 1, "price": 100}\n'
+                      b'{"date": "2024-04-01", "ticker": "\xff\xfe", "type": "Buy", "quantity": 1, "price": 100}\n'
+                      b'{"date": "2024-04-02", "ticker": "SOL/USDT", "type": "Sell", "quantity": 1, "price": 120}\n')
+    stats = ingest(fills)
+    assert stats['committed'] == 2 and stats['rejected'] == 1
+    assert len(run.load_data()) == 6
@@ -0,0 +1,137 @@
+import os
+import types
+
+import pandas as pd
+import pytest
+
+import run
+from conftest import make_trades
+
+
+@pytest.fixture(autouse=True)
+def quiet_dialogs(monkeypatch):
+    shown = []
+    monkeypatch.setattr(run, 'messagebox', types.SimpleNamespace(
+        showinfo=lambda *a: shown.append(a), showwarning=lambda *a: shown.append(a),
+        showerror=lambda *a: shown.append(('error',) + a), askyesno=lambda *a: True))
+    return shown
+
+
+def restart():
+    """Forgets everything this process remembered about books, as a new session would."""
+    for cache in (run.book_cache, run.parsed_book_cache, run.operation_log_cache, run.lot_state_cache):
+        cache.clear()
+
+
+def digest():
+    return run.book_digest(run.load_data())
+
+
+def test_undo_and_redo_survive_restart(book_path):
+    original = digest()
+    run.add_record('2024-01-03', 'SOL/USDT', 'Buy', 5.0, 100.0, 'new')
+    run.edit_record(0, '2024-01-02', 'BTC/USDT', 'Buy', 2.0, 40000.0, 'edited')
+    run.delete_record(3)
+    changed = digest()
+
+    restart()
+    for _ in range(3):
+        assert run.step_operation('undo')
+    assert digest() == original
+    assert not run.step_operation('undo') # Nothing left to undo
+
+    restart()
+    for _ in range(3):
+        assert run.step_operation('redo')
+    assert digest() == changed
+
+
+def test_operation_records_only_the_changed_rows(book_path):
+    run.add_record('2024-01-03', 'SOL/USDT', 'Buy', 5.0, 100.0, '')
+    record = run.read_operation_log()[-1]
+    assert record['kind'] == 'op' and record['start'] == 1
+    assert record['removed'] == [] and len(record['inserted']) == 1
+
+
+def test_sub_second_trades_keep_the_log_across_restart(book_path):
+    df = run.load_data()
+    run.store_book(pd.concat([df, make_trades([('2024-02-03 23:59:59.500', 'BTC/USDT', 'Buy', 1.0, 1.0),
+                                               ('2024-02-04 12:00:00.123456', 'BTC/USDT', 'Buy', 1.0, 1.0)])]))
+    restart()
+    assert run.recover_book() is None
+    assert len(run.read_operation_log()) == 1
+    assert run.step_operation('undo')
+    assert digest() == run.book_digest(df)
+
+
+def test_change_logged_but_not_written_is_replayed(book_path, monkeypatch, quiet_dialogs):
+    before = run.load_data()
+
+    replace_file = run.replace_file
+
+    def crash_before_book_is_replaced(source_path, target_path):
+        if os.path.samefile(os.path.dirname(target_path), os.path.dirname(book_path)) and target_path.endswith('book.xlsx'):
+            raise SystemExit("crash")
+        replace_file(source_path, target_path)
+
+    monkeypatch.setattr(run, 'replace_file', crash_before_book_is_replaced)
+    with pytest.raises(SystemExit):
+        run.add_record('2024-01-03', 'SOL/USDT', 'Buy', 5.0, 100.0, 'crash')
+    monkeypatch.setattr(run, 'replace_file', replace_file)
+
+    restart()
+    assert run.book_digest(run.load_data()) == run.book_digest(before)
+    assert "recovered" in run.recover_book()
+    assert (run.load_data()['Notes'] == 'crash').sum() == 1
+    assert run.recover_book() is None
+    assert run.step_operation('undo')
+    assert digest() == run.book_digest(before)
+
+
+def test_torn_record_is_truncated(book_path):
+    run.add_record('2024-01-03', 'SOL/USDT', 'Buy', 5.0, 100.0, '')
+    size = os.path.getsize(run.operation_log_path())
+    with open(run.operation_log_path(), 'ab') as f:
+        f.write(b'0badc0de {"seq": 2, "kind"')
+    restart()
+    with run.book_write_lock():
+        assert len(run.read_operation_log()) == 1
+    assert os.path.getsize(run.operation_log_path()) == size
+
+
+def test_external_change_keeps_the_log_aside(book_path):
+    run.add_record('2024-01-03', 'SOL/USDT', 'Buy', 5.0, 100.0, '')
+    run.write_book(run.load_data().iloc[:2]) # Edited outside the app
+    restart()
+    message = run.recover_book()
+    assert "changed outside the app" in message
+    assert not os.path.exists(run.operation_log_path())
+    kept = [name for name in os.listdir(os.path.dirname(book_path)) if name.endswith('.oplog.jsonl')]
+    assert len(kept) == 1 and kept[0] in message
+
+
+def test_compaction_keeps_undo_and_redo_history(book_path, monkeypatch):
+    monkeypatch.setattr(run, 'OPLOG_MAX_BYTES', 1)
+    for quantity in range(1, 6):
+        run.add_record('2024-01-03', 'SOL/USDT', 'Buy', float(quantity), 100.0, '')
+    run.step_operation('undo')
+    run.step_operation('undo')
+    undo, redo = run.operation_history(run.read_operation_log())
+    assert (len(undo), len(redo)) == (3, 2)
+    assert len(run.read_operation_log()) == 7 # Five operations and two undo records, nothing else
+
+    restart()
+    assert run.recover_book() is None
+    assert run.step_operation('redo') and run.step_operation('redo')
+    assert (run.load_data()['Ticker'] == 'SOL/USDT').sum() == 5
+
+
+def test_undo_dialogs_are_shown_without_the_book_lock(book_path, monkeypatch):
+    depths = []
+    record = lambda *a: depths.append(run.book_lock_depth)
+    monkeypatch.setattr(run, 'messagebox', types.SimpleNamespace(showinfo=record, showerror=record, showwarning=record))
+    assert not run.step_operation('redo') # Nothing to redo
+    run.add_record('2024-01-03', 'SOL/USDT', 'Buy', 5.0, 100.0, 'new')
+    run.write_book(run.load_data().iloc[:2]) # An outside change, so the undo fails
+    assert not run.step_operation('undo')
+    assert depths == [0, 0]
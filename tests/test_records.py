@@ -0,0 +1,124 @@
+import contextlib
+import types
+
+import pytest
+
+import run
+
+
+@pytest.fixture
+def prompts(monkeypatch):
+    """Records the lock depth at each duplicate prompt and answers from a list (default: decline)."""
+    asked = []
+    answers = []
+
+    def askyesno(title, message):
+        asked.append(run.book_lock_depth)
+        return answers.pop(0) if answers else False
+
+    monkeypatch.setattr(run, 'messagebox', types.SimpleNamespace(
+        askyesno=askyesno, showerror=lambda *a: pytest.fail(a), showinfo=lambda *a: None))
+    return asked, answers
+
+
+def trades():
+    return len(run.load_data())
+
+
+def test_duplicate_prompt_does_not_hold_the_book_lock(book_path, prompts):
+    asked, answers = prompts
+    assert not run.add_record('2024-01-02', 'BTC/USDT', 'Buy', 1.0, 40000.0, '')
+    answers.append(True)
+    assert run.add_record('2024-01-02', 'BTC/USDT', 'Buy', 1.0, 40000.0, 'again')
+    assert asked == [0, 0]
+    assert trades() == 5
+
+
+def test_duplicate_written_while_unlocked_is_asked_about(book_path, prompts, monkeypatch):
+    asked, _ = prompts
+    book_write_lock = run.book_write_lock
+    raced = []
+
+    @contextlib.contextmanager
+    def racing_lock(*args, **kwargs):
+        if not raced: # Another writer adds the same trade between the duplicate check and the lock
+            raced.append(True)
+            assert run.add_record('2024-01-05', 'SOL/USDT', 'Buy', 5.0, 100.0, 'other writer')
+        with book_write_lock(*args, **kwargs):
+            yield
+
+    monkeypatch.setattr(run, 'book_write_lock', racing_lock)
+    assert not run.add_record('2024-01-05', 'SOL/USDT', 'Buy', 5.0, 100.0, '')
+    assert asked == [0]
+    assert trades() == 5
+
+
+def test_row_ids_follow_trades_across_inserts(book_path, prompts):
+    ids = run.book_row_ids(run.load_data())
+    assert len(set(ids)) == len(ids)
+    sell_id = ids[2] # The BTC sell on 2024-02-01
+
+    assert run.add_record('2024-01-03', 'SOL/USDT', 'Buy', 5.0, 100.0, '')
+    book = run.load_data()
+    assert run.record_position(book, 2, sell_id) == 3
+    assert book.iloc[3]['Trade_Type'] == 'Sell' and book.iloc[3]['Ticker'] == 'BTC/USDT'
+
+
+def test_identical_trades_get_distinct_ids(book_path, prompts):
+    _, answers = prompts
+    answers.append(True)
+    assert run.add_record('2024-01-02', 'BTC/USDT', 'Buy', 1.0, 40000.0, '')
+    ids = run.book_row_ids(run.load_data())
+    assert ids[0] != ids[1] and ids[0].split('-')[0] == ids[1].split('-')[0]
+
+
+def test_edit_and_delete_by_id_act_on_the_selected_trade(book_path, prompts):
+    ids = run.book_row_ids(run.load_data())
+    eth_buy, eth_sell = ids[1], ids[3]
+    assert run.add_record('2024-01-01', 'SOL/USDT', 'Buy', 5.0, 100.0, '') # Shifts every position by one
+
+    assert run.edit_record(1, '2024-01-05', 'ETH/USDT', 'Buy', 12.0, 2000.0, 'edited', row_id=eth_buy)
+    book = run.load_data()
+    assert book.loc[book['Notes'] == 'edited', 'Quantity'].tolist() == [12.0]
+    assert book.iloc[1]['Ticker'] == 'BTC/USDT' # The trade now at the old position is untouched
+
+    assert run.delete_record(3, row_id=eth_sell)
+    book = run.load_data()
+    assert len(book) == 4 and not ((book['Ticker'] == 'ETH/USDT') & (book['Trade_Type'] == 'Sell')).any()
+
+
+def test_edit_of_a_removed_trade_is_refused(book_path, prompts, monkeypatch):
+    errors = []
+    monkeypatch.setattr(run.messagebox, 'showerror', lambda *a: errors.append(a))
+    gone = run.book_row_ids(run.load_data())[0]
+    assert run.delete_record(0)
+    assert not run.edit_record(0, '2024-01-02', 'BTC/USDT', 'Buy', 2.0, 40000.0, '', row_id=gone)
+    assert errors and trades() == 3
+
+
+def test_edit_and_delete_errors_are_shown_without_the_book_lock(book_path, monkeypatch):
+    depths = []
+    monkeypatch.setattr(run, 'messagebox', types.SimpleNamespace(showerror=lambda *a: depths.append(run.book_lock_depth)))
+    assert not run.edit_record(9, '2024-01-02', 'BTC/USDT', 'Buy', 2.0, 40000.0, '')
+    assert not run.delete_record(9)
+    assert not run.delete_record(0, row_id='gone-0')
+
+    def failing_store(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(run, 'store_book', failing_store)
+    assert not run.edit_record(0, '2024-01-02', 'BTC/USDT', 'Buy', 2.0, 40000.0, '')
+    assert depths == [0, 0, 0, 0]
+    assert trades() == 4
+
+
+def test_add_errors_are_shown_without_the_book_lock(book_path, monkeypatch):
+    depths = []
+    monkeypatch.setattr(run, 'messagebox', types.SimpleNamespace(showerror=lambda *a: depths.append(run.book_lock_depth)))
+
+    def failing_store(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(run, 'store_book', failing_store)
+    assert not run.add_record('2024-01-05', 'SOL/USDT', 'Buy', 5.0, 100.0, '')
+    assert depths == [0]
@@ -0,0 +1,11 @@
+import run
+
+
+def test_round_trips_with_reporting_currency(book_path, tmp_path):
+    rates = tmp_path / 'fx.csv'
+    rates.write_text('ticker,timestamp,price\nUSDT/EUR,2024-01-01,0.5\n')
+    with run.active_book(book_path):
+        run.book_settings.update(reporting_currency='EUR', fx_rates_file=str(rates))
+        df = run.load_data()
+        for _ in range(2): # Built, then served from the cache
+            assert sorted(run.get_round_trips(df)['PnL']) == [1000.0, 1250.0]
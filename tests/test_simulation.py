@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import run
+from test_api import get, serve
+
+
+def test_scenario_prices_are_bounded():
+    assert list(run.parse_scenario_prices('90:110:3')) == [90.0, 100.0, 110.0]
+    assert list(run.parse_scenario_prices('95, 100')) == [95.0, 100.0]
+    with pytest.raises(ValueError):
+        run.parse_scenario_prices(f'0:1:{run.SIMULATION_MAX_SCENARIOS + 1}')
+    with pytest.raises(ValueError):
+        run.parse_scenario_prices(','.join(['1'] * (run.SIMULATION_MAX_SCENARIOS + 1)))
+
+
+def test_simulated_trades_are_parsed_and_bounded():
+    trades = run.parse_simulated_trades('BTC/USDT, sell, 0.5, 50000\nETH/USDT,Buy,1,3000')
+    assert trades.to_dict('list') == {'Ticker': ['BTC/USDT', 'ETH/USDT'], 'Trade_Type': ['Sell', 'Buy'],
+                                      'Quantity': [0.5, 1.0], 'Price': [50000.0, 3000.0]}
+    for text in ('', 'BTC/USDT, Hold, 1, 1', 'BTC/USDT, Buy, -1, 1', 'BTC/USDT, Buy, 1'):
+        with pytest.raises(ValueError):
+            run.parse_simulated_trades(text)
+    with pytest.raises(ValueError):
+        run.parse_simulated_trades(';'.join(['BTC/USDT,Buy,1,1'] * (run.SIMULATION_MAX_TRADES + 1)))
+
+
+def test_simulate_trades_leaves_the_book_alone(book_path):
+    before = run.load_data().copy()
+    result = run.simulate_trades(before, run.parse_simulated_trades(
+        'BTC/USDT,Sell,0.5,50000; SOL/USDT,Buy,2,100; ETH/USDT,Sell,6,3000'))
+    assert list(result['trades']['PnL']) == [5000.0, 0.0, 6000.0]
+    assert result['realized_pnl'] == 11000.0
+    assert 'BTC/USDT' not in result['holdings'] and 'ETH/USDT' not in result['holdings']
+    assert result['holdings']['SOL/USDT'] == {'quantity': 2.0, 'average_buy_price': 100.0}
+    assert run.load_data().equals(before)
+    assert run.get_current_holdings(before)['BTC/USDT']['quantity'] == 0.5
+
+
+def test_simulation_resource(book_path):
+    books = serve(book_path)
+    status, payload, _ = get(books, '/books/book/simulation?trades=BTC/USDT,Sell,0.25,50000;BTC/USDT,Sell,0.25,30000')
+    assert status == 200
+    assert [trade['realized_pnl'] for trade in payload['trades']] == [2500.0, -2500.0]
+    assert payload['realized_pnl'] == 0.0 and payload['holdings'] == {}
+
+    status, payload, _ = get(books, '/books/book/simulation?ticker=BTC/USDT&prices=40000:50000:3')
+    assert status == 200
+    assert np.allclose([s['realized_pnl'] for s in payload['scenarios']], [0.0, 2500.0, 5000.0])
+
+    assert get(books, '/books/book/simulation?ticker=BTC/USDT&prices=0:1:1000000000')[0] == 400
+    assert get(books, '/books/book/simulation?trades=BTC/USDT,Hold,1,1')[0] == 400
+    assert get(books, '/books/book/simulation')[0] == 400